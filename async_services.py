@@ -0,0 +1,264 @@
+# async_services.py
+# Asyncio versions of the Groq, Gemini and Tavily clients and the chat / profile
+# database helpers, on one shared httpx.AsyncClient and SQLAlchemy async engine
+# per event loop. A call waiting on the network is a suspended coroutine, not a
+# thread or a process, so thousands can be in flight; ASYNC_MAX_CONNECTIONS caps
+# the sockets actually open and the "async" pool profile caps DB connections.
+# Streamlit scripts are synchronous: run() hands a coroutine to one background
+# event loop and blocks the calling thread for the result, spawn() returns a
+# concurrent.futures.Future instead.
+#   reply, articles = run(chat_with_articles(messages, question), timeout=30)
+#   med_links, buy_links = run(medicine_lookup(["Paracetamol", "Amoxicillin"]))
+# In-flight benchmark against the local API stand-ins:
+#   python async_services.py --bench 5000 --latency-ms 500
+import os
+import sys
+import time
+import asyncio
+import argparse
+import threading
+import weakref
+import httpx
+from dotenv import load_dotenv
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from db import DATABASE_URL, DATABASE_READ_URL, User, Conversation, engine_options
+from model_router import MODELS, route, record, log_decision
+from cli_groq_chat import (GROQ_API_URL, ATTEMPT_TIMEOUT, REFUSAL_MESSAGE, should_refuse,
+                           groq_request, completion_result)
+from cli_gemini_prescription import GEMINI_API_URL, GEMINI_TIMEOUT, prescription_request, prescription_output
+from tavily_api import TAVILY_API_URL, tavily_headers, search_payload, medicine_query, pick_buy_link
+from drug_store import get_drug, has_reference
+from search import index_conversation
+import traffic
+
+load_dotenv()
+ASYNC_MAX_CONNECTIONS = int(os.getenv("ASYNC_MAX_CONNECTIONS", 100))
+ASYNC_MAX_KEEPALIVE = int(os.getenv("ASYNC_MAX_KEEPALIVE", 20))
+ASYNC_DRIVERS = {"mysql": "aiomysql", "sqlite": "aiosqlite", "postgresql": "asyncpg"}
+
+def async_url(url):
+    parsed = make_url(url)
+    return parsed.set(drivername=f"{parsed.get_backend_name()}+{ASYNC_DRIVERS[parsed.get_backend_name()]}")
+
+def _async_engine(url):
+    options = {} if make_url(url).get_backend_name() == "sqlite" else engine_options(url, "async")
+    return create_async_engine(async_url(url), **options)
+
+class _Resources:
+    # httpx clients and asyncpg/aiomysql pools belong to the loop that created them.
+    def __init__(self):
+        self.http = httpx.AsyncClient(limits=httpx.Limits(max_connections=ASYNC_MAX_CONNECTIONS,
+                                                          max_keepalive_connections=ASYNC_MAX_KEEPALIVE))
+        self._engines = None
+
+    def sessions(self):
+        if self._engines is None:
+            primary = _async_engine(DATABASE_URL)
+            replica = _async_engine(DATABASE_READ_URL) if DATABASE_READ_URL else primary
+            self._engines = (primary, replica, async_sessionmaker(primary, expire_on_commit=False),
+                             async_sessionmaker(replica, expire_on_commit=False))
+        return self._engines[2], self._engines[3]
+
+    async def close(self):
+        await self.http.aclose()
+        if self._engines is not None:
+            await self._engines[0].dispose()
+            if self._engines[1] is not self._engines[0]:
+                await self._engines[1].dispose()
+
+_resources = weakref.WeakKeyDictionary()
+
+def _res():
+    loop = asyncio.get_running_loop()
+    if loop not in _resources:
+        _resources[loop] = _Resources()
+    return _resources[loop]
+
+def _timeout(seconds):
+    # Waiting for a free connection is not part of a call's budget; callers
+    # bound the whole call with run(..., timeout=) instead.
+    return httpx.Timeout(seconds, pool=None)
+
+async def _post(service, url, headers, **kwargs):
+    # Every upstream call goes through here, so traffic.py can record it.
+    started = time.perf_counter()
+    try:
+        response = await _res().http.post(url, headers=traffic.request_headers(headers), **kwargs)
+    except BaseException as e:
+        traffic.upstream(service, type(e).__name__, time.perf_counter() - started)
+        raise
+    traffic.upstream(service, response.status_code, time.perf_counter() - started, response.content)
+    return response
+
+_loop = None
+_loop_lock = threading.Lock()
+
+def _get_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="async-services", daemon=True).start()
+        return _loop
+
+def spawn(coro, timeout=None):
+    # Schedules coro on the shared background loop; returns a concurrent.futures.Future.
+    loop = _get_loop()
+    if threading.current_thread().name == "async-services":
+        raise RuntimeError("spawn()/run() called from the event loop; await the coroutine instead")
+    return asyncio.run_coroutine_threadsafe(asyncio.wait_for(coro, timeout) if timeout else coro, loop)
+
+def run(coro, timeout=None):
+    # Sync adapter for Streamlit: blocks until coro finishes (TimeoutError after timeout seconds).
+    try:
+        return spawn(coro, timeout).result()
+    except asyncio.TimeoutError as e:
+        # Distinct from the builtin before Python 3.11.
+        raise TimeoutError(str(e)) from e
+
+async def _semaphore(value):
+    return asyncio.Semaphore(value)
+
+def loop_semaphore(value):
+    # An asyncio.Semaphore created on the shared loop, for capping spawn()ed work.
+    return run(_semaphore(value))
+
+async def chat_reply(messages, user_message):
+    # Async twin of cli_groq_chat.chat_completion: same routing, fallback and stats.
+    # The router's state file is locked with flock, so its calls go to a thread.
+    decision = await asyncio.to_thread(route, messages, user_message)
+    attempts, reply, error, usage = [], None, None, {}
+    for tier in decision["order"]:
+        headers, data = groq_request(MODELS[tier], messages)
+        started = time.perf_counter()
+        try:
+            response = await _post("groq", GROQ_API_URL, headers, json=data, timeout=_timeout(ATTEMPT_TIMEOUT))
+            status = response.status_code
+            if status == 200:
+                body = response.json()
+                reply = body["choices"][0]["message"]["content"]
+                usage = body.get("usage") or {}
+            else:
+                error = f"Groq API error: {status}, {response.text}"
+        except (httpx.HTTPError, KeyError, IndexError, ValueError) as e:
+            status, error = "error", f"Groq API error: {e}"
+        latency = time.perf_counter() - started
+        await asyncio.to_thread(record, tier, latency, reply is not None)
+        attempts.append({"model": MODELS[tier]["name"], "status": status, "latency": round(latency, 3)})
+        if reply is not None:
+            break
+    result = completion_result(attempts, reply, error, usage)
+    await asyncio.to_thread(log_decision, decision, attempts, result["model"])
+    return result
+
+async def prescription_page(file_bytes):
+    # file_bytes: an already preprocessed page (image_pipeline.preprocess_image).
+    # Returns what cli_gemini_prescription.py prints: the JSON text or an error line.
+    headers, params, payload = prescription_request(file_bytes)
+    response = await _post("gemini", GEMINI_API_URL, headers, params=params, json=payload,
+                           timeout=_timeout(GEMINI_TIMEOUT))
+    return prescription_output(response)
+
+async def _search(query, num_results, timeout, url=None):
+    response = await _post("tavily", url or TAVILY_API_URL, tavily_headers(), json=search_payload(query, num_results),
+                           timeout=_timeout(timeout))
+    if response.status_code != 200:
+        return []
+    return [{"title": item["title"], "url": item["url"]} for item in response.json().get("results", [])[:num_results]]
+
+async def health_articles(query, url=None):
+    return await _search(query, 5, 10, url)
+
+async def _medicine_search(name):
+    try:
+        return [{"medicine": name, **item} for item in await _search(medicine_query(name), 1, 6)]
+    except (httpx.HTTPError, ValueError, KeyError):
+        return []
+
+async def medicine_lookup(names):
+    # -> (med_links, buy_links) like tavily_api.get_medicine_links / get_buy_links,
+    # but every medicine missing from the drug store is searched once, concurrently,
+    # and that one result feeds both lists.
+    # get_drug is blocking SQLite work, and the first call may build the store.
+    drugs = dict(zip(names, await asyncio.gather(*(asyncio.to_thread(get_drug, name) for name in names))))
+    missing = [name for name, drug in drugs.items() if not has_reference(drug)]
+    found = dict(zip(missing, await asyncio.gather(*(_medicine_search(name) for name in missing))))
+    med_links, buy_links = [], {}
+    for name in names:
+        drug = drugs[name]
+        if has_reference(drug):
+            info = [{"medicine": name, "title": drug["description"], "url": drug["reference_url"]}]
+        else:
+            info = found[name]
+        med_links.extend(info)
+        if drug and drug["pharmacy_links"]:
+            buy_links[name] = next(iter(drug["pharmacy_links"].values()))
+        elif info:
+            buy_links[name] = pick_buy_link(info)
+    return med_links, buy_links
+
+async def chat_with_articles(messages, user_message, articles=True):
+    # -> (reply text, articles). The model call and the article search run
+    # concurrently; a failed search only costs the articles.
+    if should_refuse(user_message):
+        return REFUSAL_MESSAGE, []
+    calls = [chat_reply(messages, user_message)] + ([health_articles(user_message)] if articles else [])
+    results = await asyncio.gather(*calls, return_exceptions=True)
+    if isinstance(results[0], BaseException):
+        raise results[0]
+    reply = results[0]["reply"] if results[0]["reply"] is not None else results[0]["error"]
+    found = results[1] if articles and not isinstance(results[1], BaseException) else []
+    return reply, found
+
+async def get_user_profile(user_id):
+    sessions, _ = _res().sessions()
+    async with sessions() as db:
+        return await db.get(User, user_id)
+
+async def load_conversation(user_id, limit=5):
+    # Primary, like app.load_conversation: replica lag would drop the latest turns.
+    sessions, _ = _res().sessions()
+    async with sessions() as db:
+        rows = (await db.scalars(select(Conversation).where(Conversation.user_id == user_id)
+                                 .order_by(Conversation.timestamp.desc(), Conversation.id.desc())
+                                 .limit(limit))).all()
+    return rows[::-1]
+
+async def load_chat_context(user_id, limit=5):
+    # Profile and recent turns in parallel, on separate connections.
+    return await asyncio.gather(get_user_profile(user_id), load_conversation(user_id, limit))
+
+async def save_conversation(user_id, message, response):
+    sessions, _ = _res().sessions()
+    async with sessions() as db, db.begin():
+        conversation = Conversation(user_id=user_id, message=message, response=response)
+        db.add(conversation)
+        await db.flush()
+        # The search indexer is written against a sync Session.
+        await db.run_sync(lambda sync_db: index_conversation(sync_db, conversation))
+        return conversation.id
+
+async def _bench(count, url):
+    started = time.perf_counter()
+    results = await asyncio.gather(*(health_articles(f"question {i}", url) for i in range(count)),
+                                   return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    await _res().close()
+    failed = sum(1 for r in results if isinstance(r, BaseException))
+    return elapsed, failed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent in-flight benchmark for the async clients")
+    parser.add_argument("--bench", type=int, default=1000, help="number of concurrent searches")
+    parser.add_argument("--latency-ms", type=int, default=500, help="stand-in latency per call")
+    args = parser.parse_args()
+    import resource
+    import stub_services
+    server, base_url = stub_services.start(latency_ms={"tavily": args.latency_ms})
+    elapsed, failed = asyncio.run(_bench(args.bench, stub_services.paths(base_url)["TAVILY_API_URL"]))
+    print(f"{args.bench} searches in {elapsed:.2f}s ({args.bench / elapsed:.0f}/s), {failed} failed, "
+          f"{threading.active_count()} threads, peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+    server.shutdown()
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,11 @@
+# auth.py
+# Password hashing shared by the app's login/registration and import_users.py.
+# Kept free of Streamlit and database imports so process-pool workers can load it cheaply.
+import hashlib
+
+def hash_password(password):
+    return hashlib.sha256(password.encode()).hexdigest()
+
+def hash_passwords(passwords):
+    # One pool task per batch: pickling a list is far cheaper than one task per password.
+    return [hash_password(p) for p in passwords]
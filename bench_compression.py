@@ -0,0 +1,54 @@
+# bench_compression.py
+# Size savings and encode/decode cost of CompressedText on realistic rows:
+#   python bench_compression.py            # synthetic assistant/prescription text
+#   python bench_compression.py --from-db  # sample of stored rows
+import sys
+import time
+import random
+import statistics
+from db import compress_text, decompress_text, COMPRESS_THRESHOLD
+
+SENTENCES = [
+    "Based on your profile, it is generally safe to take ibuprofen with food to reduce stomach upset.",
+    "Since you have a history of asthma, please use NSAIDs with caution and talk to your doctor first.",
+    "Stay hydrated, rest, and monitor your temperature every few hours.",
+    "If symptoms persist for more than three days or get worse, please consult a healthcare professional.",
+    "Metformin is usually taken with meals to reduce gastrointestinal side effects.",
+    "Paracetamol 650 mg can be taken every six hours as needed, not exceeding four doses a day.",
+    "Your current medications do not have known interactions with this medicine, but confirm with your pharmacist.",
+    "Amoxicillin should be taken for the full course even if you start feeling better.",
+    "Avoid alcohol while taking this medication as it may increase drowsiness.",
+    "Keep a record of your blood pressure readings and share them at your next checkup.",
+]
+
+def synthetic_rows(n=500, seed=7):
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(SENTENCES) for _ in range(rng.randint(2, 30))) for _ in range(n)]
+
+def db_rows(limit=500):
+    from db import SessionLocal, Conversation, PrescriptionAnalysis
+    db = SessionLocal()
+    rows = [r for (r,) in db.query(Conversation.response).order_by(Conversation.id.desc()).limit(limit)]
+    rows += [r for (r,) in db.query(PrescriptionAnalysis.result).order_by(PrescriptionAnalysis.id.desc()).limit(limit)]
+    db.close()
+    return [r for r in rows if r]
+
+def bench(rows):
+    raw_bytes = sum(len(r.encode("utf-8")) for r in rows)
+    encode_us, decode_us, stored = [], [], []
+    for row in rows:
+        start = time.perf_counter()
+        packed = compress_text(row)
+        encode_us.append((time.perf_counter() - start) * 1e6)
+        start = time.perf_counter()
+        assert decompress_text(packed) == row
+        decode_us.append((time.perf_counter() - start) * 1e6)
+        stored.append(len(packed.encode("utf-8")))
+    compressed = sum(1 for row, size in zip(rows, stored) if size != len(row.encode("utf-8")))
+    print(f"rows: {len(rows)} (threshold {COMPRESS_THRESHOLD} chars, {compressed} compressed)")
+    print(f"stored bytes: {sum(stored):,} of {raw_bytes:,} ({100 * sum(stored) / max(1, raw_bytes):.1f}%)")
+    print(f"encode: median {statistics.median(encode_us):.1f}us, max {max(encode_us):.1f}us")
+    print(f"decode: median {statistics.median(decode_us):.1f}us, max {max(decode_us):.1f}us")
+
+if __name__ == "__main__":
+    bench(db_rows() if "--from-db" in sys.argv[1:] else synthetic_rows())
@@ -0,0 +1,71 @@
+# bench_image_pipeline.py
+# Compares the legacy downscale path with image_pipeline.preprocess_image on a
+# folder of sample prescriptions:
+#   python bench_image_pipeline.py samples/ [--gemini]
+import sys, os, time, base64, statistics
+from image_pipeline import preprocess_image, legacy_downscale
+from prescription import process_result
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png")
+
+def medicine_lines(text):
+    return set(process_result(text)[1])
+
+def time_call(fn, *args):
+    start = time.perf_counter()
+    out = fn(*args)
+    return out, (time.perf_counter() - start) * 1000
+
+def gemini_text(file_bytes):
+    from cli_gemini_prescription import request_prescription_info
+    response, ms = time_call(request_prescription_info, file_bytes, "sample.jpg")
+    try:
+        text = response.json()['candidates'][0]['content']['parts'][0]['text']
+    except Exception:
+        text = ""
+    return text, ms
+
+def run(folder, with_gemini=False):
+    paths = sorted(os.path.join(folder, f) for f in os.listdir(folder) if f.lower().endswith(IMAGE_EXTS))
+    if not paths:
+        print("No sample images found in", folder)
+        return
+    rows = []
+    for path in paths:
+        with open(path, "rb") as f:
+            original = f.read()
+        row = {"file": os.path.basename(path), "original": len(original)}
+        for label, fn in (("legacy", legacy_downscale), ("pipeline", preprocess_image)):
+            try:
+                out, ms = time_call(fn, original)
+            except Exception as e:
+                print(f"{row['file']}: {label} failed: {e}")
+                out, ms = b"", 0.0
+            row[f"{label}_bytes"] = len(base64.b64encode(out))
+            row[f"{label}_ms"] = ms
+            if with_gemini and out:
+                text, gem_ms = gemini_text(out)
+                row[f"{label}_gemini_ms"] = gem_ms
+                row[f"{label}_meds"] = medicine_lines(text)
+        rows.append(row)
+        print(f"{row['file']}: original {row['original']}B | "
+              f"legacy {row['legacy_bytes']}B {row['legacy_ms']:.1f}ms | "
+              f"pipeline {row['pipeline_bytes']}B {row['pipeline_ms']:.1f}ms")
+
+    print("\nSummary (request body bytes are base64-encoded)")
+    for label in ("legacy", "pipeline"):
+        print(f"  {label:9s} median bytes {statistics.median(r[f'{label}_bytes'] for r in rows):>10.0f}"
+              f"  median preprocess {statistics.median(r[f'{label}_ms'] for r in rows):>8.1f}ms")
+        if with_gemini:
+            print(f"  {'':9s} median gemini {statistics.median(r.get(f'{label}_gemini_ms', 0) for r in rows):>12.1f}ms")
+    if with_gemini:
+        agreement = []
+        for r in rows:
+            legacy, new = r.get("legacy_meds", set()), r.get("pipeline_meds", set())
+            if legacy or new:
+                agreement.append(len(legacy & new) / len(legacy | new))
+        if agreement:
+            print(f"  medicine agreement (Jaccard, pipeline vs legacy): {statistics.mean(agreement):.2f}")
+
+if __name__ == "__main__":
+    run(sys.argv[1], with_gemini="--gemini" in sys.argv[2:])
@@ -1,25 +1,23 @@
 # cli_gemini_prescription.py
 import sys, os, requests, base64
 from dotenv import load_dotenv
-from PIL import Image
-import io
+from image_pipeline import preprocess_image
+from prescription import PRESCRIPTION_SCHEMA
 
 load_dotenv()
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
+GEMINI_API_URL = os.getenv("GEMINI_API_URL", "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent")
 
-def downscale_image(file_path, max_dim=800):
-    image = Image.open(file_path)
-    if image.mode != "RGB":
-        image = image.convert("RGB")
-    image.thumbnail((max_dim, max_dim))
-    buf = io.BytesIO()
-    image.save(buf, format='JPEG')
-    return buf.getvalue()
+def downscale_image(file_path):
+    with open(file_path, "rb") as f:
+        return preprocess_image(f.read())
 
-def extract_prescription_info(file_bytes, filename):
+GEMINI_TIMEOUT = 45
+
+def prescription_request(file_bytes):
+    # -> (headers, params, payload); shared with the async client in async_services.py.
     encoded_string = base64.b64encode(file_bytes).decode()
-    mime_type = "image/png" if filename.lower().endswith("png") else "image/jpeg"
+    mime_type = "image/jpeg"
     headers = { "Content-Type": "application/json" }
     params = {"key": GEMINI_API_KEY}
     payload = {
@@ -29,9 +27,11 @@ def extract_prescription_info(file_bytes, filename):
                 "parts": [
                     {
                         "text": (
-                            "Extract all medication names, dosages, frequencies, and doctor comments from this prescription. "
-                            "Give a short summary for the patient in plain English. Also, mention what each medicine is generally used for if possible. "
-                            "Format medicine names clearly as a markdown list for extraction."
+                            "Extract every medication on this prescription with its dosage, frequency and any notes, "
+                            "plus the doctor's comments. In 'summary', explain the prescription to the patient in plain English, "
+                            "including what each medicine is generally used for if possible. "
+                            "List only actual medicines under 'medicines' - not headings, tests, dosages or instructions. "
+                            "Use an empty string for any field that is not written on the prescription."
                         )
                     },
                     {
@@ -42,17 +42,29 @@ def extract_prescription_info(file_bytes, filename):
                     }
                 ]
             }
-        ]
+        ],
+        "generationConfig": {
+            "responseMimeType": "application/json",
+            "responseSchema": PRESCRIPTION_SCHEMA
+        }
     }
-    response = requests.post(GEMINI_API_URL, headers=headers, params=params, json=payload, timeout=45)
+    return headers, params, payload
+
+def request_prescription_info(file_bytes, filename):
+    headers, params, payload = prescription_request(file_bytes)
+    return requests.post(GEMINI_API_URL, headers=headers, params=params, json=payload, timeout=GEMINI_TIMEOUT)
+
+def prescription_output(response):
+    # Works on requests and httpx responses alike.
     if response.status_code == 200:
         try:
-            print(response.json()['candidates'][0]['content']['parts'][0]['text'])
+            return response.json()['candidates'][0]['content']['parts'][0]['text']
         except Exception as e:
-            print("Error parsing Gemini response:", e)
-            print(response.text)
-    else:
-        print(f"Gemini API error: {response.status_code}, {response.text}")
+            return f"Error parsing Gemini response: {e}\n{response.text}"
+    return f"Gemini API error: {response.status_code}, {response.text}"
+
+def extract_prescription_info(file_bytes, filename):
+    print(prescription_output(request_prescription_info(file_bytes, filename)))
 
 if __name__ == "__main__":
     file_path = sys.argv[1]
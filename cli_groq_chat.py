@@ -1,10 +1,21 @@
 # cli_groq_chat.py
-import sys, os, requests, json
+# One turn:    python cli_groq_chat.py messages.json "question"
+# Benchmark:   python cli_groq_chat.py --batch questions.jsonl answers.jsonl --concurrency 8 --rate 5
+#   input lines: {"id": ..., "profile": {"age", "gender", "conditions", "allergies", "medications"},
+#                 "history": [{"question", "answer"}], "question": "..."}
+#   routing stats and decisions go to answers.jsonl.router_state.json / .router_log.jsonl
+import sys, os, requests, json, time, argparse, threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
+from model_router import MODELS, route, record, log_decision, use_files
+from prompts import profile_summary, chat_messages
 
 load_dotenv()
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-GROQ_API_URL = "https://api.groq.com/openai/v1/chat/completions"
+GROQ_API_URL = os.getenv("GROQ_API_URL", "https://api.groq.com/openai/v1/chat/completions")
+# Two attempts (preferred model, then fallback) must fit in the 30s the app's chat
+# tab gives async_services.chat_with_articles.
+ATTEMPT_TIMEOUT = 10
 
 IRRELEVANT_TOPICS = ["news", "stock", "stocks", "cricket", "football", "movie", "politics", "bitcoin", "weather", "sport", "sports"]
 
@@ -14,30 +25,176 @@ def should_refuse(user_message):
             return True
     return False
 
-def ask_llama(messages, user_message):
-    if should_refuse(user_message):
-        print("I'm a health assistant and can't answer questions unrelated to health (like news, stocks, sports, etc.). Please ask a health-related question.")
-        return
+REFUSAL_MESSAGE = ("I'm a health assistant and can't answer questions unrelated to health "
+                   "(like news, stocks, sports, etc.). Please ask a health-related question.")
+
+def groq_request(model, messages):
+    # Shared with the async client in async_services.py.
     headers = {
         "Authorization": f"Bearer {GROQ_API_KEY}",
         "Content-Type": "application/json"
     }
     data = {
-        "model": "llama3-70b-8192",
+        "model": model["name"],
         "messages": messages,
-        "temperature": 0.15,
-        "max_tokens": 400,
+        "temperature": model["temperature"],
+        "max_tokens": model["max_tokens"],
+    }
+    return headers, data
+
+def completion_result(attempts, reply, error, usage):
+    return {
+        "reply": reply,
+        "error": None if reply is not None else error,
+        "model": attempts[-1]["model"] if reply is not None else None,
+        "latency": round(sum(a["latency"] for a in attempts), 3),
+        "prompt_tokens": usage.get("prompt_tokens"),
+        "completion_tokens": usage.get("completion_tokens"),
+        "attempts": attempts,
     }
-    response = requests.post(GROQ_API_URL, headers=headers, json=data, timeout=10)
-    if response.status_code == 200:
-        reply = response.json()["choices"][0]["message"]["content"]
-        print(reply)
+
+def chat_completion(messages, user_message):
+    # -> {"reply", "error", "model", "latency", "prompt_tokens", "completion_tokens", "attempts"}
+    decision = route(messages, user_message)
+    attempts, reply, error, usage = [], None, None, {}
+    for tier in decision["order"]:
+        model = MODELS[tier]
+        headers, data = groq_request(model, messages)
+        started = time.perf_counter()
+        try:
+            response = requests.post(GROQ_API_URL, headers=headers, json=data, timeout=ATTEMPT_TIMEOUT)
+            status = response.status_code
+            if status == 200:
+                body = response.json()
+                reply = body["choices"][0]["message"]["content"]
+                usage = body.get("usage") or {}
+            else:
+                error = f"Groq API error: {status}, {response.text}"
+        except (requests.RequestException, KeyError, IndexError, ValueError) as e:
+            status, error = "error", f"Groq API error: {e}"
+        latency = time.perf_counter() - started
+        record(tier, latency, reply is not None)
+        attempts.append({"model": model["name"], "status": status, "latency": round(latency, 3)})
+        if reply is not None:
+            break
+    result = completion_result(attempts, reply, error, usage)
+    log_decision(decision, attempts, result["model"])
+    return result
+
+def ask_llama(messages, user_message):
+    if should_refuse(user_message):
+        print(REFUSAL_MESSAGE)
+        return
+    result = chat_completion(messages, user_message)
+    print(result["reply"] if result["reply"] is not None else result["error"])
+
+class RateLimiter:
+    # Spaces request starts at least 1/rate seconds apart across worker threads.
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        time.sleep(max(0.0, slot - now))
+
+def batch_messages(item):
+    profile = item.get("profile") or {}
+    summary = profile_summary(profile.get("age"), profile.get("gender"), profile.get("conditions"),
+                              profile.get("allergies"), profile.get("medications"))
+    history = [(turn["question"], turn["answer"]) for turn in item.get("history") or []]
+    return chat_messages(summary, history) + [{"role": "user", "content": item["question"]}]
+
+def evaluate_item(item_id, item, limiter):
+    question = item["question"]
+    refused = should_refuse(question)
+    if refused:
+        result = {"reply": REFUSAL_MESSAGE, "error": None, "model": None, "latency": 0.0,
+                  "prompt_tokens": 0, "completion_tokens": 0, "attempts": []}
     else:
-        print(f"Groq API error: {response.status_code}, {response.text}")
+        limiter.wait()
+        result = chat_completion(batch_messages(item), question)
+    return {"id": item_id, "question": question, "refused": refused, **result}
+
+def _read_jsonl(path):
+    with open(path) as f:
+        for line_no, line in enumerate(f, 1):
+            if line.strip():
+                yield line_no, json.loads(line)
+
+def _percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))] if values else 0.0
+
+def summarize(out_path, elapsed=None, processed=None):
+    latest = {}
+    for _, row in _read_jsonl(out_path):
+        latest[row["id"]] = row
+    rows = list(latest.values())
+    answered = [r for r in rows if r["reply"] is not None and not r["refused"]]
+    latencies = [r["latency"] for r in answered]
+    models = {}
+    for r in answered:
+        models[r["model"]] = models.get(r["model"], 0) + 1
+    print(f"items: {len(rows)}  answered: {len(answered)}  refused: {sum(r['refused'] for r in rows)}  "
+          f"errors: {sum(1 for r in rows if r['error'])}")
+    print("latency: " + "  ".join(f"p{p} {_percentile(latencies, p):.2f}s" for p in (50, 90, 95, 99)))
+    print(f"tokens: prompt {sum(r['prompt_tokens'] or 0 for r in answered)}, "
+          f"completion {sum(r['completion_tokens'] or 0 for r in answered)}")
+    print(f"served by: {models}")
+    if elapsed and processed:
+        print(f"this run: {processed} requests in {elapsed:.1f}s ({processed / elapsed:.2f} req/s)")
+
+def run_batch(in_path, out_path, concurrency=4, rate=2.0):
+    # Routing stats and decisions of the run sit next to its answers, not in the app's files.
+    use_files(out_path + ".router_state.json", out_path + ".router_log.jsonl")
+    done = set()
+    if os.path.exists(out_path):
+        # Resume: anything already answered (or refused) is skipped; errors are retried.
+        done = {row["id"] for _, row in _read_jsonl(out_path) if not row.get("error")}
+    pending = [(item.get("id", line_no), item) for line_no, item in _read_jsonl(in_path)]
+    pending = [(item_id, item) for item_id, item in pending if item_id not in done]
+    print(f"{len(done)} already done, {len(pending)} to run")
+    limiter = RateLimiter(rate)
+    write_lock = threading.Lock()
+    started = time.perf_counter()
+    with open(out_path, "a") as out, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {pool.submit(evaluate_item, item_id, item, limiter): (item_id, item) for item_id, item in pending}
+        for count, future in enumerate(as_completed(futures), 1):
+            try:
+                row = future.result()
+            except Exception as e:
+                # A malformed item (or a bug) costs that item only; resume retries it.
+                item_id, item = futures[future]
+                row = {"id": item_id, "question": item.get("question"),
+                       "refused": False, "reply": None, "error": f"{type(e).__name__}: {e}", "model": None,
+                       "latency": 0.0, "prompt_tokens": 0, "completion_tokens": 0, "attempts": []}
+            with write_lock:
+                out.write(json.dumps(row, ensure_ascii=False) + "\n")
+                out.flush()
+            if count % 50 == 0:
+                print(f"{count}/{len(pending)}")
+    summarize(out_path, time.perf_counter() - started, len(pending))
 
 if __name__ == "__main__":
-    json_path = sys.argv[1]
-    user_message = sys.argv[2]
-    with open(json_path, "r") as f:
-        messages = json.load(f)
-    ask_llama(messages, user_message)
+    if "--batch" in sys.argv[1:]:
+        parser = argparse.ArgumentParser(description="Batch-evaluate benchmark questions against the chat model")
+        parser.add_argument("--batch", nargs=2, metavar=("IN_JSONL", "OUT_JSONL"), required=True)
+        parser.add_argument("--concurrency", type=int, default=4)
+        parser.add_argument("--rate", type=float, default=2.0, help="max requests started per second")
+        parser.add_argument("--summary-only", action="store_true")
+        args = parser.parse_args()
+        if args.summary_only:
+            summarize(args.batch[1])
+        else:
+            run_batch(args.batch[0], args.batch[1], args.concurrency, args.rate)
+    else:
+        json_path = sys.argv[1]
+        user_message = sys.argv[2]
+        with open(json_path, "r") as f:
+            messages = json.load(f)
+        ask_llama(messages, user_message)
@@ -1,10 +1,56 @@
 # db.py
-from sqlalchemy import create_engine, Column, Integer, String, Text, ForeignKey, DateTime
+from sqlalchemy import create_engine, event, Column, Integer, String, Text, ForeignKey, DateTime, Date, UniqueConstraint, Index, select, update
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.types import TypeDecorator
 from dotenv import load_dotenv
+from contextlib import contextmanager
+import threading
+import datetime
+import base64
+import zlib
 import os
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Optional replica for history search, analytics and rollups; falls back to the primary.
+# Conversation context and the near-duplicate lookup always read the primary.
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL")
+DB_POOL_PROFILE = os.getenv("DB_POOL_PROFILE", "web")
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", 10))
+COMPRESS_THRESHOLD = int(os.getenv("COMPRESS_THRESHOLD", 512))
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", 6))
+# Prefix of compressed values. Natural-language output never starts with a
+# unit-separator control character, so rows written before compression read back unchanged.
+COMPRESSED_MARKER = "\x1fz1:"
+PREVIEW_CHARS = 200
+
+def compress_text(value, threshold=COMPRESS_THRESHOLD):
+    if value is None or len(value) < threshold or value.startswith(COMPRESSED_MARKER):
+        return value
+    packed = COMPRESSED_MARKER + base64.b64encode(zlib.compress(value.encode("utf-8"), COMPRESS_LEVEL)).decode("ascii")
+    return packed if len(packed) < len(value) else value
+
+def decompress_text(value):
+    if value is None or not value.startswith(COMPRESSED_MARKER):
+        return value
+    return zlib.decompress(base64.b64decode(value[len(COMPRESSED_MARKER):])).decode("utf-8")
+
+def text_preview(value, length=PREVIEW_CHARS):
+    # Uncompressed head of a long text column, for list views that never need the full body.
+    if value is None:
+        return None
+    flat = " ".join(value.split())
+    return flat if len(flat) <= length else flat[:length - 1].rstrip() + "…"
+
+class CompressedText(TypeDecorator):
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return compress_text(value)
+
+    def process_result_value(self, value, dialect):
+        return decompress_text(value)
 
 Base = declarative_base()
 
@@ -21,42 +67,309 @@ class User(Base):
 
 class Conversation(Base):
     __tablename__ = "conversations"
+    __table_args__ = (Index("ix_conversations_timestamp", "timestamp"),)
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'))
     message = Column(Text)
-    response = Column(Text)
-    timestamp = Column(DateTime)
+    response = Column(CompressedText)
+    response_preview = Column(String(PREVIEW_CHARS))
+    timestamp = Column(DateTime, default=datetime.datetime.now)
+
+class PrescriptionAnalysis(Base):
+    __tablename__ = 'prescription_analyses'
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    filename = Column(String(255))
+    result = Column(CompressedText)
+    result_preview = Column(String(PREVIEW_CHARS))
+    created_at = Column(DateTime, default=datetime.datetime.now)
 
-class Feedback(Base):
-    __tablename__ = "feedback"
+class PrescriptionPage(Base):
+    __tablename__ = 'prescription_pages'
     id = Column(Integer, primary_key=True)
-    conversation_id = Column(Integer, ForeignKey('conversations.id'))
-    rating = Column(Integer)
-    comment = Column(Text)
+    analysis_id = Column(Integer, ForeignKey("prescription_analyses.id"), index=True)
+    phash = Column(String(16), nullable=False)
+    # 256-bit dHash confirming a band match before an analysis is reused.
+    fine_hash = Column(String(64))
+    raw = Column(CompressedText)
+    created_at = Column(DateTime, default=datetime.datetime.now)
+
+class HouseholdMember(Base):
+    # Users whose prescription uploads may reuse each other's analyses (PHASH_SCOPE=household).
+    __tablename__ = 'household_members'
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True, autoincrement=False)
+    household_id = Column(Integer, nullable=False, index=True)
+
+class PrescriptionHashBand(Base):
+    __tablename__ = 'prescription_hash_bands'
+    band = Column(Integer, primary_key=True, autoincrement=False)
+    value = Column(Integer, primary_key=True, autoincrement=False)
+    page_id = Column(Integer, ForeignKey("prescription_pages.id"), primary_key=True, autoincrement=False)
+
 class ChatFeedback(Base):
     __tablename__ = 'chat_feedback'
+    __table_args__ = (
+        UniqueConstraint("user_id", "conversation_id", name="uq_chat_feedback_user_conversation"),
+        Index("ix_chat_feedback_updated", "updated_at", "id"),
+        Index("ix_chat_feedback_conversation", "conversation_id"),
+        Index("ix_chat_feedback_created", "created_at"),
+    )
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"))
-    question = Column(Text)
-    answer = Column(Text)
+    conversation_id = Column(Integer, ForeignKey("conversations.id"))
     feedback = Column(Integer) # 1 for 👍, 0 for 👎
+    created_at = Column(DateTime, default=datetime.datetime.now)
+    updated_at = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
 
 class PrescriptionFeedback(Base):
     __tablename__ = 'prescription_feedback'
+    __table_args__ = (
+        UniqueConstraint("user_id", "analysis_id", name="uq_prescription_feedback_user_analysis"),
+        Index("ix_prescription_feedback_updated", "updated_at", "id"),
+        Index("ix_prescription_feedback_created", "created_at"),
+    )
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"))
-    filename = Column(String(255))
-    result = Column(Text)
+    analysis_id = Column(Integer, ForeignKey("prescription_analyses.id"))
     feedback = Column(Integer)
+    created_at = Column(DateTime, default=datetime.datetime.now)
+    updated_at = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
+
+class SessionTurn(Base):
+    __tablename__ = 'session_turns'
+    id = Column(Integer, primary_key=True)
+    session_id = Column(String(64), index=True, nullable=False)
+    turn_index = Column(Integer, nullable=False)
+    payload = Column(Text)
+
+class SearchDocument(Base):
+    __tablename__ = 'search_documents'
+    __table_args__ = (Index("ix_search_documents_user", "user_id", "doc_type"),)
+    doc_type = Column(String(20), primary_key=True)
+    doc_id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    length = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.datetime.now)
+
+class SearchPosting(Base):
+    __tablename__ = 'search_postings'
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    term = Column(String(64), primary_key=True)
+    doc_type = Column(String(20), primary_key=True)
+    doc_id = Column(Integer, primary_key=True)
+    tf = Column(Integer, nullable=False)
+
+class FeedbackRollup(Base):
+    __tablename__ = 'feedback_rollups'
+    day = Column(Date, primary_key=True)
+    kind = Column(String(20), primary_key=True)
+    user_id = Column(Integer, primary_key=True)
+    total = Column(Integer, nullable=False, default=0)
+    positive = Column(Integer, nullable=False, default=0)
+
+class RollupState(Base):
+    __tablename__ = 'rollup_state'
+    name = Column(String(50), primary_key=True)
+    high_water_time = Column(DateTime)
+    high_water_id = Column(Integer, default=0)
 
-engine = create_engine(DATABASE_URL)
+PREVIEW_COLUMNS = {
+    Conversation: ("response", "response_preview"),
+    PrescriptionAnalysis: ("result", "result_preview"),
+}
+
+def _set_preview(mapper, connection, target):
+    source, preview = PREVIEW_COLUMNS[type(target)]
+    setattr(target, preview, text_preview(getattr(target, source)))
+
+for _model in PREVIEW_COLUMNS:
+    event.listen(_model, "before_insert", _set_preview)
+    event.listen(_model, "before_update", _set_preview)
+
+# "web" serves many concurrent Streamlit sessions; "batch" is for the CLI jobs
+# (exports, rollups, recompress) that hold one or two long-running connections;
+# "async" backs async_services.py, where many coroutines queue for few connections.
+# Recycle stays below MySQL's default wait_timeout so idle connections never go stale.
+POOL_PROFILES = {
+    "web": {"pool_size": 10, "max_overflow": 20, "pool_timeout": 10, "pool_recycle": 1800},
+    "batch": {"pool_size": 2, "max_overflow": 2, "pool_timeout": 60, "pool_recycle": 3600},
+    "async": {"pool_size": 10, "max_overflow": 10, "pool_timeout": 60, "pool_recycle": 1800},
+}
+POOL_ENV = {
+    "pool_size": "DB_POOL_SIZE",
+    "max_overflow": "DB_MAX_OVERFLOW",
+    "pool_timeout": "DB_POOL_TIMEOUT",
+    "pool_recycle": "DB_POOL_RECYCLE",
+}
+CONNECT_TIMEOUT_ARG = {
+    "mysqlconnector": "connection_timeout",
+    "pymysql": "connect_timeout",
+    "mysqldb": "connect_timeout",
+    "psycopg2": "connect_timeout",
+    "aiomysql": "connect_timeout",
+    "asyncpg": "timeout",
+}
+
+def engine_options(url, profile=DB_POOL_PROFILE):
+    options = dict(POOL_PROFILES[profile])
+    for key, env in POOL_ENV.items():
+        if os.getenv(env):
+            options[key] = int(os.getenv(env))
+    options["pool_pre_ping"] = os.getenv("DB_POOL_PRE_PING", "1") != "0"
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite":
+        # In-memory databases get a single shared connection; file databases
+        # have no server-side idle timeout to recycle around.
+        if parsed.database in (None, "", ":memory:"):
+            return {}
+        options.pop("pool_recycle")
+        return options
+    timeout_arg = CONNECT_TIMEOUT_ARG.get(parsed.get_driver_name())
+    if timeout_arg:
+        options["connect_args"] = {timeout_arg: DB_CONNECT_TIMEOUT}
+    return options
+
+_pool_events = {}
+
+def _track_pool(name, eng):
+    counters = _pool_events.setdefault(name, {"connects": 0, "checkouts": 0, "invalidated": 0})
+
+    def on_connect(dbapi_connection, connection_record):
+        counters["connects"] += 1
+
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        counters["checkouts"] += 1
+
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        counters["invalidated"] += 1
+
+    event.listen(eng, "connect", on_connect)
+    event.listen(eng, "checkout", on_checkout)
+    event.listen(eng, "invalidate", on_invalidate)
+    return eng
+
+engine = _track_pool("primary", create_engine(DATABASE_URL, **engine_options(DATABASE_URL)))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+if DATABASE_READ_URL:
+    read_engine = _track_pool("replica", create_engine(DATABASE_READ_URL, **engine_options(DATABASE_READ_URL)))
+else:
+    read_engine = engine
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+_uow = threading.local()
+
+@contextmanager
+def unit_of_work(commit_on=()):
+    # One session per script run: helpers share its identity map and the run
+    # commits or rolls back once at the end. commit_on lists exceptions that
+    # still end the run normally (Streamlit's rerun/stop signals).
+    if getattr(_uow, "session", None) is not None:
+        yield _uow.session
+        return
+    db = SessionLocal(expire_on_commit=False)
+    read_db = db if read_engine is engine else ReadSessionLocal(expire_on_commit=False)
+    _uow.session, _uow.read_session = db, read_db
+    try:
+        yield db
+        db.commit()
+    except commit_on:
+        db.commit()
+        raise
+    except BaseException:
+        db.rollback()
+        raise
+    finally:
+        _uow.session = _uow.read_session = None
+        db.close()
+        if read_db is not db:
+            read_db.close()
+
+@contextmanager
+def session_scope(read=False):
+    shared = getattr(_uow, "read_session" if read else "session", None)
+    if shared is not None:
+        yield shared
+        return
+    db = (ReadSessionLocal if read else SessionLocal)(expire_on_commit=False)
+    try:
+        yield db
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def checkpoint():
+    # Commit what the unit of work has so far and hand its connections back to
+    # the pool before a slow external call; loaded objects stay in the identity map.
+    for db in {getattr(_uow, "session", None), getattr(_uow, "read_session", None)} - {None}:
+        db.commit()
+
+def pool_stats():
+    engines = {"primary": engine}
+    if read_engine is not engine:
+        engines["replica"] = read_engine
+    stats = {}
+    for name, eng in engines.items():
+        pool = eng.pool
+        row = {"pool": type(pool).__name__, **_pool_events.get(name, {})}
+        if hasattr(pool, "checkedout"):
+            size = pool.size()
+            capacity = size + max(0, getattr(pool, "_max_overflow", 0))
+            row.update({
+                "size": size,
+                "checked_out": pool.checkedout(),
+                "idle": pool.checkedin(),
+                "overflow": max(0, pool.overflow()),
+                "utilization": pool.checkedout() / max(1, capacity),
+            })
+        stats[name] = row
+    return stats
+
+def pool_metric_lines():
+    # pool_stats() in Prometheus text format, for the scheduler's /metrics endpoint.
+    stats = pool_stats()
+    keys = sorted({k for row in stats.values() for k, v in row.items() if isinstance(v, (int, float))})
+    lines = []
+    for key in keys:
+        name = f"curo_db_pool_{key}_total" if key in ("connects", "checkouts", "invalidated") else f"curo_db_pool_{key}"
+        lines.append(f"# TYPE {name} {'counter' if name.endswith('_total') else 'gauge'}")
+        lines.extend(f'{name}{{pool="{pool}"}} {row[key]}' for pool, row in stats.items() if key in row)
+    return lines
 
 
 
 def init_db():
     Base.metadata.create_all(bind=engine)
 
+def upsert(db, model, rows, keys, update_columns):
+    # One INSERT ... ON DUPLICATE KEY / ON CONFLICT statement for the whole batch.
+    if not rows:
+        return
+    dialect = db.get_bind().dialect.name
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+        stmt = insert(model).values(rows)
+        stmt = stmt.on_duplicate_key_update({c: stmt.inserted[c] for c in update_columns})
+    elif dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(model).values(rows)
+        stmt = stmt.on_conflict_do_update(index_elements=keys, set_={c: stmt.excluded[c] for c in update_columns})
+    else:
+        for row in rows:
+            match = {k: row[k] for k in keys}
+            existing = db.execute(select(model.id).filter_by(**match)).first()
+            if existing:
+                db.execute(update(model).where(model.id == existing[0]).values({c: row[c] for c in update_columns}))
+            else:
+                db.add(model(**row))
+        return
+    db.execute(stmt)
+
 # For testing the connection and creating tables
 if __name__ == "__main__":
     try:
@@ -0,0 +1,69 @@
+# drug_index.py
+import os
+import re
+import json
+import difflib
+from functools import lru_cache
+from dotenv import load_dotenv
+
+load_dotenv()
+DRUG_NAMES_PATH = os.getenv("DRUG_NAMES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "drug_names.json"))
+FUZZY_CUTOFF = float(os.getenv("DRUG_FUZZY_CUTOFF", 0.84))
+
+# Strength, dosage form and release-modifier words that appear around a name
+# on prescriptions but are not part of it.
+DOSE_PATTERN = re.compile(r"\b\d+(\.\d+)?\s*(mg|mcg|g|gm|ml|iu|units?|%)\b", re.I)
+FORM_WORDS = {
+    "tab", "tabs", "tablet", "tablets", "cap", "caps", "capsule", "capsules", "syp", "syrup",
+    "susp", "suspension", "inj", "injection", "drops", "drop", "eye", "ear", "nasal", "spray",
+    "cream", "ointment", "gel", "lotion", "inhaler", "rotacap", "rotacaps", "respules", "sachet",
+    "sr", "er", "xr", "cr", "mr", "od", "ds", "forte", "plus", "oral", "solution", "powder",
+}
+
+def normalize_name(name):
+    name = DOSE_PATTERN.sub(" ", name.lower())
+    name = re.sub(r"[^a-z0-9\s]", " ", name)
+    words = [w for w in name.split() if w not in FORM_WORDS and not w.isdigit()]
+    return " ".join(words)
+
+@lru_cache(maxsize=1)
+def load_index(path=DRUG_NAMES_PATH):
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    index = {}
+    for generic in data.get("generics", []):
+        index[normalize_name(generic)] = generic
+    for brand, generic in data.get("brands", {}).items():
+        index.setdefault(normalize_name(brand), generic)
+    by_initial = {}
+    for key in index:
+        by_initial.setdefault(key[0], []).append(key)
+    return index, by_initial
+
+@lru_cache(maxsize=4096)
+def lookup(name):
+    index, by_initial = load_index()
+    key = normalize_name(name)
+    if not key:
+        return None
+    if key in index:
+        return index[key]
+    # Dose and form words are already gone ("Dolo 650" -> "dolo"). A leftover word
+    # usually names another ingredient ("Telma H" is telmisartan with
+    # hydrochlorothiazide), so spelling fixes only consider names of the same length.
+    words = len(key.split())
+    candidates = [c for c in by_initial.get(key[0], []) if len(c.split()) == words]
+    match = difflib.get_close_matches(key, candidates, n=1, cutoff=FUZZY_CUTOFF)
+    return index[match[0]] if match else None
+
+def canonicalize(names):
+    seen = []
+    for name in names:
+        canonical = lookup(name)
+        if canonical and canonical not in seen:
+            seen.append(canonical)
+    return seen
+
+def refresh_index():
+    load_index.cache_clear()
+    lookup.cache_clear()
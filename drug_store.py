@@ -0,0 +1,165 @@
+# drug_store.py
+# Offline drug information consulted before any web search.
+# Rebuild from a dataset with:  python drug_store.py data/drug_info.csv
+import os
+import sys
+import csv
+import json
+import sqlite3
+import tempfile
+import threading
+import time
+from dotenv import load_dotenv
+from drug_index import lookup, normalize_name
+
+load_dotenv()
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DRUG_STORE_PATH = os.getenv("DRUG_STORE_PATH", os.path.join(BASE_DIR, "data", "drug_store.db"))
+DRUG_DATASET_PATH = os.getenv("DRUG_DATASET_PATH", os.path.join(BASE_DIR, "data", "drug_info.csv"))
+REFRESH_INTERVAL = int(os.getenv("DRUG_STORE_REFRESH_SECONDS", 300))
+PHARMACY_COLUMNS = ("1mg_url", "pharmeasy_url", "netmeds_url")
+
+_lock = threading.Lock()
+# Serializes builds and the refresher start; readers only wait on _lock.
+_build_lock = threading.Lock()
+_cache = {"mtime": None, "drugs": {}, "aliases": {}, "retry_at": 0.0}
+_refresher = None
+
+def _read_rows(dataset_path):
+    with open(dataset_path, "r", encoding="utf-8") as f:
+        if dataset_path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+def build_store(dataset_path=DRUG_DATASET_PATH, store_path=DRUG_STORE_PATH):
+    with _build_lock:
+        return _build(dataset_path, store_path)
+
+def _build(dataset_path, store_path):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(store_path)),
+                                    prefix=os.path.basename(store_path) + ".", suffix=".tmp")
+    os.close(fd)
+    try:
+        count = _write_store(dataset_path, tmp_path)
+        # Readers keep using the old file until the rename lands.
+        os.replace(tmp_path, store_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return count
+
+def _write_store(dataset_path, tmp_path):
+    conn = sqlite3.connect(tmp_path)
+    conn.executescript("""
+        CREATE TABLE drugs (
+            name TEXT PRIMARY KEY,
+            description TEXT,
+            reference_url TEXT,
+            pharmacy_links TEXT
+        );
+        CREATE TABLE aliases (
+            alias TEXT PRIMARY KEY,
+            name TEXT NOT NULL REFERENCES drugs(name)
+        );
+    """)
+    count = 0
+    for row in _read_rows(dataset_path):
+        name = (row.get("name") or "").strip().lower()
+        if not name:
+            continue
+        links = {col.split("_")[0]: row[col].strip() for col in PHARMACY_COLUMNS if (row.get(col) or "").strip()}
+        conn.execute(
+            "INSERT OR REPLACE INTO drugs VALUES (?, ?, ?, ?)",
+            (name, (row.get("description") or "").strip(), (row.get("reference_url") or "").strip(), json.dumps(links))
+        )
+        aliases = row.get("aliases") or ""
+        if isinstance(aliases, str):
+            aliases = aliases.split(";")
+        for alias in [name] + list(aliases):
+            key = normalize_name(alias)
+            if key:
+                conn.execute("INSERT OR IGNORE INTO aliases VALUES (?, ?)", (key, name))
+        count += 1
+    conn.commit()
+    conn.close()
+    return count
+
+def _load(store_path=DRUG_STORE_PATH):
+    conn = sqlite3.connect(f"file:{store_path}?mode=ro", uri=True)
+    drugs = {}
+    for name, description, reference_url, links in conn.execute("SELECT name, description, reference_url, pharmacy_links FROM drugs"):
+        drugs[name] = {
+            "name": name,
+            "description": description,
+            "reference_url": reference_url,
+            "pharmacy_links": json.loads(links or "{}"),
+        }
+    aliases = dict(conn.execute("SELECT alias, name FROM aliases"))
+    conn.close()
+    return drugs, aliases
+
+def refresh(store_path=DRUG_STORE_PATH):
+    if not os.path.exists(store_path):
+        if not os.path.exists(DRUG_DATASET_PATH):
+            return False
+        with _build_lock:
+            # Another thread may have built it while this one waited.
+            if not os.path.exists(store_path):
+                _build(DRUG_DATASET_PATH, store_path)
+    mtime = os.path.getmtime(store_path)
+    if mtime == _cache["mtime"]:
+        return False
+    drugs, aliases = _load(store_path)
+    with _lock:
+        _cache.update(mtime=mtime, drugs=drugs, aliases=aliases)
+    return True
+
+def _refresh_loop(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            refresh()
+        except Exception as e:
+            print("Drug store refresh failed:", e)
+
+def start_background_refresh(interval=REFRESH_INTERVAL):
+    global _refresher
+    with _build_lock:
+        if _refresher is None or not _refresher.is_alive():
+            _refresher = threading.Thread(target=_refresh_loop, args=(interval,), daemon=True)
+            _refresher.start()
+
+def get_drug(name):
+    if _cache["mtime"] is None and time.monotonic() >= _cache["retry_at"]:
+        try:
+            refresh()
+        except Exception as e:
+            print("Drug store load failed:", e)
+        if _cache["mtime"] is None:
+            # No store and no dataset, or a broken one: try again at the
+            # refresh interval rather than on every lookup.
+            _cache["retry_at"] = time.monotonic() + REFRESH_INTERVAL
+        start_background_refresh()
+    key = normalize_name(name)
+    with _lock:
+        drug_name = _cache["aliases"].get(key)
+        if drug_name is None:
+            canonical = lookup(name)
+            drug_name = _cache["aliases"].get(normalize_name(canonical)) if canonical else None
+        return _cache["drugs"].get(drug_name) if drug_name else None
+
+def has_reference(drug):
+    # Rows without a description only carry a search-page URL, so those
+    # medicines are looked up on the web like ones missing from the store.
+    return bool(drug and drug["description"] and drug["reference_url"])
+
+if __name__ == "__main__":
+    dataset = sys.argv[1] if len(sys.argv) > 1 else DRUG_DATASET_PATH
+    try:
+        n = build_store(dataset)
+        print(f"✅ Imported {n} drugs into {DRUG_STORE_PATH}")
+    except Exception as e:
+        print("❌ Drug store build failed:", e)
@@ -0,0 +1,175 @@
+# export_feedback.py
+# Streams chat and prescription feedback, joined with the rated text and the
+# user's profile, to compressed JSONL or Parquet for RLHF / offline evaluation:
+#   python export_feedback.py out_dir [--format jsonl|parquet] [--incremental] [--pseudonymize]
+# Incremental runs pick up from an (updated_at, id) high-water mark, like
+# rollups.py, so a rating flipped after an export is exported again; keep the
+# row with the latest updated_at per id downstream.
+import os
+import json
+import gzip
+import hmac
+import hashlib
+import argparse
+import datetime
+from sqlalchemy import select, or_, and_, Integer, DateTime, String
+from dotenv import load_dotenv
+from db import read_engine, User, Conversation, ChatFeedback, PrescriptionFeedback, PrescriptionAnalysis
+from rollups import EPOCH, SAFETY_LAG
+
+load_dotenv()
+SECRET_KEY = os.getenv("SECRET_KEY", "")
+CHUNK_SIZE = 1000
+STATE_FILE = "export_state.json"
+PROFILE_COLUMNS = (User.age, User.gender, User.conditions, User.allergies, User.medications)
+
+def _after(query, model, mark, cutoff):
+    after_time, after_id = mark
+    return (query.where(or_(model.updated_at > after_time, and_(model.updated_at == after_time, model.id > after_id)),
+                        model.updated_at <= cutoff)
+            .order_by(model.updated_at, model.id))
+
+def chat_query(mark, cutoff):
+    query = (select(ChatFeedback.id, ChatFeedback.user_id, ChatFeedback.feedback, ChatFeedback.updated_at,
+                    Conversation.id.label("conversation_id"), Conversation.message.label("question"),
+                    Conversation.response.label("answer"), Conversation.timestamp, *PROFILE_COLUMNS)
+             .join(Conversation, ChatFeedback.conversation_id == Conversation.id)
+             .join(User, ChatFeedback.user_id == User.id))
+    return _after(query, ChatFeedback, mark, cutoff)
+
+def prescription_query(mark, cutoff):
+    query = (select(PrescriptionFeedback.id, PrescriptionFeedback.user_id, PrescriptionFeedback.feedback,
+                    PrescriptionFeedback.updated_at, PrescriptionAnalysis.id.label("analysis_id"),
+                    PrescriptionAnalysis.filename, PrescriptionAnalysis.result,
+                    PrescriptionAnalysis.created_at.label("timestamp"), *PROFILE_COLUMNS)
+             .join(PrescriptionAnalysis, PrescriptionFeedback.analysis_id == PrescriptionAnalysis.id)
+             .join(User, PrescriptionFeedback.user_id == User.id))
+    return _after(query, PrescriptionFeedback, mark, cutoff)
+
+SOURCES = {
+    "chat_feedback": chat_query,
+    "prescription_feedback": prescription_query,
+}
+
+def pseudonym(user_id):
+    return hmac.new(SECRET_KEY.encode(), str(user_id).encode(), hashlib.sha256).hexdigest()[:16]
+
+def columns(query_fn, pseudonymize=False):
+    # (name, SQL type) of each exported column; pseudonymized user ids are strings.
+    cols = []
+    for col in query_fn((EPOCH, 0), EPOCH).selected_columns:
+        cols.append((col.name, String() if pseudonymize and col.name == "user_id" else col.type))
+    return cols
+
+def stream_rows(query_fn, mark, cutoff, chunk=CHUNK_SIZE):
+    # Keyset chunks over a server-side cursor: memory stays at one chunk even
+    # on drivers that ignore stream_results.
+    while True:
+        with read_engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=chunk).execute(
+                query_fn(mark, cutoff).limit(chunk))
+            rows = [dict(row._mapping) for row in result]
+        if not rows:
+            return
+        mark = (rows[-1]["updated_at"], rows[-1]["id"])
+        yield rows
+
+def _jsonable(row):
+    return {k: v.isoformat() if isinstance(v, datetime.datetime) else v for k, v in row.items()}
+
+class JsonlWriter:
+    def __init__(self, path, columns):
+        self.path = path + ".jsonl.gz"
+        self.f = gzip.open(self.path, "wt", encoding="utf-8")
+
+    def write(self, rows):
+        for row in rows:
+            self.f.write(json.dumps(_jsonable(row), ensure_ascii=False) + "\n")
+
+    def close(self):
+        self.f.close()
+
+class ParquetWriter:
+    def __init__(self, path, columns):
+        import pyarrow
+        import pyarrow.parquet
+        self.pa, self.pq = pyarrow, pyarrow.parquet
+        self.path = path + ".parquet"
+        # Declared up front: a schema inferred from the first chunk makes a
+        # column that is all None there a null column, and later chunks fail to cast.
+        self.schema = pyarrow.schema([(name, self._arrow_type(kind)) for name, kind in columns])
+        self.writer = self.pq.ParquetWriter(self.path, self.schema, compression="zstd")
+
+    def _arrow_type(self, kind):
+        if isinstance(kind, Integer):
+            return self.pa.int64()
+        if isinstance(kind, DateTime):
+            return self.pa.timestamp("us")
+        return self.pa.string()
+
+    def write(self, rows):
+        self.writer.write_table(self.pa.Table.from_pylist(rows, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+WRITERS = {"jsonl": JsonlWriter, "parquet": ParquetWriter}
+
+def load_state(out_dir):
+    path = os.path.join(out_dir, STATE_FILE)
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+def save_state(out_dir, state):
+    path = os.path.join(out_dir, STATE_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+def _mark(value):
+    # Marks from before (updated_at, id) were bare ids and cannot tell which
+    # ratings changed since, so those sources are exported again from the start.
+    if isinstance(value, dict):
+        return datetime.datetime.fromisoformat(value["updated_at"]), value["id"]
+    return EPOCH, 0
+
+def export_feedback(out_dir, fmt="jsonl", incremental=False, pseudonymize=False, chunk=CHUNK_SIZE):
+    os.makedirs(out_dir, exist_ok=True)
+    state = load_state(out_dir) if incremental else {}
+    stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    # Rows updated within SAFETY_LAG may still be behind uncommitted ones with earlier timestamps.
+    cutoff = datetime.datetime.now() - SAFETY_LAG
+    for name, query_fn in SOURCES.items():
+        mark = _mark(state.get(name))
+        writer, count = None, 0
+        for rows in stream_rows(query_fn, mark, cutoff, chunk):
+            if pseudonymize:
+                for row in rows:
+                    row["user_id"] = pseudonym(row["user_id"])
+            if writer is None:
+                writer = WRITERS[fmt](os.path.join(out_dir, f"{name}_{stamp}"), columns(query_fn, pseudonymize))
+            writer.write(rows)
+            count += len(rows)
+            mark = (rows[-1]["updated_at"], rows[-1]["id"])
+        if writer is not None:
+            writer.close()
+            print(f"✅ {name}: {count} rows -> {writer.path}")
+        else:
+            print(f"{name}: no new rows")
+        state[name] = {"updated_at": mark[0].isoformat(), "id": mark[1]}
+    if incremental:
+        save_state(out_dir, state)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the Curo feedback corpus")
+    parser.add_argument("out_dir")
+    parser.add_argument("--format", choices=sorted(WRITERS), default="jsonl")
+    parser.add_argument("--incremental", action="store_true", help="only rows added or re-rated since the last export")
+    parser.add_argument("--pseudonymize", action="store_true", help="replace user ids with keyed hashes (uses SECRET_KEY)")
+    parser.add_argument("--chunk", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+    if args.pseudonymize and not SECRET_KEY:
+        parser.error("--pseudonymize needs SECRET_KEY to be set")
+    export_feedback(args.out_dir, args.format, args.incremental, args.pseudonymize, args.chunk)
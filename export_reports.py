@@ -0,0 +1,61 @@
+# export_reports.py
+# Bulk-render chat history reports for many users in a process pool:
+#   python export_reports.py out_dir [--users 1,2,3] [--workers 4]
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from db import SessionLocal, engine, User, Conversation
+from reports import write_chat_pdf
+
+def _init_worker():
+    # Forked workers must not reuse the parent's pooled connections.
+    engine.dispose(close=False)
+
+def render_user_report(user_id, out_dir):
+    db = SessionLocal()
+    try:
+        user = db.get(User, user_id)
+        if user is None:
+            return user_id, None
+        chats = [
+            {"user": c.message or "", "assistant": c.response or "",
+             "user_time": c.timestamp, "assistant_time": c.timestamp}
+            for c in db.query(Conversation).filter_by(user_id=user_id).order_by(Conversation.id).yield_per(200)
+        ]
+        db.expunge(user)
+    finally:
+        db.close()
+    if not chats:
+        return user_id, None
+    path = os.path.join(out_dir, f"curo_chat_user_{user_id}.pdf")
+    write_chat_pdf(path, chats, user, f"user-{user_id}-history")
+    return user_id, path
+
+def export_reports(out_dir, user_ids=None, workers=None):
+    os.makedirs(out_dir, exist_ok=True)
+    if user_ids is None:
+        db = SessionLocal()
+        user_ids = [uid for (uid,) in db.query(User.id).order_by(User.id)]
+        db.close()
+    done, failed = 0, 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = {pool.submit(render_user_report, uid, out_dir): uid for uid in user_ids}
+        for future in as_completed(futures):
+            try:
+                uid, path = future.result()
+                if path:
+                    done += 1
+                    print(f"✅ user {uid}: {path}")
+            except Exception as e:
+                failed += 1
+                print(f"❌ user {futures[future]}: {e}")
+    print(f"Rendered {done} reports, {failed} failures")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk export Curo chat reports as PDF")
+    parser.add_argument("out_dir")
+    parser.add_argument("--users", help="comma-separated user ids (default: all users)")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    ids = [int(u) for u in args.users.split(",")] if args.users else None
+    export_reports(args.out_dir, ids, args.workers)
@@ -0,0 +1,112 @@
+# image_pipeline.py
+import io
+import os
+from PIL import Image, ImageOps
+from dotenv import load_dotenv
+
+load_dotenv()
+MAX_UPLOAD_BYTES = int(os.getenv("PRESCRIPTION_MAX_UPLOAD_BYTES", 15_000_000))
+MAX_DIM = int(os.getenv("PRESCRIPTION_MAX_DIM", 1024))
+TARGET_BYTES = int(os.getenv("PRESCRIPTION_TARGET_BYTES", 120_000))
+MIN_QUALITY = 35
+MAX_QUALITY = 90
+# Pixels lighter than this (after grayscale) count as blank paper when cropping.
+MARGIN_THRESHOLD = 235
+MARGIN_PAD = 12
+
+def _open_draft(file_bytes, max_dim, grayscale):
+    image = Image.open(io.BytesIO(file_bytes))
+    if image.format == "JPEG":
+        # Let libjpeg decode at 1/2, 1/4 or 1/8 scale instead of full resolution.
+        image.draft("L" if grayscale else "RGB", (max_dim, max_dim))
+    image = ImageOps.exif_transpose(image)
+    return image
+
+def _flatten(image, grayscale):
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGBA", image.size, (255, 255, 255, 255))
+        image = Image.alpha_composite(background, image)
+    if grayscale:
+        return image.convert("L")
+    return image.convert("RGB") if image.mode != "RGB" else image
+
+def crop_margins(image, threshold=MARGIN_THRESHOLD, pad=MARGIN_PAD):
+    gray = image if image.mode == "L" else image.convert("L")
+    mask = gray.point(lambda p: 255 if p < threshold else 0)
+    bbox = mask.getbbox()
+    if not bbox:
+        return image
+    left, top, right, bottom = bbox
+    left, top = max(0, left - pad), max(0, top - pad)
+    right, bottom = min(image.width, right + pad), min(image.height, bottom + pad)
+    if (right - left) * (bottom - top) >= image.width * image.height * 0.98:
+        return image
+    return image.crop((left, top, right, bottom))
+
+def encode_to_budget(image, target_bytes=TARGET_BYTES):
+    lo, hi = MIN_QUALITY, MAX_QUALITY
+    best = None
+    while lo <= hi:
+        quality = (lo + hi) // 2
+        buf = io.BytesIO()
+        image.save(buf, format="JPEG", quality=quality, optimize=True)
+        data = buf.getvalue()
+        if len(data) <= target_bytes:
+            best = data
+            lo = quality + 1
+        else:
+            hi = quality - 1
+    if best is None:
+        buf = io.BytesIO()
+        image.save(buf, format="JPEG", quality=MIN_QUALITY, optimize=True)
+        best = buf.getvalue()
+    return best
+
+def _is_small_jpeg(file_bytes, max_dim, target_bytes):
+    if len(file_bytes) > target_bytes:
+        return False
+    try:
+        image = Image.open(io.BytesIO(file_bytes))
+    except Exception:
+        return False
+    return image.format == "JPEG" and max(image.size) <= max_dim
+
+def preprocess_image(file_bytes, max_dim=MAX_DIM, grayscale=True, normalize=True,
+                     autocrop=True, target_bytes=TARGET_BYTES):
+    if len(file_bytes) > MAX_UPLOAD_BYTES:
+        raise ValueError(f"Image is larger than {MAX_UPLOAD_BYTES // 1_000_000}MB")
+    # Output of a previous pass: re-encoding would only lose detail.
+    if _is_small_jpeg(file_bytes, max_dim, target_bytes):
+        return file_bytes
+    image = _open_draft(file_bytes, max_dim, grayscale)
+    image = _flatten(image, grayscale)
+    if autocrop:
+        image = crop_margins(image)
+    image.thumbnail((max_dim, max_dim), Image.LANCZOS)
+    if normalize:
+        image = ImageOps.autocontrast(image, cutoff=1)
+    return encode_to_budget(image, target_bytes)
+
+def dhash(file_bytes, size=8):
+    # 64-bit difference hash: each bit says whether a pixel is brighter than its
+    # right neighbour on a 9x8 thumbnail. Re-shot photos of the same page land a
+    # few bits apart, unlike a byte hash.
+    image = Image.open(io.BytesIO(file_bytes))
+    image.draft("L", (size * 4, size * 4))
+    pixels = list(image.convert("L").resize((size + 1, size), Image.LANCZOS).getdata())
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left, right = pixels[row * (size + 1) + col], pixels[row * (size + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f"{bits:0{size * size // 4}x}"
+
+def legacy_downscale(file_bytes, max_dim=800):
+    image = Image.open(io.BytesIO(file_bytes))
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    image.thumbnail((max_dim, max_dim))
+    buf = io.BytesIO()
+    image.save(buf, format='JPEG')
+    return buf.getvalue()
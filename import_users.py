@@ -0,0 +1,256 @@
+# import_users.py
+# Bulk import of users and their profiles (e.g. onboarding a partner clinic)
+# from CSV or JSONL with the columns / keys
+#   username, password, age, gender, conditions, allergies, medications
+# (password_hash may replace password for accounts exported from another Curo
+# database; list values in JSONL are joined with ", "). The file is streamed,
+# passwords are hashed in a process pool a few batches ahead of the database,
+# and each batch is committed as multi-row upserts keyed on username: new users
+# are created, existing ones get the profile columns the file has (an empty
+# cell clears that field; a missing column or JSON key leaves it alone) and
+# keep their password unless --reset-passwords. Rejected rows are written with their line
+# number to <input>.errors.csv. Progress is checkpointed after every committed
+# batch, so running the same command again after an interruption resumes there:
+#   python import_users.py clinic_users.csv [--batch 5000] [--workers 4] [--reset-passwords] [--restart]
+import os
+import csv
+import json
+import time
+import hashlib
+import argparse
+from collections import deque, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+from db import SessionLocal, engine, User, init_db, upsert
+from auth import hash_passwords
+
+BATCH_SIZE = 5000
+PROFILE_FIELDS = ("age", "gender", "conditions", "allergies", "medications")
+MAX_LENGTHS = {"username": 50, "gender": 10}
+# Rows per INSERT; keeps SQLite under its bind-parameter limit.
+STATEMENT_ROWS = {"sqlite": 100}
+DEFAULT_STATEMENT_ROWS = 1000
+FINGERPRINT_BYTES = 1 << 16
+
+def read_rows(path, fmt):
+    # -> (line number, row dict, parse error) per record, streamed.
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        if fmt == "csv":
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row, None
+        else:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_no, json.loads(line), None
+                except ValueError as e:
+                    yield line_no, None, f"invalid JSON: {e}"
+
+def _text(value):
+    if isinstance(value, list):
+        value = ", ".join(str(v).strip() for v in value if str(v).strip())
+    value = str(value).strip() if value is not None else ""
+    return value or None
+
+def clean_row(row):
+    # -> (record, plaintext password or None, error); profile fields the row
+    # does not have are left out of the record, so they are never overwritten.
+    if not isinstance(row, dict):
+        return None, None, "not an object"
+    record = {"username": _text(row.get("username"))}
+    for field in ("username", "gender", "conditions", "allergies", "medications"):
+        if field not in row:
+            continue
+        record[field] = _text(row[field])
+        if record[field] and len(record[field]) > MAX_LENGTHS.get(field, len(record[field])):
+            return None, None, f"{field} longer than {MAX_LENGTHS[field]} characters"
+    if not record["username"]:
+        return None, None, "missing username"
+    if "age" in row:
+        age = _text(row["age"])
+        if age is not None:
+            try:
+                age = int(float(age))
+            except (ValueError, OverflowError):
+                return None, None, f"invalid age {age!r}"
+            if not 0 <= age <= 150:
+                return None, None, f"age {age} out of range"
+        record["age"] = age
+    password_hash = _text(row.get("password_hash"))
+    if password_hash:
+        password_hash = password_hash.lower()
+        if len(password_hash) != 64 or set(password_hash) - set("0123456789abcdef"):
+            return None, None, "password_hash is not a SHA-256 hex digest"
+        record["password"] = password_hash
+        return record, None, None
+    password = row.get("password")
+    if password is None or str(password) == "":
+        return None, None, "missing password"
+    return record, str(password), None
+
+def batches(rows, size, after_line):
+    # -> (valid [(line, record, password)], rejected [(line, username, error)], last line)
+    batch, rejected, last = [], [], after_line
+    for line_no, row, error in rows:
+        if line_no <= after_line:
+            continue
+        last = line_no
+        record, password = None, None
+        if error is None:
+            record, password, error = clean_row(row)
+        if error:
+            rejected.append((line_no, _text(row.get("username")) if isinstance(row, dict) else None, error))
+        else:
+            batch.append((line_no, record, password))
+        if len(batch) >= size:
+            yield batch, rejected, last
+            batch, rejected = [], []
+    if batch or rejected:
+        yield batch, rejected, last
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def _error_message(e):
+    return str(getattr(e, "orig", None) or e).splitlines()[0]
+
+def _update_columns(record, reset_passwords):
+    columns = [f for f in PROFILE_FIELDS if f in record] + (["password"] if reset_passwords else [])
+    # Upserts need something to set on a conflict; username = username changes nothing.
+    return columns or ["username"]
+
+def write_batch(db, batch, hashes, reset_passwords=False, statement_rows=DEFAULT_STATEMENT_ROWS):
+    # -> (inserted, updated, failed [(line, username, error)])
+    hashes = iter(hashes)
+    by_name, failed = {}, []
+    for line_no, record, password in batch:
+        if password is not None:
+            record["password"] = next(hashes)
+        earlier = by_name.get(record["username"])
+        if earlier:
+            failed.append((earlier[0], record["username"], f"duplicate username, superseded by line {line_no}"))
+        by_name[record["username"]] = (line_no, record)
+    names = list(by_name)
+    existing = set()
+    for chunk in _chunks(names, statement_rows):
+        existing.update(db.scalars(select(User.username).where(User.username.in_(chunk))))
+    # One statement needs the same columns in every row.
+    groups = defaultdict(list)
+    for _, record in by_name.values():
+        groups[tuple(_update_columns(record, reset_passwords))].append(record)
+    try:
+        with db.begin_nested():
+            for columns, records in groups.items():
+                for chunk in _chunks(records, statement_rows):
+                    upsert(db, User, chunk, ["username"], list(columns))
+    except SQLAlchemyError:
+        # Pin the failure down one savepoint per row; the rest of the batch still goes in.
+        for name, (line_no, record) in list(by_name.items()):
+            try:
+                with db.begin_nested():
+                    upsert(db, User, [record], ["username"], _update_columns(record, reset_passwords))
+            except SQLAlchemyError as e:
+                failed.append((line_no, name, _error_message(e)))
+                del by_name[name]
+    updated = sum(1 for name in by_name if name in existing)
+    return len(by_name) - updated, updated, failed
+
+def file_fingerprint(path):
+    with open(path, "rb") as f:
+        head = f.read(FINGERPRINT_BYTES)
+    return f"{os.path.getsize(path)}:{hashlib.sha256(head).hexdigest()[:16]}"
+
+def load_state(path):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return None
+
+def save_state(path, state):
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+def import_users(path, fmt=None, batch_size=BATCH_SIZE, workers=None, reset_passwords=False, restart=False):
+    fmt = fmt or ("jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv")
+    state_path, errors_path = path + ".import_state.json", path + ".errors.csv"
+    fingerprint = file_fingerprint(path)
+    state = None if restart else load_state(state_path)
+    if state and state["fingerprint"] != fingerprint:
+        raise SystemExit(f"{path} changed since the interrupted import; use --restart to import it from the top")
+    if state:
+        print(f"Resuming after line {state['line']} ({state['inserted']} created, {state['updated']} updated so far)")
+    else:
+        state = {"fingerprint": fingerprint, "line": 0, "inserted": 0, "updated": 0, "rejected": 0}
+    init_db()
+    statement_rows = STATEMENT_ROWS.get(engine.dialect.name, DEFAULT_STATEMENT_ROWS)
+    workers = (os.cpu_count() or 1) if workers is None else workers
+    pool = ProcessPoolExecutor(workers) if workers > 0 else None
+    source = batches(read_rows(path, fmt), batch_size, state["line"])
+    pending = deque()
+
+    def fill():
+        # Keep every worker busy hashing upcoming batches while the current one is written.
+        while len(pending) < max(1, workers) + 1:
+            item = next(source, None)
+            if item is None:
+                return
+            batch, rejected, last_line = item
+            passwords = [p for _, _, p in batch if p is not None]
+            hashed = pool.submit(hash_passwords, passwords) if pool else hash_passwords(passwords)
+            pending.append((batch, rejected, last_line, hashed))
+
+    errors_file = open(errors_path, "a" if state["line"] else "w", newline="")
+    errors = csv.writer(errors_file)
+    if errors_file.tell() == 0:
+        errors.writerow(["line", "username", "error"])
+    db = SessionLocal()
+    started, processed = time.perf_counter(), 0
+    try:
+        fill()
+        while pending:
+            batch, rejected, last_line, hashed = pending.popleft()
+            fill()
+            inserted, updated, failed = write_batch(db, batch, hashed.result() if pool else hashed,
+                                                    reset_passwords, statement_rows)
+            db.commit()
+            # Written after the commit: a batch redone on resume is an idempotent upsert.
+            errors.writerows(sorted(rejected + failed))
+            errors_file.flush()
+            state["line"] = last_line
+            state["inserted"] += inserted
+            state["updated"] += updated
+            state["rejected"] += len(rejected) + len(failed)
+            save_state(state_path, state)
+            processed += len(batch) + len(rejected)
+            elapsed = time.perf_counter() - started
+            print(f"line {last_line}: {inserted} created, {updated} updated, {len(rejected) + len(failed)} rejected "
+                  f"({processed / max(elapsed, 1e-9):.0f} rows/s)")
+    finally:
+        db.close()
+        errors_file.close()
+        if pool:
+            pool.shutdown(cancel_futures=True)
+    elapsed = time.perf_counter() - started
+    if os.path.exists(state_path):
+        os.remove(state_path)
+    print(f"✅ {state['inserted']} users created, {state['updated']} updated, {state['rejected']} rejected "
+          f"({processed} rows in {elapsed:.1f}s, {processed / max(elapsed, 1e-9):.0f} rows/s)")
+    if state["rejected"]:
+        print(f"Rejected rows: {errors_path}")
+    return state
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk import users and profiles from CSV or JSONL")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="default: from the file extension")
+    parser.add_argument("--batch", type=int, default=BATCH_SIZE, help="rows per committed batch")
+    parser.add_argument("--workers", type=int, help="password hashing processes (default: CPU count, 0 = inline)")
+    parser.add_argument("--reset-passwords", action="store_true", help="also overwrite passwords of existing users")
+    parser.add_argument("--restart", action="store_true", help="ignore a saved checkpoint and start from the top")
+    args = parser.parse_args()
+    import_users(args.path, args.format, args.batch, args.workers, args.reset_passwords, args.restart)
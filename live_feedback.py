@@ -0,0 +1,125 @@
+# live_feedback.py
+# Incrementally updated feedback aggregates for the live dashboard
+# (pages/feedback.py). The state starts from the rollup table; every tick then
+# reads only feedback rows past an (updated_at, id) high-water mark, which
+# covers new rows (ids above the mark) and re-rated ones (upserts bump
+# updated_at in place), and recomputes just the (day, user) groups they touch.
+# One instance per server process serves every open dashboard, and ticks are
+# spaced at least LIVE_MIN_INTERVAL_SECONDS apart however many viewers poll.
+import os
+import time
+import datetime
+import threading
+from collections import defaultdict
+from sqlalchemy import or_, and_
+from dotenv import load_dotenv
+from db import ReadSessionLocal, User, FeedbackRollup, RollupState
+from rollups import KINDS, EPOCH, SAFETY_LAG, aggregate_groups, archive_horizon
+
+load_dotenv()
+LIVE_MIN_INTERVAL = float(os.getenv("LIVE_MIN_INTERVAL_SECONDS", 3))
+# A full reload from the rollups picks up rebuilds and archiving done elsewhere.
+LIVE_RESYNC_SECONDS = int(os.getenv("LIVE_RESYNC_SECONDS", 3600))
+RECENT_ROWS = 10
+FETCH_LIMIT = 5000
+
+class Snapshot:
+    __slots__ = ("version", "groups", "users", "recent", "updated_at", "fetched")
+
+    def __init__(self, version, groups, users, recent, fetched):
+        self.version = version
+        # {(day, kind, user_id): (total, positive)}
+        self.groups = groups
+        self.users = users
+        # {kind: [(id, created_at, user_id, feedback)] newest first}
+        self.recent = recent
+        self.updated_at = datetime.datetime.now()
+        self.fetched = fetched
+
+class LiveFeedback:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._high_water = {}
+        self._last_tick = 0.0
+        self._synced_at = 0.0
+        # Replaced whole on every change, so readers never see a half-applied tick.
+        self.snapshot = Snapshot(0, {}, {}, {kind: [] for kind in KINDS}, 0)
+
+    def _resync(self, db):
+        # Rollup rows and their high-water marks are committed together; reading
+        # both in one transaction gives a consistent starting point.
+        groups = {(day, kind, user_id): (total, positive) for day, kind, user_id, total, positive in
+                  db.query(FeedbackRollup.day, FeedbackRollup.kind, FeedbackRollup.user_id,
+                           FeedbackRollup.total, FeedbackRollup.positive)}
+        for kind in KINDS:
+            state = db.get(RollupState, f"feedback_{kind}")
+            self._high_water[kind] = (state.high_water_time, state.high_water_id) if state else (EPOCH, 0)
+        recent = {kind: [tuple(r) for r in db.query(model.id, model.created_at, model.user_id, model.feedback)
+                         .order_by(model.id.desc()).limit(RECENT_ROWS)]
+                  for kind, model in KINDS.items()}
+        users = dict(db.query(User.id, User.username).all())
+        self.snapshot = Snapshot(self.snapshot.version + 1, groups, users, recent, len(groups))
+        self._synced_at = time.monotonic()
+
+    def _advance(self, db):
+        current = self.snapshot
+        groups, recent, fetched = None, dict(current.recent), 0
+        cutoff = datetime.datetime.now() - SAFETY_LAG
+        for kind, model in KINDS.items():
+            hw_time, hw_id = self._high_water[kind]
+            rows = (db.query(model.id, model.created_at, model.user_id, model.feedback, model.updated_at)
+                    .filter(or_(model.updated_at > hw_time, and_(model.updated_at == hw_time, model.id > hw_id)),
+                            model.updated_at <= cutoff)
+                    .order_by(model.updated_at, model.id)
+                    .limit(FETCH_LIMIT).all())
+            if not rows:
+                continue
+            fetched += len(rows)
+            horizon = archive_horizon(db, kind)
+            keys = defaultdict(set)
+            for row in rows:
+                if row.user_id is not None and (horizon is None or row.created_at >= horizon):
+                    keys[row.created_at.date()].add(row.user_id)
+            if groups is None:
+                groups = dict(current.groups)
+            for (day, user_id), (total, positive) in aggregate_groups(db, model, keys).items():
+                if total:
+                    groups[(day, kind, user_id)] = (total, positive)
+                else:
+                    groups.pop((day, kind, user_id), None)
+            merged = {r[0]: r for r in recent[kind]}
+            merged.update({r.id: (r.id, r.created_at, r.user_id, r.feedback) for r in rows})
+            recent[kind] = sorted(merged.values(), reverse=True)[:RECENT_ROWS]
+            self._high_water[kind] = (rows[-1].updated_at, rows[-1].id)
+        if not fetched:
+            return False
+        users = current.users
+        seen = {user_id for _, _, user_id in (groups or {})} | {r[2] for rows in recent.values() for r in rows}
+        missing = {user_id for user_id in seen if user_id is not None and user_id not in users}
+        if missing:
+            users = {**users, **dict(db.query(User.id, User.username).filter(User.id.in_(missing)).all())}
+        self.snapshot = Snapshot(current.version + 1, groups if groups is not None else current.groups,
+                                 users, recent, fetched)
+        return True
+
+    def tick(self):
+        # Returns the current snapshot, first advancing it if the last tick is old
+        # enough. A session that finds another one mid-tick just reads the old
+        # snapshot, unless there is none yet.
+        if time.monotonic() - self._last_tick >= LIVE_MIN_INTERVAL and \
+                self._lock.acquire(blocking=not self._synced_at):
+            try:
+                self._last_tick = time.monotonic()
+                db = ReadSessionLocal()
+                try:
+                    if not self._synced_at or time.monotonic() - self._synced_at > LIVE_RESYNC_SECONDS:
+                        self._resync(db)
+                    else:
+                        self._advance(db)
+                finally:
+                    db.close()
+            except Exception as e:
+                print("Live feedback refresh failed:", e)
+            finally:
+                self._lock.release()
+        return self.snapshot
@@ -0,0 +1,477 @@
+# loadtest.py
+# Concurrent-session load test against one real app process. It starts
+# `streamlit run app.py` once and connects N websocket clients to it, each
+# speaking the browser's protocol (widget states in, deltas out) through
+# sign-up, login, chat turns, feedback clicks, a prescription upload, history
+# search, both analytics views, against stub_services.py and a local database:
+#   python loadtest.py --ramp 1,5,10,20 --turns 3
+#   python loadtest.py --ramp 10 --latency-ms 1500 --database-url mysql+pymysql://...
+# While a level runs, the server process's CPU time and RSS are read from /proc
+# and its connection pool and scheduler gauges from SCHEDULER_METRICS_PORT, so
+# the report shows what one app process spends on N sessions. Linux only.
+import os
+import io
+import re
+import sys
+import time
+import json
+import uuid
+import random
+import socket
+import asyncio
+import argparse
+import threading
+import subprocess
+import urllib.request
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+APP_SCRIPT = os.path.join(ROOT, "app.py")
+QUESTIONS = [
+    "Is it safe to take ibuprofen with food?",
+    "How much water should I drink when I have a fever?",
+    "What should I do for a persistent dry cough?",
+    "Can I take paracetamol with my blood pressure medicine?",
+    "How can I improve my sleep with mild anxiety?",
+]
+SCRIPT_TIMEOUT = 120
+STARTUP_TIMEOUT = 60
+SAMPLE_INTERVAL = 0.5
+# ScriptFinishedStatus values; FINISHED_EARLY_FOR_RERUN (st.rerun) is followed by another run.
+SCRIPT_OK, SCRIPT_COMPILE_ERROR = 0, 1
+_METRIC = re.compile(r"^([a-zA-Z_:][\w:]*)(\{[^}]*\})?\s+(\S+)$")
+
+def sample_prescription(seed):
+    from PIL import Image, ImageDraw
+    rng = random.Random(seed)
+    img = Image.new("RGB", (1240, 1754), "white")
+    draw = ImageDraw.Draw(img)
+    for i, line in enumerate(["Rx", "Tab Paracetamol 650 mg 1-0-1", "Cap Amoxicillin 500 mg TDS x 5 days",
+                              "Tab Pantoprazole 40 mg OD", "Review after 5 days"]):
+        draw.text((120 + rng.randint(0, 40), 200 + i * 90), line, fill="black")
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=90)
+    return buf.getvalue()
+
+def _multipart(name, data, content_type):
+    boundary = uuid.uuid4().hex
+    body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{name}\"\r\n"
+            f"Content-Type: {content_type}\r\n\r\n").encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+class Client:
+    # One browser tab: a websocket session that keeps its widget states and
+    # replays them with every rerun, like the frontend does.
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.ws = None
+        self.reader = None
+        self.session_id = None
+        self.pages = {}
+        self.page_hash = ""
+        self.elements = {}
+        self.states = {}
+        self.cache = {}
+        self.finished = asyncio.Event()
+        self.status = None
+        self.uploads = {}
+
+    async def connect(self):
+        from tornado.websocket import websocket_connect
+        self.ws = await websocket_connect(self.base_url.replace("http", "ws", 1) + "/_stcore/stream",
+                                          max_message_size=64 << 20)
+        self.reader = asyncio.ensure_future(self._read())
+        await self.run()
+
+    def close(self):
+        if self.ws is not None:
+            self.ws.close()
+        if self.reader is not None:
+            self.reader.cancel()
+
+    async def _send(self, back):
+        await self.ws.write_message(back.SerializeToString(), binary=True)
+
+    async def _read(self):
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+        while True:
+            data = await self.ws.read_message()
+            if data is None:
+                self.status = "connection closed"
+                self.finished.set()
+                return
+            msg = ForwardMsg()
+            msg.ParseFromString(data)
+            kind = msg.WhichOneof("type")
+            if kind == "ref_hash":
+                # The server only sends a reference for messages this client has cached.
+                ref, msg = msg, ForwardMsg()
+                msg.CopyFrom(self.cache[ref.ref_hash])
+                msg.metadata.CopyFrom(ref.metadata)
+                kind = msg.WhichOneof("type")
+            elif msg.metadata.cacheable:
+                self.cache[msg.hash] = msg
+            if kind == "new_session":
+                if msg.new_session.HasField("initialize"):
+                    self.session_id = msg.new_session.initialize.session_id
+                self.pages = {p.page_name: p.page_script_hash for p in msg.new_session.app_pages}
+                self.page_hash = msg.new_session.page_script_hash
+                self.elements = {}
+            elif kind == "delta" and msg.delta.WhichOneof("type") == "new_element":
+                self.elements[tuple(msg.metadata.delta_path)] = msg.delta.new_element
+            elif kind == "script_finished" and msg.script_finished in (SCRIPT_OK, SCRIPT_COMPILE_ERROR):
+                self.status = msg.script_finished
+                self.finished.set()
+            elif kind == "file_urls_response":
+                future = self.uploads.pop(msg.file_urls_response.response_id, None)
+                if future is not None:
+                    future.set_result(msg.file_urls_response)
+
+    async def run(self, trigger=None):
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        back = BackMsg()
+        client_state = back.rerun_script
+        client_state.page_script_hash = self.page_hash
+        client_state.widget_states.widgets.extend(self.states.values())
+        if trigger is not None:
+            widget = client_state.widget_states.widgets.add()
+            widget.id = trigger
+            widget.trigger_value = True
+        self.finished.clear()
+        self.status = None
+        await self._send(back)
+        await asyncio.wait_for(self.finished.wait(), SCRIPT_TIMEOUT)
+        if self.status != SCRIPT_OK:
+            raise RuntimeError(f"script did not finish: {self.status}")
+        for element in self.elements.values():
+            if element.WhichOneof("type") == "exception":
+                raise RuntimeError(f"{element.exception.type}: {element.exception.message}")
+
+    def widgets(self, kind):
+        return [getattr(e, kind) for _, e in sorted(self.elements.items()) if e.WhichOneof("type") == kind]
+
+    def widget(self, kind, key=None, label=None):
+        # Keyed widget ids end with "-<key>".
+        for w in self.widgets(kind):
+            if (key is None or w.id.endswith("-" + key)) and (label is None or w.label == label):
+                return w
+        raise LookupError(f"no {kind} with key={key!r} label={label!r}")
+
+    def set_state(self, widget_id, **value):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+        state = WidgetState(id=widget_id)
+        for field, v in value.items():
+            setattr(state, field, v)
+        self.states[widget_id] = state
+        return state
+
+    async def type(self, key, text):
+        self.set_state(self.widget("text_input", key=key).id, string_value=text)
+
+    async def click(self, label=None, key=None):
+        await self.run(trigger=self.widget("button", key=key, label=label).id)
+
+    async def choose(self, label, option):
+        radio = self.widget("radio", label=label)
+        self.set_state(radio.id, int_value=list(radio.options).index(option))
+        await self.run()
+
+    async def open_page(self, name):
+        self.page_hash = self.pages[name]
+        await self.run()
+
+    async def upload(self, files):
+        # files: [(name, bytes)]; the same URL request and PUT the browser makes.
+        from tornado.httpclient import AsyncHTTPClient
+        from urllib.parse import urljoin
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.Common_pb2 import UploadedFileInfo
+        uploader = self.widgets("file_uploader")[0]
+        back = BackMsg()
+        back.file_urls_request.request_id = uuid.uuid4().hex
+        back.file_urls_request.file_names.extend(name for name, _ in files)
+        back.file_urls_request.session_id = self.session_id
+        future = asyncio.get_running_loop().create_future()
+        self.uploads[back.file_urls_request.request_id] = future
+        await self._send(back)
+        response = await asyncio.wait_for(future, SCRIPT_TIMEOUT)
+        if response.error_msg:
+            raise RuntimeError(response.error_msg)
+        state = self.set_state(uploader.id)
+        http = AsyncHTTPClient()
+        for (name, data), urls in zip(files, response.file_urls):
+            body, content_type = _multipart(name, data, "image/jpeg")
+            await http.fetch(urljoin(self.base_url, urls.upload_url), method="PUT", body=body,
+                             headers={"Content-Type": content_type}, request_timeout=SCRIPT_TIMEOUT)
+            state.file_uploader_state_value.uploaded_file_info.append(
+                UploadedFileInfo(file_id=urls.file_id, name=name, size=len(data), file_urls=urls))
+        await self.run()
+
+async def run_session(base_url, index, turns):
+    timings = defaultdict(list)
+    errors, failures = defaultdict(int), []
+    username, password = f"loadtest_{uuid.uuid4().hex[:8]}_{index}", "loadtest-password"
+    client = Client(base_url)
+
+    async def timed(action, coro):
+        started = time.perf_counter()
+        try:
+            await coro
+        except Exception as e:
+            errors[action] += 1
+            failures.append(f"{action}: {type(e).__name__}: {str(e)[:120]}")
+            return False
+        timings[action].append(time.perf_counter() - started)
+        return True
+
+    async def signup():
+        await client.connect()
+        await client.click("Sign Up")
+        await client.type("signup_user", username)
+        await client.type("signup_pass", password)
+        await client.click("Register")
+
+    async def login():
+        await client.click("Login")
+        await client.type("login_user", username)
+        await client.type("login_pass", password)
+        await client.click("Sign In")
+        if not client.widgets("radio"):
+            raise RuntimeError("login failed")
+
+    async def chat(question):
+        await client.type("chat_input_box", question)
+        await client.click("Send")
+
+    async def feedback():
+        await client.run(trigger=[w for w in client.widgets("button") if "-thumbs_up_" in w.id][-1].id)
+
+    async def prescription():
+        await client.upload([(f"page_{n}.jpg", sample_prescription(index * 10 + n)) for n in range(2)])
+
+    async def search():
+        await client.type("history_query", "paracetamol")
+        await client.run()
+
+    try:
+        if await timed("signup", signup()) and await timed("login", login()):
+            for turn in range(turns):
+                if await timed("chat", chat(QUESTIONS[(index + turn) % len(QUESTIONS)])):
+                    await timed("feedback", feedback())
+            await timed("prescription_tab", client.choose("Menu", "📄 Prescription Reader"))
+            await timed("prescription", prescription())
+            await timed("history_tab", client.choose("Menu", "🔎 History Search"))
+            await timed("search", search())
+            await timed("analytics_tab", client.choose("Menu", "📊 Feedback Analytics"))
+            await timed("dashboard", client.open_page("feedback"))
+    finally:
+        client.close()
+    return {"timings": dict(timings), "errors": dict(errors), "failures": failures}
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = (len(values) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+def server_connections(engine):
+    dialect = engine.dialect.name
+    queries = {
+        "mysql": "SHOW STATUS LIKE 'Threads_connected'",
+        "postgresql": "SELECT 'connections', count(*) FROM pg_stat_activity WHERE datname = current_database()",
+    }
+    if dialect not in queries:
+        return None
+    from sqlalchemy import text
+    with engine.connect() as conn:
+        return int(conn.execute(text(queries[dialect])).first()[1])
+
+def sample_connections(engine, stop, samples, interval=0.5):
+    while not stop.is_set():
+        try:
+            count = server_connections(engine)
+        except Exception:
+            count = None
+        if count is None:
+            return
+        samples.append(count)
+        stop.wait(interval)
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_app(env, log_path):
+    # -> (process, base url) once /_stcore/health answers.
+    port = free_port()
+    log = open(log_path, "w")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", APP_SCRIPT, "--server.headless", "true",
+         "--server.address", "127.0.0.1", "--server.port", str(port), "--server.fileWatcherType", "none",
+         "--server.enableXsrfProtection", "false", "--browser.gatherUsageStats", "false"],
+        cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"streamlit exited with {process.returncode}; see {log_path}")
+        try:
+            with urllib.request.urlopen(base_url + "/_stcore/health", timeout=2):
+                return process, base_url
+        except OSError:
+            time.sleep(0.5)
+    process.terminate()
+    raise SystemExit(f"streamlit did not become healthy in {STARTUP_TIMEOUT}s; see {log_path}")
+
+def process_usage(pid):
+    # -> (CPU seconds, RSS MB) of the app process, children excluded.
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    with open(f"/proc/{pid}/status") as f:
+        rss = next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+    return cpu, rss / 1024
+
+def scrape_metrics(url):
+    # -> {"name{labels}": value} from the app's Prometheus endpoint.
+    with urllib.request.urlopen(url, timeout=2) as response:
+        text = response.read().decode()
+    values = {}
+    for line in text.splitlines():
+        m = _METRIC.match(line)
+        if m:
+            values[m.group(1) + (m.group(2) or "")] = float(m.group(3))
+    return values
+
+def sample_app(pid, metrics_url, stop, samples, interval=SAMPLE_INTERVAL):
+    while not stop.is_set():
+        cpu, rss = process_usage(pid)
+        try:
+            gauges = scrape_metrics(metrics_url)
+        except OSError:
+            gauges = {}
+        samples.append((time.perf_counter(), cpu, rss, gauges))
+        stop.wait(interval)
+
+async def _run_sessions(base_url, concurrency, turns):
+    return await asyncio.gather(*(run_session(base_url, i, turns) for i in range(concurrency)))
+
+def run_level(app, base_url, metrics_url, concurrency, turns):
+    from db import engine
+    connections, app_samples, stop = [], [], threading.Event()
+    samplers = [threading.Thread(target=sample_connections, args=(engine, stop, connections), daemon=True),
+                threading.Thread(target=sample_app, args=(app.pid, metrics_url, stop, app_samples), daemon=True)]
+    baseline = process_usage(app.pid)
+    for sampler in samplers:
+        sampler.start()
+    started = time.perf_counter()
+    sessions = asyncio.run(_run_sessions(base_url, concurrency, turns))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for sampler in samplers:
+        sampler.join()
+    app_samples.append((time.perf_counter(), *process_usage(app.pid), scrape_metrics(metrics_url)))
+    return sessions, elapsed, baseline, app_samples, connections
+
+def _peaks(samples, pattern):
+    peaks = {}
+    for _, _, _, gauges in samples:
+        for name, value in gauges.items():
+            if re.match(pattern, name):
+                peaks[name] = max(value, peaks.get(name, value))
+    return peaks
+
+def report(concurrency, sessions, elapsed, baseline, app_samples, connections):
+    timings, errors, failures = defaultdict(list), defaultdict(int), defaultdict(int)
+    for s in sessions:
+        for action, values in s["timings"].items():
+            timings[action] += values
+        for action, count in s["errors"].items():
+            errors[action] += count
+        for message in s["failures"]:
+            failures[message] += 1
+    print(f"\n=== {concurrency} concurrent sessions on one app process, {elapsed:.1f}s wall ===")
+    print(f"{'action':<18}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'errors':>8}")
+    actions = list(dict.fromkeys(list(timings) + list(errors)))
+    for action in actions:
+        values = timings.get(action, [])
+        row = [percentile(values, p) * 1000 for p in (50, 95, 99, 100)]
+        print(f"{action:<18}{len(values):>6}" + "".join(f"{v:>10.0f}" for v in row) + f"{errors.get(action, 0):>8}")
+    for message, count in sorted(failures.items(), key=lambda kv: -kv[1])[:10]:
+        print(f"  ! {count}x {message}")
+    cpu_seconds = app_samples[-1][1] - baseline[0]
+    # Busiest sampling interval, in cores.
+    busiest = max(((b[1] - a[1]) / max(b[0] - a[0], 1e-9) for a, b in zip(app_samples, app_samples[1:])), default=0.0)
+    rss_peak = max(s[2] for s in app_samples)
+    print(f"app cpu: {cpu_seconds:.1f}s ({cpu_seconds / max(elapsed, 1e-9):.2f} cores mean, {busiest:.2f} peak), "
+          f"{cpu_seconds / concurrency:.2f}s per session")
+    print(f"app memory: {baseline[1]:.0f} MB before, peak {rss_peak:.0f} MB, "
+          f"{(rss_peak - baseline[1]) / concurrency:.1f} MB per session")
+    pool = _peaks(app_samples, r"curo_db_pool_(checked_out|overflow)\{")
+    queues = _peaks(app_samples, r"curo_scheduler_(queued|running)\{")
+    if pool or queues:
+        print("peaks: " + ", ".join(f"{k} {v:g}" for k, v in sorted({**pool, **queues}.items())))
+    if connections:
+        print(f"db server connections peak {max(connections)}")
+    return {
+        "concurrency": concurrency,
+        "wall_seconds": elapsed,
+        "actions": {a: {"n": len(v), "p50": percentile(v, 50), "p95": percentile(v, 95), "p99": percentile(v, 99)}
+                    for a, v in timings.items()},
+        "errors": dict(errors),
+        "app_cpu_seconds": cpu_seconds,
+        "app_cpu_peak_cores": busiest,
+        "app_rss_mb_before": baseline[1],
+        "app_rss_mb_peak": rss_peak,
+        "pool_peaks": pool,
+        "scheduler_peaks": queues,
+        "server_connections_peak": max(connections) if connections else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent-session load test for the Curo Streamlit app")
+    parser.add_argument("--ramp", default="1,5,10", help="comma-separated concurrency levels")
+    parser.add_argument("--turns", type=int, default=3, help="chat turns per session")
+    parser.add_argument("--database-url", default="sqlite:///" + os.path.join(ROOT, "loadtest.db"))
+    parser.add_argument("--latency-ms", type=int, default=300, help="mean latency of the API stand-ins")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of stand-in calls that fail")
+    parser.add_argument("--log", default=os.path.join(ROOT, "loadtest_app.log"), help="app server output")
+    parser.add_argument("--json", help="write the per-level summary to this file")
+    args = parser.parse_args()
+    os.chdir(ROOT)
+
+    import stub_services
+    server, base_url = stub_services.start(
+        latency_ms=dict.fromkeys(("groq", "gemini", "tavily"), args.latency_ms), error_rate=args.error_rate)
+    metrics_port = free_port()
+    # Set before db is imported here; the app process inherits it.
+    os.environ.update(stub_services.paths(base_url))
+    os.environ.update({"DATABASE_URL": args.database_url, "GROQ_API_KEY": "stub", "GEMINI_API_KEY": "stub",
+                       "TAVILY_API_KEY": "stub", "SCHEDULER_METRICS_PORT": str(metrics_port)})
+    from db import init_db
+    init_db()
+
+    app, app_url = start_app(dict(os.environ), args.log)
+    metrics_url = f"http://127.0.0.1:{metrics_port}/metrics"
+    summary = []
+    try:
+        # One untimed session first, so the levels measure sessions rather than imports and caches.
+        asyncio.run(_run_sessions(app_url, 1, 1))
+        for concurrency in [int(c) for c in args.ramp.split(",") if c.strip()]:
+            summary.append(report(concurrency, *run_level(app, app_url, metrics_url, concurrency, args.turns)))
+    finally:
+        app.terminate()
+        app.wait(timeout=30)
+        server.shutdown()
+    calls = {k: v for k, v in server.stats.items() if k != "lock"}
+    print(f"\nAPI stand-in calls: {calls}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+# migrations.py
+# Schema and data migrations for existing databases. Safe to re-run:
+#   python migrations.py
+import datetime
+from sqlalchemy import inspect, text
+from db import engine, init_db, compress_text, decompress_text, text_preview, PREVIEW_CHARS
+
+def _columns(conn, table):
+    return {c["name"] for c in inspect(conn).get_columns(table)}
+
+def _tables(conn):
+    return set(inspect(conn).get_table_names())
+
+def _indexes(conn, table):
+    names = {i["name"] for i in inspect(conn).get_indexes(table)}
+    names |= {u["name"] for u in inspect(conn).get_unique_constraints(table)}
+    return names
+
+def add_column(conn, table, column, ddl_type):
+    if column not in _columns(conn, table):
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}"))
+
+def drop_column(conn, table, column):
+    if column in _columns(conn, table):
+        conn.execute(text(f"ALTER TABLE {table} DROP COLUMN {column}"))
+
+def create_index(conn, table, name, columns, unique=False):
+    if name not in _indexes(conn, table):
+        kind = "UNIQUE INDEX" if unique else "INDEX"
+        conn.execute(text(f"CREATE {kind} {name} ON {table} ({', '.join(columns)})"))
+
+def _dedupe(conn, table, ref_column):
+    # Keep the latest click per (user, referenced row); it is the one the user meant.
+    rows = conn.execute(text(
+        f"SELECT user_id, {ref_column}, MAX(id) FROM {table} "
+        f"WHERE {ref_column} IS NOT NULL GROUP BY user_id, {ref_column} HAVING COUNT(*) > 1"
+    )).fetchall()
+    for user_id, ref_id, keep_id in rows:
+        conn.execute(text(
+            f"DELETE FROM {table} WHERE user_id = :u AND {ref_column} = :r AND id <> :k"
+        ), {"u": user_id, "r": ref_id, "k": keep_id})
+
+def feedback_references(conn):
+    add_column(conn, "chat_feedback", "conversation_id", "INTEGER")
+    add_column(conn, "prescription_feedback", "analysis_id", "INTEGER")
+
+    if "question" in _columns(conn, "chat_feedback"):
+        pending = conn.execute(text(
+            "SELECT id, user_id, question, answer FROM chat_feedback WHERE conversation_id IS NULL"
+        )).fetchall()
+        for fid, user_id, question, answer in pending:
+            conv = conn.execute(text(
+                "SELECT id FROM conversations WHERE user_id = :u AND message = :q AND response IN (:a, :ca) ORDER BY id LIMIT 1"
+            ), {"u": user_id, "q": question, "a": answer, "ca": compress_text(answer)}).first()
+            if conv is None:
+                conv_id = conn.execute(text(
+                    "INSERT INTO conversations (user_id, message, response, timestamp) VALUES (:u, :q, :a, :t)"
+                ), {"u": user_id, "q": question, "a": answer, "t": datetime.datetime.now()}).lastrowid
+            else:
+                conv_id = conv[0]
+            conn.execute(text("UPDATE chat_feedback SET conversation_id = :c WHERE id = :f"), {"c": conv_id, "f": fid})
+
+    if "result" in _columns(conn, "prescription_feedback"):
+        pending = conn.execute(text(
+            "SELECT id, user_id, filename, result FROM prescription_feedback WHERE analysis_id IS NULL"
+        )).fetchall()
+        for fid, user_id, filename, result in pending:
+            analysis = conn.execute(text(
+                "SELECT id FROM prescription_analyses WHERE user_id = :u AND filename = :f AND result IN (:r, :cr) ORDER BY id LIMIT 1"
+            ), {"u": user_id, "f": filename, "r": result, "cr": compress_text(result)}).first()
+            if analysis is None:
+                analysis_id = conn.execute(text(
+                    "INSERT INTO prescription_analyses (user_id, filename, result, created_at) VALUES (:u, :f, :r, :t)"
+                ), {"u": user_id, "f": filename, "r": result, "t": datetime.datetime.now()}).lastrowid
+            else:
+                analysis_id = analysis[0]
+            conn.execute(text("UPDATE prescription_feedback SET analysis_id = :a WHERE id = :f"), {"a": analysis_id, "f": fid})
+
+    _dedupe(conn, "chat_feedback", "conversation_id")
+    _dedupe(conn, "prescription_feedback", "analysis_id")
+    create_index(conn, "chat_feedback", "uq_chat_feedback_user_conversation", ["user_id", "conversation_id"], unique=True)
+    create_index(conn, "prescription_feedback", "uq_prescription_feedback_user_analysis", ["user_id", "analysis_id"], unique=True)
+
+    for column in ("question", "answer"):
+        drop_column(conn, "chat_feedback", column)
+    for column in ("filename", "result"):
+        drop_column(conn, "prescription_feedback", column)
+
+    # The old `feedback` table was never written to; only drop it if that is still true.
+    if "feedback" in _tables(conn):
+        if conn.execute(text("SELECT COUNT(*) FROM feedback")).scalar() == 0:
+            conn.execute(text("DROP TABLE feedback"))
+        else:
+            print("⚠️ Legacy feedback table is not empty; left in place.")
+
+def feedback_timestamps(conn):
+    now = datetime.datetime.now()
+    for table in ("chat_feedback", "prescription_feedback"):
+        add_column(conn, table, "created_at", "DATETIME")
+        add_column(conn, table, "updated_at", "DATETIME")
+        conn.execute(text(f"UPDATE {table} SET created_at = :t WHERE created_at IS NULL"), {"t": now})
+        conn.execute(text(f"UPDATE {table} SET updated_at = created_at WHERE updated_at IS NULL"))
+        create_index(conn, table, f"ix_{table}_updated", ["updated_at", "id"])
+
+def text_previews(conn, batch=500):
+    for table, source, preview in (("conversations", "response", "response_preview"),
+                                   ("prescription_analyses", "result", "result_preview")):
+        add_column(conn, table, preview, f"VARCHAR({PREVIEW_CHARS})")
+        last_id = 0
+        while True:
+            rows = conn.execute(text(
+                f"SELECT id, {source} FROM {table} WHERE id > :last AND {preview} IS NULL AND {source} IS NOT NULL "
+                f"ORDER BY id LIMIT {batch}"
+            ), {"last": last_id}).fetchall()
+            if not rows:
+                break
+            for row_id, value in rows:
+                conn.execute(text(f"UPDATE {table} SET {preview} = :p WHERE id = :i"),
+                             {"p": text_preview(decompress_text(value)), "i": row_id})
+            last_id = rows[-1][0]
+
+def retention_indexes(conn):
+    # Retention scans conversations by age and finds their feedback by conversation.
+    create_index(conn, "conversations", "ix_conversations_timestamp", ["timestamp"])
+    create_index(conn, "chat_feedback", "ix_chat_feedback_conversation", ["conversation_id"])
+    create_index(conn, "prescription_feedback", "ix_prescription_feedback_created", ["created_at"])
+
+def page_fine_hash(conn):
+    # Older pages have no fine hash and are never reused again.
+    add_column(conn, "prescription_pages", "fine_hash", "VARCHAR(64)")
+
+def chat_feedback_created(conn):
+    # Rollups read a day of chat feedback by created_at, as they do prescription feedback.
+    create_index(conn, "chat_feedback", "ix_chat_feedback_created", ["created_at"])
+
+MIGRATIONS = [
+    ("0001_feedback_references", feedback_references),
+    ("0002_feedback_timestamps", feedback_timestamps),
+    ("0003_text_previews", text_previews),
+    ("0004_retention_indexes", retention_indexes),
+    ("0005_page_fine_hash", page_fine_hash),
+    ("0006_chat_feedback_created", chat_feedback_created),
+]
+
+def run_migrations():
+    init_db()
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations (name VARCHAR(100) PRIMARY KEY, applied_at DATETIME)"
+        ))
+        applied = {row[0] for row in conn.execute(text("SELECT name FROM schema_migrations"))}
+    for name, migration in MIGRATIONS:
+        if name in applied:
+            continue
+        with engine.begin() as conn:
+            migration(conn)
+            conn.execute(text("INSERT INTO schema_migrations (name, applied_at) VALUES (:n, :t)"),
+                         {"n": name, "t": datetime.datetime.now()})
+        print(f"✅ Applied {name}")
+
+if __name__ == "__main__":
+    try:
+        run_migrations()
+    except Exception as e:
+        print("❌ Migration failed:", e)
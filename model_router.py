@@ -0,0 +1,166 @@
+# model_router.py
+# Picks the Groq model for a chat turn. Short, simple questions go to the small
+# model; long, multi-part or profile-heavy ones go to the large model. Rolling
+# per-model latency and error stats are kept in ROUTER_STATE_FILE (shared by
+# every app process and kept across restarts), and a model that is failing or
+# over its latency budget hands its traffic to the other one. Every decision is
+# appended to ROUTER_LOG_FILE for tuning:
+#   python model_router.py            # current per-model stats
+#   python model_router.py --log 20   # last routing decisions
+import os
+import re
+import sys
+import json
+import time
+from dotenv import load_dotenv
+
+try:
+    import fcntl
+except ImportError:  # Windows: stats updates are best effort
+    fcntl = None
+
+load_dotenv()
+MODELS = {
+    "small": {
+        "name": os.getenv("ROUTER_SMALL_MODEL", "llama3-8b-8192"),
+        "temperature": 0.2,
+        "max_tokens": 300,
+        "latency_budget": float(os.getenv("ROUTER_SMALL_BUDGET_SECONDS", 2.5)),
+    },
+    "large": {
+        "name": os.getenv("ROUTER_LARGE_MODEL", "llama3-70b-8192"),
+        "temperature": 0.15,
+        "max_tokens": 400,
+        "latency_budget": float(os.getenv("ROUTER_LARGE_BUDGET_SECONDS", 6.0)),
+    },
+}
+ROUTER_STATE_FILE = os.getenv("ROUTER_STATE_FILE", "model_router_state.json")
+ROUTER_LOG_FILE = os.getenv("ROUTER_LOG_FILE", "model_router_log.jsonl")
+WINDOW_SIZE = 50
+WINDOW_SECONDS = 900
+MIN_SAMPLES = 5
+MAX_ERROR_RATE = 0.25
+SIMPLE_MAX_WORDS = 14
+COMPLEX_TERMS = [
+    "interaction", "interact", "together with", "combine", "pregnan", "breastfeed", "dose", "dosage",
+    "overdose", "compare", "difference between", "why", "explain", "chronic", "side effect",
+    "kidney", "liver", "heart", "child", "infant", "elderly", "surgery", "chemo",
+]
+PROFILE_FIELDS = re.compile(r"(Medical conditions|Allergies|Medications): (.*?)\.(?: |$)")
+
+def features(messages, user_message):
+    text = user_message.lower()
+    system = next((m["content"] for m in messages if m.get("role") == "system"), "")
+    profile_fields = sum(1 for _, value in PROFILE_FIELDS.findall(system) if value.strip() not in ("", "None"))
+    return {
+        "words": len(text.split()),
+        "questions": text.count("?"),
+        "complex_terms": sum(1 for term in COMPLEX_TERMS if term in text),
+        "profile_fields": profile_fields,
+        "history_turns": sum(1 for m in messages if m.get("role") == "user") - 1,
+    }
+
+def classify(f):
+    # Profile details only matter once the question itself is more than a one-liner.
+    score = f["complex_terms"] * 2 + max(0, f["questions"] - 1)
+    score += (f["words"] > SIMPLE_MAX_WORDS) + (f["words"] > 3 * SIMPLE_MAX_WORDS)
+    if f["words"] > SIMPLE_MAX_WORDS // 2:
+        score += min(f["profile_fields"], 2)
+    return "large" if score >= 2 else "small"
+
+def _load(f):
+    f.seek(0)
+    try:
+        return json.load(f)
+    except ValueError:
+        return {}
+
+def use_files(state_file, log_file):
+    # Keeps benchmark runs out of the production stats and decision log.
+    global ROUTER_STATE_FILE, ROUTER_LOG_FILE
+    ROUTER_STATE_FILE, ROUTER_LOG_FILE = state_file, log_file
+
+class _StateFile:
+    def __init__(self, path=None):
+        self.path = path or ROUTER_STATE_FILE
+
+    def __enter__(self):
+        self.f = open(self.path, "a+")
+        if fcntl:
+            fcntl.flock(self.f, fcntl.LOCK_EX)
+        return _load(self.f)
+
+    def save(self, state):
+        self.f.seek(0)
+        self.f.truncate()
+        json.dump(state, self.f)
+        self.f.flush()
+
+    def __exit__(self, *exc):
+        if fcntl:
+            fcntl.flock(self.f, fcntl.LOCK_UN)
+        self.f.close()
+
+def model_health(state, tier, now=None):
+    now = now or time.time()
+    samples = [s for s in state.get(tier, []) if now - s[0] <= WINDOW_SECONDS]
+    latencies = sorted(s[1] for s in samples if s[2])
+    errors = sum(1 for s in samples if not s[2])
+    p90 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.9))] if latencies else 0.0
+    error_rate = errors / len(samples) if samples else 0.0
+    degraded = len(samples) >= MIN_SAMPLES and (
+        error_rate > MAX_ERROR_RATE or p90 > MODELS[tier]["latency_budget"])
+    return {"samples": len(samples), "p90": p90, "error_rate": error_rate, "degraded": degraded}
+
+def route(messages, user_message):
+    f = features(messages, user_message)
+    preferred = classify(f)
+    other = "large" if preferred == "small" else "small"
+    state_file = _StateFile()
+    with state_file as state:
+        health = {tier: model_health(state, tier) for tier in MODELS}
+    if health[preferred]["degraded"] and not health[other]["degraded"]:
+        order, reason = [other, preferred], f"{preferred} degraded"
+    else:
+        order, reason = [preferred, other], "classified"
+    return {"features": f, "preferred": preferred, "order": order, "reason": reason, "health": health}
+
+def record(tier, latency, ok):
+    state_file = _StateFile()
+    with state_file as state:
+        samples = state.get(tier, [])
+        samples.append([time.time(), round(latency, 3), ok])
+        state[tier] = samples[-WINDOW_SIZE:]
+        state_file.save(state)
+
+def log_decision(decision, attempts, served_by):
+    entry = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "preferred": decision["preferred"],
+        "reason": decision["reason"],
+        "served_by": served_by,
+        "features": decision["features"],
+        "attempts": attempts,
+        "total_latency": round(sum(a["latency"] for a in attempts), 3),
+    }
+    try:
+        with open(ROUTER_LOG_FILE, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+    except OSError:
+        pass
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if "--log" in args:
+        count = int(args[args.index("--log") + 1]) if len(args) > args.index("--log") + 1 else 20
+        if os.path.exists(ROUTER_LOG_FILE):
+            with open(ROUTER_LOG_FILE) as f:
+                for line in f.readlines()[-count:]:
+                    print(line.rstrip())
+    else:
+        with _StateFile() as state:
+            for tier, model in MODELS.items():
+                h = model_health(state, tier)
+                print(f"{tier:<6} {model['name']:<18} samples {h['samples']:>3}  p90 {h['p90']:.2f}s "
+                      f"(budget {model['latency_budget']}s)  errors {h['error_rate']:.0%}"
+                      + ("  DEGRADED" if h["degraded"] else ""))
@@ -2,12 +2,16 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-from db import SessionLocal, User, ChatFeedback, PrescriptionFeedback, init_db
-from sqlalchemy import func
-from datetime import datetime, timedelta
+import time
+from db import init_db
+from rollups import start_background_refresh
+from live_feedback import LiveFeedback
+from profiling import profiled_rerun, profiling_toggle
+from datetime import timedelta
 
 st.set_page_config("Feedback Analytics", layout="wide", page_icon="📊")
 init_db()
+start_background_refresh()
 
 COLORS = {
     "positive": "#4CAF50",
@@ -19,76 +23,46 @@ COLORS = {
     "header": "#9C27B0",
     "card": "var(--card-background-color)"
 }
+LIVE_INTERVALS = [5, 10, 30, 60]
 
-def fetch_feedback():
-    db = SessionLocal()
-    chat = db.query(ChatFeedback).all()
-    presc = db.query(PrescriptionFeedback).all()
-    users = db.query(User).all()
-    db.close()
-    return chat, presc, users
-
-def make_df(feedback, kind="chat"):
-    rows = []
-    for f in feedback:
-        user = f.user_id
-        feedback_val = f.feedback
-        timestamp = getattr(f, "timestamp", None)
-        if not timestamp:
-            timestamp = datetime.now()
-        rows.append({
-            "user_id": user,
-            "feedback": feedback_val,
-            "timestamp": timestamp,
-            "type": kind
-        })
-    return pd.DataFrame(rows)
-
-def user_map(users):
-    return {u.id: u.username for u in users}
-
-chat, presc, users = fetch_feedback()
-if not chat and not presc:
-    st.warning("No feedback data found yet.")
-    st.stop()
-
-user_lookup = user_map(users)
-
-chat_df = make_df(chat, "chat")
-presc_df = make_df(presc, "prescription")
-
-chat_df["username"] = chat_df["user_id"].map(user_lookup)
-presc_df["username"] = presc_df["user_id"].map(user_lookup)
-
-df = pd.concat([chat_df, presc_df], ignore_index=True)
-df["date"] = pd.to_datetime(df["timestamp"]).dt.date
-df["week"] = df["timestamp"].apply(lambda x: x - timedelta(days=x.weekday()))
-df["feedback_type"] = df["feedback"].apply(lambda x: "positive" if x else "negative")
-
-st.title("📊 Chatbot & Prescription Feedback Dashboard")
-st.markdown("**Track user feedback and model performance metrics**")
-
-col1, col2, col3, col4 = st.columns(4)
-with col1:
-    st.metric("Total Feedbacks", len(df))
-with col2:
-    st.metric("👍 Positive Rate", f"{100*df['feedback'].mean():.1f}%")
-with col3:
-    st.metric("💬 Chat Feedbacks", len(chat_df), 
-             delta=f"{len(chat_df)/len(df)*100:.1f}% of total" if len(df) > 0 else "0%")
-with col4:
-    st.metric("💊 Prescription Feedbacks", len(presc_df), 
-             delta=f"{len(presc_df)/len(df)*100:.1f}% of total" if len(df) > 0 else "0%")
-
-st.markdown("---")
-
-main_col1, main_col2 = st.columns([1, 1])
-
-with main_col1:
-    st.subheader("Feedback Distribution by Type")
+@st.cache_resource
+def live_state():
+    # One incremental state per server process, shared by every dashboard session.
+    return LiveFeedback()
+
+@st.cache_data(max_entries=2, show_spinner=False)
+def frames(version, _snapshot):
+    # Rebuilt only when a tick changed the aggregates.
+    df = pd.DataFrame([(day, kind, user_id, total, positive)
+                       for (day, kind, user_id), (total, positive) in _snapshot.groups.items()],
+                      columns=["day", "type", "user_id", "total", "positive"])
+    df["negative"] = df["total"] - df["positive"]
+    df["username"] = df["user_id"].map(_snapshot.users)
+    df["week"] = pd.to_datetime(df["day"]).apply(lambda x: x - timedelta(days=x.weekday()))
+    # One row per (group, sentiment) for charts that split on feedback type.
+    long_df = df.melt(
+        id_vars=["day", "week", "type", "user_id", "username"],
+        value_vars=["positive", "negative"],
+        var_name="feedback_type",
+        value_name="count"
+    )
+    long_df = long_df[long_df["count"] > 0]
+    return df, long_df
+
+def recent_frame(rows, users):
+    recent = pd.DataFrame([(created_at, user_id, feedback) for _, created_at, user_id, feedback in rows],
+                          columns=["timestamp", "user_id", "feedback"])
+    recent["username"] = recent["user_id"].map(users)
+    return recent
+
+# Each figure is cached on the small aggregate it plots, so a tick that leaves
+# a chart's numbers alone hands Streamlit the same figure and the chart is not redrawn.
+@st.cache_data(max_entries=4, show_spinner=False)
+def type_figure(type_totals):
     type_fig = px.pie(
-        df, 
+        pd.DataFrame(type_totals, columns=["type", "total"]),
         names='type',
+        values='total',
         color='type',
         color_discrete_map={'chat': COLORS['chat'], 
                           'prescription': COLORS['prescription']},
@@ -101,40 +75,38 @@ with main_col1:
         plot_bgcolor='rgba(0,0,0,0)',
         font=dict(color=COLORS['text'])
     )
-    st.plotly_chart(type_fig, use_container_width=True)
-    
-    st.subheader("Weekly Feedback Trend")
-    weekly = df.groupby(['week', 'feedback_type', 'type']).size().reset_index(name='count')
-    if not weekly.empty:
-        trend_fig = px.bar(
-            weekly,
-            x='week',
-            y='count',
-            color='type',
-            barmode='group',
-            color_discrete_map={
-                'chat': COLORS['chat'],
-                'prescription': COLORS['prescription']
-            },
-            labels={'count': 'Feedback Count', 'week': 'Week'}
-        )
-        trend_fig.update_xaxes(tickformat="%b %d")
-        trend_fig.update_layout(
-            paper_bgcolor='rgba(0,0,0,0)',
-            plot_bgcolor='rgba(0,0,0,0)',
-            font=dict(color=COLORS['text']),
-            xaxis=dict(color=COLORS['text']),
-            yaxis=dict(color=COLORS['text'])
-        )
-        st.plotly_chart(trend_fig, use_container_width=True)
-    else:
-        st.info("No data available for weekly trends")
-
-with main_col2:
-    st.subheader("Feedback Sentiment")
+    return type_fig
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def weekly_figure(weekly_rows):
+    trend_fig = px.bar(
+        pd.DataFrame(weekly_rows, columns=["week", "type", "count"]),
+        x='week',
+        y='count',
+        color='type',
+        barmode='group',
+        color_discrete_map={
+            'chat': COLORS['chat'],
+            'prescription': COLORS['prescription']
+        },
+        labels={'count': 'Feedback Count', 'week': 'Week'}
+    )
+    trend_fig.update_xaxes(tickformat="%b %d")
+    trend_fig.update_layout(
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0,0,0,0)',
+        font=dict(color=COLORS['text']),
+        xaxis=dict(color=COLORS['text']),
+        yaxis=dict(color=COLORS['text'])
+    )
+    return trend_fig
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def sentiment_figure(sentiment_rows):
     sentiment_fig = px.sunburst(
-        df,
+        pd.DataFrame(sentiment_rows, columns=["type", "feedback_type", "count"]),
         path=['type', 'feedback_type'],
+        values='count',
         color='feedback_type',
         color_discrete_map={
             'positive': COLORS['positive'],
@@ -148,210 +120,258 @@ with main_col2:
         plot_bgcolor='rgba(0,0,0,0)',
         font=dict(color=COLORS['text'])
     )
-    st.plotly_chart(sentiment_fig, use_container_width=True)
-    
-    st.subheader("Feedback by User")
-    user_feedback = df.groupby(['username', 'feedback_type']).size().unstack(fill_value=0)
-    user_feedback['total'] = user_feedback.sum(axis=1)
-    user_feedback = user_feedback.sort_values('total', ascending=False).head(10)
-    
-    if not user_feedback.empty:
-        user_fig = go.Figure()
-        user_fig.add_trace(go.Bar(
-            x=user_feedback.index,
-            y=user_feedback.get('positive', 0),
-            name='Positive',
-            marker_color=COLORS['positive']
-        ))
-        user_fig.add_trace(go.Bar(
-            x=user_feedback.index,
-            y=user_feedback.get('negative', 0),
-            name='Negative',
-            marker_color=COLORS['negative']
-        ))
-        user_fig.update_layout(
-            barmode='stack', 
-            xaxis_title="User", 
-            yaxis_title="Feedback Count",
-            paper_bgcolor='rgba(0,0,0,0)',
-            plot_bgcolor='rgba(0,0,0,0)',
-            font=dict(color=COLORS['text']),
-            xaxis=dict(color=COLORS['text']),
-            yaxis=dict(color=COLORS['text']),
-            legend=dict(font=dict(color=COLORS['text']))
-        )
-        st.plotly_chart(user_fig, use_container_width=True)
-    else:
-        st.info("No user feedback data available")
-
-st.markdown("---")
-st.header("Detailed Feedback Analysis")
-
-tab1, tab2 = st.tabs(["💬 Chat Feedback", "💊 Prescription Feedback"])
-
-with tab1:
-    if not chat_df.empty:
-        c1, c2 = st.columns(2)
-        
-        with c1:
-            st.subheader("Sentiment Distribution")
-            chat_sentiment = chat_df['feedback'].value_counts()
-            fig = px.pie(
-                values=chat_sentiment.values,
-                names=chat_sentiment.index.map({1: 'Positive', 0: 'Negative'}),
-                color_discrete_sequence=[COLORS['positive'], COLORS['negative']]
-            )
-            fig.update_layout(
-                paper_bgcolor='rgba(0,0,0,0)',
-                plot_bgcolor='rgba(0,0,0,0)',
-                font=dict(color=COLORS['text'])
-            )
-            st.plotly_chart(fig, use_container_width=True)
-        
-        with c2:
-            st.subheader("Top Users")
-            top_users = chat_df['username'].value_counts().head(5)
-            fig = px.bar(
-                top_users, 
-                orientation='v',
-                labels={'index': 'User', 'value': 'Feedback Count'},
-                color_discrete_sequence=[COLORS['chat']]
-            )
-            fig.update_layout(
-                paper_bgcolor='rgba(0,0,0,0)',
-                plot_bgcolor='rgba(0,0,0,0)',
-                font=dict(color=COLORS['text']),
-                xaxis=dict(color=COLORS['text']),
-                yaxis=dict(color=COLORS['text'])
-            )
-            st.plotly_chart(fig, use_container_width=True)
-        
-        st.subheader("Recent Chat Feedback")
-        st.dataframe(
-            chat_df[['timestamp', 'username', 'feedback']]
-            .sort_values('timestamp', ascending=False)
-            .head(10)
-            .assign(feedback=lambda x: x['feedback'].map({1: '👍', 0: '👎'}))
-            .rename(columns={
-                'timestamp': 'Timestamp',
-                'username': 'User',
-                'feedback': 'Feedback'
-            }),
-            hide_index=True,
-            use_container_width=True
-        )
-    else:
-        st.info("No chat feedback available")
-
-with tab2:
-    if not presc_df.empty:
-        c1, c2 = st.columns(2)
-        
-        with c1:
-            st.subheader("Sentiment Distribution")
-            presc_sentiment = presc_df['feedback'].value_counts()
-            fig = px.pie(
-                values=presc_sentiment.values,
-                names=presc_sentiment.index.map({1: 'Positive', 0: 'Negative'}),
-                color_discrete_sequence=[COLORS['positive'], COLORS['negative']]
-            )
-            fig.update_layout(
-                paper_bgcolor='rgba(0,0,0,0)',
-                plot_bgcolor='rgba(0,0,0,0)',
-                font=dict(color=COLORS['text'])
-            )
-            st.plotly_chart(fig, use_container_width=True)
-        
-        with c2:
-            st.subheader("Top Users")
-            top_users = presc_df['username'].value_counts().head(5)
-            fig = px.bar(
-                top_users, 
-                orientation='v',
-                labels={'index': 'User', 'value': 'Feedback Count'},
-                color_discrete_sequence=[COLORS['prescription']]
-            )
-            fig.update_layout(
-                paper_bgcolor='rgba(0,0,0,0)',
-                plot_bgcolor='rgba(0,0,0,0)',
-                font=dict(color=COLORS['text']),
-                xaxis=dict(color=COLORS['text']),
-                yaxis=dict(color=COLORS['text'])
-            )
-            st.plotly_chart(fig, use_container_width=True)
-        
-        st.subheader("Recent Prescription Feedback")
-        st.dataframe(
-            presc_df[['timestamp', 'username', 'feedback']]
-            .sort_values('timestamp', ascending=False)
-            .head(10)
-            .assign(feedback=lambda x: x['feedback'].map({1: '👍', 0: '👎'}))
-            .rename(columns={
-                'timestamp': 'Timestamp',
-                'username': 'User',
-                'feedback': 'Feedback'
-            }),
-            hide_index=True,
-            use_container_width=True
-        )
-    else:
-        st.info("No prescription feedback available")
-
-st.markdown(f"""
-<style>
-    :root {{
-        --background-color: var(--background-color);
-        --text-color: var(--text-color);
-        --card-background-color: var(--secondary-background-color);
-    }}
-    
-    [data-testid="stMetric"] {{
-        background-color: var(--card-background-color);
-        border-radius: 12px;
-        padding: 15px;
-        border: 1px solid var(--border-color);
-    }}
-    
-    [data-testid="stMetricValue"] {{
-        color: var(--text-color) !important;
-    }}
-    
-    [data-testid="stMetricLabel"] {{
-        color: var(--text-color) !important;
-    }}
-    
-    [data-baseweb="tab"] {{
-        background-color: var(--card-background-color) !important;
-        border-radius: 8px !important;
-        margin: 5px !important;
-        padding: 10px 15px !important;
-        border: 1px solid var(--border-color) !important;
-    }}
-    
-    [data-baseweb="tab"][aria-selected="true"] {{
-        background-color: {COLORS['chat']} !important;
-        color: white !important;
-        font-weight: bold;
-    }}
-    
-    .dataframe {{
-        background-color: var(--card-background-color) !important;
-        color: var(--text-color) !important;
-        border-radius: 10px;
-        border: 1px solid var(--border-color);
-    }}
-    
-    .dataframe th, .dataframe td {{
-        color: var(--text-color) !important;
-    }}
-    
-    hr {{
-        margin: 2rem 0;
-        border-top: 2px solid {COLORS['prescription']};
-    }}
-    
-    .js-plotly-plot .plotly {{
-        background: transparent !important;
-    }}
-</style>
-""", unsafe_allow_html=True)
\ No newline at end of file
+    return sentiment_fig
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def user_figure(user_rows):
+    # user_rows: ((username, positive, negative), ...) busiest first
+    user_fig = go.Figure()
+    user_fig.add_trace(go.Bar(
+        x=[u for u, _, _ in user_rows],
+        y=[p for _, p, _ in user_rows],
+        name='Positive',
+        marker_color=COLORS['positive']
+    ))
+    user_fig.add_trace(go.Bar(
+        x=[u for u, _, _ in user_rows],
+        y=[n for _, _, n in user_rows],
+        name='Negative',
+        marker_color=COLORS['negative']
+    ))
+    user_fig.update_layout(
+        barmode='stack', 
+        xaxis_title="User", 
+        yaxis_title="Feedback Count",
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0,0,0,0)',
+        font=dict(color=COLORS['text']),
+        xaxis=dict(color=COLORS['text']),
+        yaxis=dict(color=COLORS['text']),
+        legend=dict(font=dict(color=COLORS['text']))
+    )
+    return user_fig
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def split_figure(positive, negative):
+    fig = px.pie(
+        values=[positive, negative],
+        names=['Positive', 'Negative'],
+        color_discrete_sequence=[COLORS['positive'], COLORS['negative']]
+    )
+    fig.update_layout(
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0,0,0,0)',
+        font=dict(color=COLORS['text'])
+    )
+    return fig
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def top_users_figure(top_rows, color):
+    top_users = pd.Series([t for _, t in top_rows], index=pd.Index([u for u, _ in top_rows], name='username'),
+                          name='total')
+    fig = px.bar(
+        top_users, 
+        orientation='v',
+        labels={'index': 'User', 'value': 'Feedback Count'},
+        color_discrete_sequence=[color]
+    )
+    fig.update_layout(
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0,0,0,0)',
+        font=dict(color=COLORS['text']),
+        xaxis=dict(color=COLORS['text']),
+        yaxis=dict(color=COLORS['text'])
+    )
+    return fig
+
+def render_kind(kind_df, recent, color, label):
+    c1, c2 = st.columns(2)
+
+    with c1:
+        st.subheader("Sentiment Distribution")
+        st.plotly_chart(split_figure(int(kind_df['positive'].sum()), int(kind_df['negative'].sum())),
+                        use_container_width=True)
+
+    with c2:
+        st.subheader("Top Users")
+        top_users = kind_df.groupby('username')['total'].sum().sort_values(ascending=False).head(5)
+        st.plotly_chart(top_users_figure(tuple((u, int(t)) for u, t in top_users.items()), color),
+                        use_container_width=True)
+
+    st.subheader(f"Recent {label} Feedback")
+    st.dataframe(
+        recent[['timestamp', 'username', 'feedback']]
+        .assign(feedback=lambda x: x['feedback'].map({1: '👍', 0: '👎'}))
+        .rename(columns={
+            'timestamp': 'Timestamp',
+            'username': 'User',
+            'feedback': 'Feedback'
+        }),
+        hide_index=True,
+        use_container_width=True
+    )
+
+def live_controls():
+    live = st.sidebar.toggle("🔴 Live updates", key="live_mode",
+                             help="Refreshes with only the feedback that arrived since the last update")
+    interval = st.sidebar.select_slider("Refresh every", options=LIVE_INTERVALS, value=10,
+                                        format_func=lambda s: f"{s}s", key="live_interval", disabled=not live)
+    return live, interval
+
+def wait_for_refresh(interval):
+    # A one-second countdown keeps clicks responsive: Streamlit can only
+    # interrupt the script at the next element update.
+    countdown = st.sidebar.empty()
+    for remaining in range(interval, 0, -1):
+        countdown.caption(f"Next refresh in {remaining}s")
+        time.sleep(1)
+    st.rerun()
+
+def main():
+    profiling_toggle(st, st.session_state.get("username", ""))
+    snapshot = live_state().tick()
+    st.sidebar.caption(f"Updated {snapshot.updated_at:%H:%M:%S} · {snapshot.fetched} rows read")
+    if not snapshot.groups:
+        st.warning("No feedback data found yet.")
+        return
+
+    df, long_df = frames(snapshot.version, snapshot)
+
+    chat_df = df[df["type"] == "chat"]
+    presc_df = df[df["type"] == "prescription"]
+    total_feedback = int(df["total"].sum())
+    chat_total = int(chat_df["total"].sum())
+    presc_total = int(presc_df["total"].sum())
+
+    st.title("📊 Chatbot & Prescription Feedback Dashboard")
+    st.markdown("**Track user feedback and model performance metrics**")
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Total Feedbacks", total_feedback)
+    with col2:
+        st.metric("👍 Positive Rate", f"{100*df['positive'].sum()/max(1, total_feedback):.1f}%")
+    with col3:
+        st.metric("💬 Chat Feedbacks", chat_total, 
+                 delta=f"{chat_total/total_feedback*100:.1f}% of total" if total_feedback > 0 else "0%")
+    with col4:
+        st.metric("💊 Prescription Feedbacks", presc_total, 
+                 delta=f"{presc_total/total_feedback*100:.1f}% of total" if total_feedback > 0 else "0%")
+
+    st.markdown("---")
+
+    main_col1, main_col2 = st.columns([1, 1])
+
+    with main_col1:
+        st.subheader("Feedback Distribution by Type")
+        type_totals = df.groupby('type')['total'].sum()
+        st.plotly_chart(type_figure(tuple((k, int(v)) for k, v in type_totals.items())), use_container_width=True)
+
+        st.subheader("Weekly Feedback Trend")
+        weekly = df.groupby(['week', 'type'])['total'].sum().reset_index(name='count')
+        if not weekly.empty:
+            st.plotly_chart(weekly_figure(tuple((w, t, int(c)) for w, t, c in weekly.itertuples(index=False))),
+                            use_container_width=True)
+        else:
+            st.info("No data available for weekly trends")
+
+    with main_col2:
+        st.subheader("Feedback Sentiment")
+        sentiment = long_df.groupby(['type', 'feedback_type'])['count'].sum()
+        st.plotly_chart(sentiment_figure(tuple((t, f, int(c)) for (t, f), c in sentiment.items())),
+                        use_container_width=True)
+
+        st.subheader("Feedback by User")
+        user_feedback = long_df.groupby(['username', 'feedback_type'])['count'].sum().unstack(fill_value=0)
+        user_feedback['total'] = user_feedback.sum(axis=1)
+        user_feedback = user_feedback.sort_values('total', ascending=False).head(10)
+
+        if not user_feedback.empty:
+            st.plotly_chart(user_figure(tuple(
+                (name, int(row.get('positive', 0)), int(row.get('negative', 0)))
+                for name, row in user_feedback.iterrows())), use_container_width=True)
+        else:
+            st.info("No user feedback data available")
+
+    st.markdown("---")
+    st.header("Detailed Feedback Analysis")
+
+    tab1, tab2 = st.tabs(["💬 Chat Feedback", "💊 Prescription Feedback"])
+
+    with tab1:
+        if not chat_df.empty:
+            render_kind(chat_df, recent_frame(snapshot.recent["chat"], snapshot.users), COLORS['chat'], "Chat")
+        else:
+            st.info("No chat feedback available")
+
+    with tab2:
+        if not presc_df.empty:
+            render_kind(presc_df, recent_frame(snapshot.recent["prescription"], snapshot.users),
+                        COLORS['prescription'], "Prescription")
+        else:
+            st.info("No prescription feedback available")
+
+    st.markdown(f"""
+    <style>
+        :root {{
+            --background-color: var(--background-color);
+            --text-color: var(--text-color);
+            --card-background-color: var(--secondary-background-color);
+        }}
+
+        [data-testid="stMetric"] {{
+            background-color: var(--card-background-color);
+            border-radius: 12px;
+            padding: 15px;
+            border: 1px solid var(--border-color);
+        }}
+
+        [data-testid="stMetricValue"] {{
+            color: var(--text-color) !important;
+        }}
+
+        [data-testid="stMetricLabel"] {{
+            color: var(--text-color) !important;
+        }}
+
+        [data-baseweb="tab"] {{
+            background-color: var(--card-background-color) !important;
+            border-radius: 8px !important;
+            margin: 5px !important;
+            padding: 10px 15px !important;
+            border: 1px solid var(--border-color) !important;
+        }}
+
+        [data-baseweb="tab"][aria-selected="true"] {{
+            background-color: {COLORS['chat']} !important;
+            color: white !important;
+            font-weight: bold;
+        }}
+
+        .dataframe {{
+            background-color: var(--card-background-color) !important;
+            color: var(--text-color) !important;
+            border-radius: 10px;
+            border: 1px solid var(--border-color);
+        }}
+
+        .dataframe th, .dataframe td {{
+            color: var(--text-color) !important;
+        }}
+
+        hr {{
+            margin: 2rem 0;
+            border-top: 2px solid {COLORS['prescription']};
+        }}
+
+        .js-plotly-plot .plotly {{
+            background: transparent !important;
+        }}
+    </style>
+    """, unsafe_allow_html=True)
+
+live, interval = live_controls()
+with profiled_rerun("feedback", force=st.session_state.get("profile_reruns", False)):
+    main()
+if live:
+    wait_for_refresh(interval)
@@ -0,0 +1,107 @@
+# phash_index.py
+# Near-duplicate lookup for prescription pages. Each analyzed page stores the
+# dHash of its preprocessed image and the raw model output; the 64-bit hash is
+# split into BANDS 8-bit bands, so any hash within BANDS - 1 bits of a stored
+# one shares at least one exact band and a query only reads those candidates.
+# A 9x8 thumbnail mostly sees letterhead and layout, so two prescriptions on
+# the same clinic's pad can land within the threshold: a candidate is only
+# reused when its 256-bit fine hash is within FINE_THRESHOLD bits too, and only
+# from the uploader's own pages, or with PHASH_SCOPE=household from users
+# explicitly linked to them:
+#   python phash_index.py --link-household alice bob
+#   python phash_index.py --unlink-household bob
+import os
+import sys
+from sqlalchemy import or_, and_, func
+from dotenv import load_dotenv
+from db import SessionLocal, PrescriptionPage, PrescriptionHashBand, PrescriptionAnalysis, HouseholdMember, User
+
+load_dotenv()
+BANDS = 8
+BAND_BITS = 64 // BANDS
+PHASH_THRESHOLD = min(int(os.getenv("PHASH_THRESHOLD", 6)), BANDS - 1)
+FINE_HASH_SIZE = 16
+FINE_THRESHOLD = int(os.getenv("PHASH_FINE_THRESHOLD", 16))
+# "user" (default) or "household"; there is no cross-user reuse without an explicit link.
+PHASH_SCOPE = os.getenv("PHASH_SCOPE", "user")
+
+def bands(phash):
+    bits = int(phash, 16)
+    mask = (1 << BAND_BITS) - 1
+    return [(bits >> (BAND_BITS * i)) & mask for i in range(BANDS)]
+
+def hamming(a, b):
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+def allowed_users(db, user_id):
+    if PHASH_SCOPE == "household":
+        household = db.query(HouseholdMember.household_id).filter(HouseholdMember.user_id == user_id).scalar()
+        if household is not None:
+            return [uid for (uid,) in db.query(HouseholdMember.user_id)
+                    .filter(HouseholdMember.household_id == household)]
+    return [user_id]
+
+def find_similar(db, phash, user_id, fine_hash, threshold=PHASH_THRESHOLD, fine_threshold=FINE_THRESHOLD):
+    # -> (PrescriptionPage, distance) of the closest stored page, or None
+    if user_id is None or not fine_hash:
+        return None
+    matches = or_(*[and_(PrescriptionHashBand.band == band, PrescriptionHashBand.value == value)
+                    for band, value in enumerate(bands(phash))])
+    candidate_ids = {page_id for (page_id,) in db.query(PrescriptionHashBand.page_id).filter(matches).distinct()}
+    if not candidate_ids:
+        return None
+    query = (db.query(PrescriptionPage)
+             .join(PrescriptionAnalysis, PrescriptionPage.analysis_id == PrescriptionAnalysis.id)
+             .filter(PrescriptionPage.id.in_(candidate_ids), PrescriptionPage.fine_hash.isnot(None),
+                     PrescriptionAnalysis.user_id.in_(allowed_users(db, user_id))))
+    best = None
+    for page in query:
+        distance = hamming(phash, page.phash)
+        if distance <= threshold and hamming(fine_hash, page.fine_hash) <= fine_threshold \
+                and (best is None or distance < best[1]):
+            best = (page, distance)
+    return best
+
+def add_page(db, analysis_id, phash, raw, fine_hash=None):
+    page = PrescriptionPage(analysis_id=analysis_id, phash=phash, fine_hash=fine_hash, raw=raw)
+    db.add(page)
+    db.flush()
+    db.add_all([PrescriptionHashBand(band=band, value=value, page_id=page.id)
+                for band, value in enumerate(bands(phash))])
+    return page
+
+def link_household(usernames):
+    # Puts the users in one household: the first user's, or a new one.
+    db = SessionLocal()
+    try:
+        users = dict(db.query(User.username, User.id).filter(User.username.in_(usernames)).all())
+        missing = [name for name in usernames if name not in users]
+        if missing:
+            raise SystemExit(f"Unknown users: {', '.join(missing)}")
+        household = db.query(HouseholdMember.household_id).filter(HouseholdMember.user_id == users[usernames[0]]).scalar()
+        if household is None:
+            household = (db.query(func.max(HouseholdMember.household_id)).scalar() or 0) + 1
+        for user_id in users.values():
+            db.merge(HouseholdMember(user_id=user_id, household_id=household))
+        db.commit()
+        print(f"✅ Household {household}: {', '.join(usernames)}")
+    finally:
+        db.close()
+
+def unlink_household(username):
+    db = SessionLocal()
+    try:
+        user_id = db.query(User.id).filter(User.username == username).scalar()
+        db.query(HouseholdMember).filter(HouseholdMember.user_id == user_id).delete()
+        db.commit()
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 4 and sys.argv[1] == "--link-household":
+        link_household(sys.argv[2:])
+    elif len(sys.argv) == 3 and sys.argv[1] == "--unlink-household":
+        unlink_household(sys.argv[2])
+    else:
+        print("usage: python phash_index.py --link-household USER USER [...] | --unlink-household USER")
+        sys.exit(1)
@@ -0,0 +1,154 @@
+# prescription.py
+import re
+import json
+from drug_index import lookup, normalize_name
+
+PRESCRIPTION_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "medicines": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "medicine": {"type": "STRING"},
+                    "dosage": {"type": "STRING"},
+                    "frequency": {"type": "STRING"},
+                    "notes": {"type": "STRING"},
+                },
+                "required": ["medicine"],
+            },
+        },
+        "doctor_comments": {"type": "STRING"},
+        "summary": {"type": "STRING"},
+    },
+    "required": ["medicines", "summary"],
+}
+
+MEDICINE_FIELDS = ("medicine", "dosage", "frequency", "notes")
+
+def _text(value):
+    if value is None:
+        return ""
+    if not isinstance(value, (str, int, float)):
+        raise ValueError(f"Expected text, got {type(value).__name__}")
+    return str(value).strip()
+
+def parse_prescription(raw):
+    text = raw.strip()
+    text = re.sub(r"^```(?:json)?\s*|\s*```$", "", text)
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get("medicines"), list):
+        return None
+    try:
+        medicines = []
+        for item in data["medicines"]:
+            if not isinstance(item, dict):
+                continue
+            med = {field: _text(item.get(field)) for field in MEDICINE_FIELDS}
+            if med["medicine"]:
+                medicines.append(med)
+        return {
+            "medicines": medicines,
+            "doctor_comments": _text(data.get("doctor_comments")),
+            "summary": _text(data.get("summary")),
+        }
+    except ValueError:
+        return None
+
+def normalize_medicines(medicines):
+    merged = {}
+    for med in medicines:
+        canonical = lookup(med["medicine"])
+        key = canonical or normalize_name(med["medicine"])
+        if not key:
+            continue
+        if key in merged:
+            existing = merged[key]
+            for field in ("dosage", "frequency", "notes"):
+                existing[field] = existing[field] or med[field]
+            continue
+        merged[key] = dict(med, canonical=canonical)
+    return list(merged.values())
+
+def lookup_names(medicines):
+    # Canonical names where the index knows the medicine, the prescription's own
+    # text otherwise, so unknown brands still get a web lookup and a buy link.
+    names = []
+    for m in medicines:
+        name = m.get("canonical") or m["medicine"]
+        if name and name not in names:
+            names.append(name)
+    return names
+
+def render_prescription(data):
+    lines = []
+    if data["summary"]:
+        lines += [data["summary"], ""]
+    if data["medicines"]:
+        lines.append("**Medicines**")
+        for med in data["medicines"]:
+            details = ", ".join(v for v in (med["dosage"], med["frequency"]) if v)
+            line = f"- **{med['medicine']}**"
+            if med.get("canonical") and med["canonical"].lower() != med["medicine"].lower():
+                line += f" ({med['canonical']})"
+            if details:
+                line += f": {details}"
+            if med["notes"]:
+                line += f". {med['notes']}"
+            lines.append(line)
+        lines.append("")
+    if data["doctor_comments"]:
+        lines += ["**Doctor's comments**", data["doctor_comments"]]
+    return "\n".join(lines).strip()
+
+def extract_medicine_names(text):
+    meds = set(re.findall(r'\*\*\s*([A-Za-z0-9\s-]{2,})\s*\*\*', text))
+    if not meds:
+        meds = set(re.findall(r'-\s*([A-Za-z0-9\s-]{2,})', text))
+    return list(meds)
+
+def process_result(raw):
+    data = parse_prescription(raw)
+    if data is None:
+        # Free-form markdown from an older prompt or a schema violation.
+        # Like lookup_names: unresolved medicines keep their own text.
+        names = []
+        for name in extract_medicine_names(raw):
+            if not normalize_name(name):
+                continue
+            name = lookup(name) or name.strip()
+            if name not in names:
+                names.append(name)
+        return raw, names, []
+    data["medicines"] = normalize_medicines(data["medicines"])
+    return render_prescription(data), lookup_names(data["medicines"]), data["medicines"]
+
+def merge_results(pages):
+    # pages: [(label, raw)] for one multi-page upload. Medicines are merged
+    # across pages before lookup; output has the same shape as process_result.
+    summaries, comments, medicines, free_text, extra_names = [], [], [], [], []
+    for label, raw in pages:
+        data = parse_prescription(raw)
+        if data is None:
+            text, names, _ = process_result(raw)
+            free_text.append(f"**{label}**\n{text}")
+            extra_names += names
+            continue
+        medicines += data["medicines"]
+        if data["summary"]:
+            summaries.append(f"**{label}:** {data['summary']}")
+        if data["doctor_comments"]:
+            comments.append(f"{label}: {data['doctor_comments']}")
+    merged = {
+        "medicines": normalize_medicines(medicines),
+        "summary": "\n\n".join(summaries),
+        "doctor_comments": "\n".join(comments),
+    }
+    names = lookup_names(merged["medicines"])
+    names += [n for n in dict.fromkeys(extra_names) if n not in names]
+    display = "\n\n".join([render_prescription(merged)] + free_text).strip()
+    return display, names, merged["medicines"]
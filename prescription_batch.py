@@ -0,0 +1,126 @@
+# prescription_batch.py
+# Multi-page prescription analysis. Pages are preprocessed in parallel and sent
+# to Gemini as coroutines on the async_services loop (capped by
+# PRESCRIPTION_CONCURRENCY); medicines are merged across pages before one
+# concurrent round of link lookups, so a batch takes about as long as its
+# slowest page rather than the sum of all pages.
+# Pages whose perceptual hashes are close to a page the same user (or a linked
+# household member) already had analyzed reuse that stored output instead of
+# calling Gemini again (see phash_index.py).
+import os
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dotenv import load_dotenv
+from image_pipeline import preprocess_image, dhash
+from prescription import process_result, merge_results, parse_prescription
+from phash_index import find_similar, add_page, FINE_HASH_SIZE
+from db import session_scope
+from async_services import spawn, run, loop_semaphore, prescription_page, medicine_lookup
+import traffic
+
+load_dotenv()
+MAX_PAGES = int(os.getenv("PRESCRIPTION_MAX_PAGES", 8))
+CONCURRENCY = int(os.getenv("PRESCRIPTION_CONCURRENCY", 3))
+PAGE_TIMEOUT = 60
+
+def _preprocess(file_bytes):
+    # Pillow releases the GIL while decoding, resizing and encoding, so threads scale here.
+    processed = preprocess_image(file_bytes)
+    return processed, (dhash(processed), dhash(processed, FINE_HASH_SIZE))
+
+def _find_reusable(hashes, user_id):
+    try:
+        with session_scope() as db:
+            match = find_similar(db, hashes[0], user_id, hashes[1])
+            return (match[0].raw, {"analysis_id": match[0].analysis_id, "distance": match[1]}) if match else None
+    except Exception as e:
+        print("Near-duplicate lookup failed:", e)
+        return None
+
+async def _analyze(processed, limit):
+    async with limit:
+        return await asyncio.wait_for(prescription_page(processed), PAGE_TIMEOUT)
+
+def page_label(index, name, count):
+    return name if count == 1 else f"Page {index + 1} ({name})"
+
+def analyze_pages(pages, concurrency=CONCURRENCY, user_id=None, force=False, trace=None):
+    # pages: [(filename, bytes)] -> combined analysis dict; force skips near-duplicate reuse.
+    # trace: a traffic.py trace that records the upstream calls and stage timings
+    started = time.perf_counter()
+    raws, errors, hashes, reused = {}, {}, {}, {}
+    prep_workers = max(1, min(len(pages), os.cpu_count() or 2))
+    limit = loop_semaphore(max(1, concurrency))
+    with ThreadPoolExecutor(max_workers=prep_workers) as prep_pool:
+        prepared = {prep_pool.submit(_preprocess, data): i for i, (_, data) in enumerate(pages)}
+        analyses = {}
+        # Each page goes to Gemini as soon as its own preprocessing finishes.
+        for future in as_completed(prepared):
+            i = prepared[future]
+            try:
+                processed, hashes[i] = future.result()
+            except Exception as e:
+                errors[i] = f"Image processing error: {e}"
+                continue
+            match = None if force else _find_reusable(hashes[i], user_id)
+            if match:
+                raws[i], reused[i] = match
+            else:
+                analyses[spawn(traffic.bind(trace, _analyze(processed, limit)))] = i
+        for future in as_completed(analyses):
+            i = analyses[future]
+            try:
+                raws[i] = future.result()
+            except asyncio.TimeoutError:
+                errors[i] = "Prescription analysis timed out. Please try again with a clearer image."
+            except Exception as e:
+                errors[i] = f"Error processing prescription: {e}"
+    analyzed = time.perf_counter()
+
+    labelled = [(page_label(i, pages[i][0], len(pages)), raws[i]) for i in sorted(raws)]
+    if len(labelled) == 1 and len(pages) == 1:
+        result, med_names, medicines = process_result(labelled[0][1])
+    elif labelled:
+        result, med_names, medicines = merge_results(labelled)
+    else:
+        result, med_names, medicines = "", [], []
+
+    merged = time.perf_counter()
+    med_links, buy_links = [], {}
+    lookup_error = None
+    if med_names:
+        try:
+            med_links, buy_links = run(traffic.bind(trace, medicine_lookup(med_names)))
+        except Exception as e:
+            lookup_error = f"Medicine lookup failed: {e}"
+    looked_up = time.perf_counter()
+    page_errors = [(page_label(i, pages[i][0], len(pages)), errors[i]) for i in sorted(errors)]
+    if page_errors:
+        notes = "\n".join(f"- {label}: {message}" for label, message in page_errors)
+        result = f"{result}\n\n{notes}".strip() if len(pages) > 1 else (result or page_errors[0][1])
+
+    analysis = {
+        "result": result,
+        "med_names": med_names,
+        "medicines": medicines,
+        "med_links": med_links,
+        "buy_links": buy_links,
+        "errors": page_errors + ([("Medicine lookup", lookup_error)] if lookup_error else []),
+        "pages": [{"label": page_label(i, pages[i][0], len(pages)), "phash": hashes[i][0],
+                   "fine_hash": hashes[i][1], "raw": raws[i],
+                   "reused": reused.get(i)} for i in sorted(raws)],
+        "timings": {"analysis": analyzed - started, "lookup": looked_up - merged, "total": time.perf_counter() - started},
+    }
+    if trace is not None:
+        trace.inputs["reused"] = sorted(reused)
+        for name in ("analysis", "lookup"):
+            traffic.add_stage(trace, name, analysis["timings"][name])
+    return analysis
+
+def index_pages(db, analysis_id, page_results):
+    # Freshly analyzed pages with a well-formed result become reusable; reused
+    # pages already point at their original, and error output must never be reused.
+    for page in page_results:
+        if not page["reused"] and parse_prescription(page["raw"]) is not None:
+            add_page(db, analysis_id, page["phash"], page["raw"], page.get("fine_hash"))
@@ -0,0 +1,23 @@
+# private_files.py
+# Directories and files that hold patient data (report cache, spilled chat
+# turns, cold archives) are owner-only whatever the umask: directories 0700,
+# files 0600.
+import os
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+_FLAGS = {"a": os.O_WRONLY | os.O_CREAT | os.O_APPEND, "w": os.O_WRONLY | os.O_CREAT | os.O_TRUNC}
+
+def private_dir(path):
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    # makedirs honours the umask and leaves an existing directory as it was.
+    if os.stat(path).st_mode & 0o077:
+        os.chmod(path, 0o700)
+    return path
+
+def open_private(path, mode="ab", **kwargs):
+    # Append ("a", "ab") or write ("w", "wb"); the file is 0600 even if it existed before.
+    fd = os.open(path, _FLAGS[mode[0]], 0o600)
+    if hasattr(os, "fchmod"):
+        os.fchmod(fd, 0o600)
+    return open(fd, mode, **kwargs)
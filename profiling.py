@@ -0,0 +1,171 @@
+# profiling.py
+# Opt-in per-rerun profiling for the Streamlit scripts. A sampled rerun gets
+#   <dir>/<script>_<time>_<n>.prof    cProfile stats (python -m pstats, snakeviz)
+#   <dir>/<script>_<time>_<n>.folded  collapsed stacks (flamegraph.pl, speedscope)
+#   <dir>/<script>_<time>_<n>.txt     wall time, top functions, top allocating lines
+# tracemalloc is process-wide, so only one rerun at a time gets allocation
+# figures, and those include every thread that allocated meanwhile.
+# Enable with PROFILE_RERUNS=1 (PROFILE_SAMPLE_RATE, PROFILE_MAX_RUNS and
+# PROFILE_STACK_INTERVAL_MS bound the overhead), or per session from the admin
+# toggle in the sidebar. Merge stacks from many reruns with:
+#   python profiling.py merge profiles/ > reruns.folded
+#   python profiling.py top profiles/app_....prof [cumulative|tottime]
+import os
+import sys
+import time
+import pstats
+import random
+import cProfile
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+PROFILE_RERUNS = os.getenv("PROFILE_RERUNS", "0") == "1"
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 1.0))
+PROFILE_MAX_RUNS = int(os.getenv("PROFILE_MAX_RUNS", 200))
+PROFILE_STACK_INTERVAL = int(os.getenv("PROFILE_STACK_INTERVAL_MS", 5)) / 1000
+PROFILE_MEMORY = os.getenv("PROFILE_MEMORY", "1") == "1"
+ADMIN_USERS = {u.strip() for u in os.getenv("ADMIN_USERS", "").split(",") if u.strip()}
+TOP_FUNCTIONS = 30
+TOP_ALLOCATIONS = 20
+
+_lock = threading.Lock()
+_runs = 0
+_tracing = False
+_started_tracing = False
+
+def _should_profile(force):
+    global _runs
+    with _lock:
+        if _runs >= PROFILE_MAX_RUNS:
+            return False
+        if not force and not (PROFILE_RERUNS and random.random() < PROFILE_SAMPLE_RATE):
+            return False
+        _runs += 1
+        return _runs
+
+def _start_tracing():
+    # -> snapshot, or None while another rerun holds the (process-wide) trace.
+    global _tracing, _started_tracing
+    with _lock:
+        if _tracing:
+            return None
+        _tracing = True
+        # Leave a trace started elsewhere (PYTHONTRACEMALLOC) running afterwards.
+        _started_tracing = not tracemalloc.is_tracing()
+        if _started_tracing:
+            tracemalloc.start(10)
+    return tracemalloc.take_snapshot()
+
+def _stop_tracing():
+    global _tracing, _started_tracing
+    snapshot = tracemalloc.take_snapshot()
+    with _lock:
+        if _started_tracing:
+            tracemalloc.stop()
+        _tracing = _started_tracing = False
+    return snapshot
+
+class StackSampler:
+    # Samples one thread's Python stack every `interval` seconds into folded
+    # "outer;inner count" form. Cheap enough to leave on for a sampled rerun.
+    def __init__(self, thread_id, interval=PROFILE_STACK_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+def _write(stem, wall, profiler, stacks, before, after):
+    profiler.dump_stats(stem + ".prof")
+    with open(stem + ".folded", "w") as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+    with open(stem + ".txt", "w") as f:
+        f.write(f"wall time: {wall * 1000:.1f} ms, stack samples: {sum(stacks.values())}\n\n")
+        stats = pstats.Stats(profiler, stream=f)
+        stats.sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+        if after is not None:
+            f.write("Top allocating lines, process-wide (net bytes while this rerun ran, all threads):\n")
+            for stat in after.compare_to(before, "lineno")[:TOP_ALLOCATIONS]:
+                f.write(f"{stat}\n")
+        elif PROFILE_MEMORY:
+            f.write("Allocations not traced: another rerun held the process-wide trace.\n")
+
+@contextmanager
+def profiled_rerun(script, force=False):
+    run = _should_profile(force)
+    if not run:
+        yield
+        return
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stem = os.path.join(PROFILE_DIR, f"{script}_{time.strftime('%Y%m%d_%H%M%S')}_{run}")
+    before = _start_tracing() if PROFILE_MEMORY else None
+    sampler = StackSampler(threading.get_ident()).start()
+    profiler = cProfile.Profile()
+    started = time.perf_counter()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        # Streamlit's rerun/stop signals end the script early; keep those profiles too.
+        profiler.disable()
+        wall = time.perf_counter() - started
+        stacks = sampler.stop()
+        after = _stop_tracing() if before is not None else None
+        try:
+            _write(stem, wall, profiler, stacks, before, after)
+        except OSError as e:
+            print("Could not write profile:", e)
+
+def profiling_toggle(st, username):
+    # Sidebar switch for admins; returns whether this session's reruns are profiled.
+    if username not in ADMIN_USERS:
+        return False
+    return st.sidebar.toggle("Profile reruns", key="profile_reruns",
+                             help=f"Writes CPU, stack and allocation profiles to {PROFILE_DIR}/")
+
+def merge_folded(directory):
+    totals = Counter()
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".folded"):
+            with open(os.path.join(directory, name)) as f:
+                for line in f:
+                    stack, _, count = line.rstrip("\n").rpartition(" ")
+                    if stack:
+                        totals[stack] += int(count)
+    return totals
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if len(args) >= 2 and args[0] == "merge":
+        for stack, count in merge_folded(args[1]).most_common():
+            print(f"{stack} {count}")
+    elif len(args) >= 2 and args[0] == "top":
+        pstats.Stats(args[1]).sort_stats(args[2] if len(args) > 2 else "cumulative").print_stats(TOP_FUNCTIONS)
+    else:
+        print("usage: python profiling.py merge DIR | top FILE.prof [sort]")
@@ -0,0 +1,36 @@
+# prompts.py
+# Chat prompt shared by the Streamlit app and the batch evaluation mode of
+# cli_groq_chat.py, so benchmark runs see exactly what users see.
+
+def profile_summary(age, gender, conditions, allergies, medications):
+    return (
+        f"This user is {age} years old, gender: {gender}. "
+        f"Medical conditions: {conditions or 'None'}. "
+        f"Allergies: {allergies or 'None'}. "
+        f"Medications: {medications or 'None'}."
+    )
+
+def system_prompt(summary):
+    return {
+        "role": "system",
+        "content": (
+            "You are Curo, a concise, friendly, and careful health assistant. "
+            "When greeted with 'hello', 'hi', or similar, respond politely with: "
+            "'Hello, I'm Curo. How can I assist with your health today?' "
+            "Limit your questions to at most 2 if necessary, and keep replies under 4 sentences. "
+            f"User profile: {summary} "
+            "If asked about non-health topics (like news, stocks, politics, sports, etc), reply that you only answer health queries. "
+            "Always tailor advice to the profile and suggest consulting a professional if needed. "
+            "**Never return HTML, code blocks, or markdown code fences in your response. "
+            "Your reply should be plain, readable text only, no HTML or code formatting.**"
+            "Do not include any div, span, or HTML elements in your output."
+        )
+    }
+
+def chat_messages(summary, history):
+    # history: [(question, answer)] oldest first
+    messages = [system_prompt(summary)]
+    for question, answer in history:
+        messages.append({"role": "user", "content": question})
+        messages.append({"role": "assistant", "content": answer})
+    return messages
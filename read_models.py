@@ -0,0 +1,49 @@
+# read_models.py
+# Column-projected read queries for list views. Rows are small slotted objects
+# carrying ids, ratings and short previews; full answer / prescription text is
+# only read when a row is expanded (full_text).
+from sqlalchemy import func
+from db import ChatFeedback, PrescriptionFeedback, Conversation, PrescriptionAnalysis
+
+TITLE_CHARS = 120
+
+class FeedbackRow:
+    __slots__ = ("id", "kind", "target_id", "feedback", "title", "preview", "created_at", "truncated")
+
+    def __init__(self, id, kind, target_id, feedback, title, preview, created_at):
+        self.id = id
+        self.kind = kind
+        self.target_id = target_id
+        self.feedback = feedback
+        self.title = title
+        self.preview = preview
+        self.created_at = created_at
+        self.truncated = (preview or "").endswith("…") or (kind == "chat" and len(title or "") >= TITLE_CHARS)
+
+def recent_chat_feedback(db, limit=10):
+    rows = (db.query(ChatFeedback.id, ChatFeedback.conversation_id, ChatFeedback.feedback,
+                     func.substr(Conversation.message, 1, TITLE_CHARS), Conversation.response_preview,
+                     ChatFeedback.created_at)
+            .join(Conversation, ChatFeedback.conversation_id == Conversation.id)
+            .order_by(ChatFeedback.id.desc()).limit(limit))
+    return [FeedbackRow(fid, "chat", cid, value, title, preview, created)
+            for fid, cid, value, title, preview, created in rows]
+
+def recent_prescription_feedback(db, limit=10):
+    rows = (db.query(PrescriptionFeedback.id, PrescriptionFeedback.analysis_id, PrescriptionFeedback.feedback,
+                     PrescriptionAnalysis.filename, PrescriptionAnalysis.result_preview,
+                     PrescriptionFeedback.created_at)
+            .join(PrescriptionAnalysis, PrescriptionFeedback.analysis_id == PrescriptionAnalysis.id)
+            .order_by(PrescriptionFeedback.id.desc()).limit(limit))
+    return [FeedbackRow(fid, "prescription", aid, value, title, preview, created)
+            for fid, aid, value, title, preview, created in rows]
+
+FULL_TEXT = {
+    "chat": (Conversation.message, Conversation.response, Conversation.id),
+    "prescription": (PrescriptionAnalysis.filename, PrescriptionAnalysis.result, PrescriptionAnalysis.id),
+}
+
+def full_text(db, kind, target_id):
+    # -> (title, body) with the body decompressed, for one expanded row
+    title, body, key = FULL_TEXT[kind]
+    return db.query(title, body).filter(key == target_id).first()
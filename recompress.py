@@ -0,0 +1,60 @@
+# recompress.py
+# Background job that rewrites plain-text rows of CompressedText columns in
+# compressed form. Rows are read and written in small id-ordered batches:
+#   python recompress.py [--batch 500] [--pause 0.5] [--loop 3600]
+import time
+import argparse
+from sqlalchemy import select, update, type_coerce, Text
+from db import engine, Conversation, PrescriptionAnalysis, compress_text, COMPRESSED_MARKER, COMPRESS_THRESHOLD
+
+TARGETS = [
+    (Conversation, "response"),
+    (PrescriptionAnalysis, "result"),
+]
+
+def recompress_column(model, column_name, batch=500, pause=0.0):
+    column = getattr(model, column_name)
+    # type_coerce bypasses CompressedText so we see and write the stored form.
+    raw = type_coerce(column, Text)
+    last_id, scanned, rewritten, saved = 0, 0, 0, 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(model.id, raw.label("value"))
+                .where(model.id > last_id)
+                .order_by(model.id)
+                .limit(batch)
+            ).fetchall()
+            if not rows:
+                break
+            for row_id, value in rows:
+                scanned += 1
+                if value is None or len(value) < COMPRESS_THRESHOLD or value.startswith(COMPRESSED_MARKER):
+                    continue
+                packed = compress_text(value)
+                if packed == value:
+                    continue
+                conn.execute(update(model).where(model.id == row_id).values({column_name: type_coerce(packed, Text)}))
+                rewritten += 1
+                saved += len(value) - len(packed)
+            last_id = rows[-1][0]
+        if pause:
+            time.sleep(pause)
+    return scanned, rewritten, saved
+
+def recompress_all(batch=500, pause=0.0):
+    for model, column_name in TARGETS:
+        scanned, rewritten, saved = recompress_column(model, column_name, batch, pause)
+        print(f"{model.__tablename__}.{column_name}: scanned {scanned}, compressed {rewritten}, saved {saved / 1024:.1f} KiB")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compress existing large text rows")
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--pause", type=float, default=0.0, help="seconds to sleep between batches")
+    parser.add_argument("--loop", type=int, default=0, help="re-run every N seconds (0 = run once)")
+    args = parser.parse_args()
+    while True:
+        recompress_all(args.batch, args.pause)
+        if not args.loop:
+            break
+        time.sleep(args.loop)
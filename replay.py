@@ -0,0 +1,205 @@
+# replay.py
+# Replays traces captured by traffic.py against this build. Every upstream call
+# is answered by stub_services.py with the recorded response after the recorded
+# latency, so differences in the report come from our own code: prompt building,
+# routing, image preprocessing, merging, drug-store lookups and the async clients.
+#   python replay.py traces/                         # at the captured pace
+#   python replay.py traces/ --speed 20              # arrivals 20x closer together
+#   python replay.py traces/20240501.jsonl.gz --kind chat --limit 500 --json replay.json
+# Chat turns are rebuilt from the masked question, history and profile and go
+# through chat_with_articles. Prescriptions get synthetic pages with the recorded
+# dimensions and format and go through analyze_pages with reuse off; pages the
+# capture served from the near-duplicate index are left out. --speed only
+# compresses the gaps between arrivals (0 sends them back to back). Upstream
+# latency stays as recorded, so stage timings remain comparable while
+# concurrency rises.
+import io
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+from collections import defaultdict, deque, Counter
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+# Stages measured the same way in the app and here; queueing and saving are not replayed.
+REPLAYED_STAGES = {"chat": ("chat",), "prescription": ("prescription", "analysis", "lookup")}
+CHAT_TIMEOUT = 30
+
+class Recordings:
+    # Per trace and service, the recorded replies in call order; the stand-in's responder.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queues = defaultdict(deque)
+        self.misses = Counter()
+        self.header = None
+
+    def load(self, traces, header):
+        self.header = header
+        for trace in traces:
+            for service, status, latency, body in trace["upstream"]:
+                # Client-side failures (timeouts, resets) are stored by exception name.
+                self.queues[(trace["id"], service)].append((status if isinstance(status, int) else 504, body, latency))
+
+    def __call__(self, service, headers, body):
+        with self.lock:
+            queue = self.queues.get((headers.get(self.header), service))
+            reply = queue.popleft() if queue else None
+        if reply is None or (reply[0] == 200 and reply[1] is None):
+            with self.lock:
+                self.misses[service] += 1
+            return None
+        return reply
+
+def synthetic_page(info, seed):
+    # A page with the recorded dimensions and format, noisy enough to land near the recorded size.
+    from PIL import Image, ImageDraw
+    rng = random.Random(seed)
+    width, height = info["width"], info["height"]
+    img = Image.new("L", (width, height), 255)
+    draw = ImageDraw.Draw(img)
+    for y in range(height // 12, height - 20, max(20, height // 30)):
+        draw.text((width // 10 + rng.randint(0, 30), y), "Tab " + "x" * rng.randint(8, 40), fill=0)
+    bits_per_pixel = info["bytes"] * 8 / max(1, width * height)
+    noise = Image.effect_noise((width, height), min(80.0, 12.0 * bits_per_pixel))
+    img = Image.blend(img, noise, min(0.5, 0.15 * bits_per_pixel)).convert("RGB")
+    fmt = info["format"] if info["format"] in ("JPEG", "PNG") else "JPEG"
+    buf = io.BytesIO()
+    img.save(buf, fmt, **({"quality": 90} if fmt == "JPEG" else {}))
+    return buf.getvalue()
+
+def prepare(trace):
+    # Built before the clock starts: synthetic pages for a prescription trace.
+    if trace["kind"] != "prescription":
+        return None
+    reused = set(trace["inputs"].get("reused", []))
+    return [(f"page_{i}.{(info['format'] or 'jpeg').lower()}", synthetic_page(info, f"{trace['id']}:{i}"))
+            for i, info in enumerate(trace["inputs"]["pages"]) if i not in reused and info["width"]]
+
+def replay_one(trace, pages):
+    # -> (replay trace, outcome)
+    import traffic
+    from async_services import run, chat_with_articles
+    from prescription_batch import analyze_pages
+    from prompts import profile_summary, chat_messages
+    inputs = trace["inputs"]
+    replay = traffic.Trace(trace["kind"], trace["user"], dict(inputs), trace_id=trace["id"], replay=True)
+    started = time.perf_counter()
+    try:
+        if trace["kind"] == "chat":
+            p = inputs["profile"]
+            messages = chat_messages(profile_summary(p["age"], p["gender"], p["conditions"], p["allergies"],
+                                                     p["medications"]), [tuple(turn) for turn in inputs["history"]])
+            messages.append({"role": "user", "content": inputs["question"]})
+            run(traffic.bind(replay, chat_with_articles(messages, inputs["question"], inputs["articles"])),
+                timeout=CHAT_TIMEOUT)
+            outcome = "ok"
+        elif pages:
+            outcome = "error" if analyze_pages(pages, force=True, trace=replay)["errors"] else "ok"
+        else:
+            return replay, "skipped"
+    except TimeoutError:
+        return replay, "timeout"
+    except Exception as e:
+        print(f"{trace['id']}: {type(e).__name__}: {e}")
+        return replay, "error"
+    replay.stages[trace["kind"]] = time.perf_counter() - started
+    return replay, outcome
+
+def _delta(before, after):
+    return f"{(after - before) / before * 100:+.0f}%" if before else "-"
+
+def report(results, misses):
+    from loadtest import percentile
+    outcomes = Counter()
+    captured, replayed = defaultdict(list), defaultdict(list)
+    for trace, (replay, outcome) in results:
+        outcomes[(trace["kind"], trace["outcome"], outcome)] += 1
+        for name in REPLAYED_STAGES[trace["kind"]]:
+            if name in trace["stages"] and name in replay.stages:
+                captured[f"{trace['kind']}.{name}"].append(trace["stages"][name])
+                replayed[f"{trace['kind']}.{name}"].append(replay.stages[name])
+        for service, status, latency, _ in trace["upstream"]:
+            captured[f"upstream.{service}"].append(latency)
+        for service, status, latency, _ in replay.upstream:
+            replayed[f"upstream.{service}"].append(latency)
+    print(f"{'kind':<14}{'captured':<12}{'replayed':<12}{'n':>6}")
+    for (kind, before, after), count in sorted(outcomes.items()):
+        print(f"{kind:<14}{before:<12}{after:<12}{count:>6}")
+    print(f"\n{'stage':<24}{'n':>6}{'p50 cap':>10}{'p50 now':>10}{'Δ':>7}{'p95 cap':>10}{'p95 now':>10}{'Δ':>7}")
+    summary = {}
+    for name in sorted(captured):
+        before, after = captured[name], replayed.get(name, [])
+        row = {"n": len(after)}
+        for pct in (50, 95):
+            row[f"p{pct}_captured"] = percentile(before, pct)
+            row[f"p{pct}_replayed"] = percentile(after, pct)
+        summary[name] = row
+        print(f"{name:<24}{len(after):>6}"
+              f"{row['p50_captured'] * 1000:>10.0f}{row['p50_replayed'] * 1000:>10.0f}"
+              f"{_delta(row['p50_captured'], row['p50_replayed']):>7}"
+              f"{row['p95_captured'] * 1000:>10.0f}{row['p95_replayed'] * 1000:>10.0f}"
+              f"{_delta(row['p95_captured'], row['p95_replayed']):>7}")
+    if misses:
+        print(f"\nCalls without a recorded reply (served the canned stand-in reply): {dict(misses)}")
+    return {"outcomes": {"/".join(k): v for k, v in outcomes.items()}, "stages": summary, "misses": dict(misses)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured traffic against local upstream stand-ins")
+    parser.add_argument("paths", nargs="+", help="trace files or directories written by traffic.py")
+    parser.add_argument("--speed", type=float, default=1.0, help="arrival speed-up (1 = captured pace, 0 = no gaps)")
+    parser.add_argument("--kind", choices=sorted(REPLAYED_STAGES), help="replay only chat or prescription traces")
+    parser.add_argument("--limit", type=int, help="replay at most this many traces")
+    parser.add_argument("--concurrency", type=int, default=64, help="traces in flight at most")
+    parser.add_argument("--json", help="write the comparison to this file")
+    args = parser.parse_args()
+    os.chdir(ROOT)
+
+    import stub_services
+    recordings = Recordings()
+    server, base_url = stub_services.start(responder=recordings)
+    # Set before the API clients are imported; they read their URLs once.
+    state_dir = tempfile.mkdtemp(prefix="curo_replay_")
+    os.environ.update(stub_services.paths(base_url))
+    os.environ.update({"GROQ_API_KEY": "stub", "GEMINI_API_KEY": "stub", "TAVILY_API_KEY": "stub",
+                       "ROUTER_STATE_FILE": os.path.join(state_dir, "router_state.json"),
+                       "ROUTER_LOG_FILE": os.path.join(state_dir, "router_log.jsonl"),
+                       "TRAFFIC_CAPTURE": "0"})
+    os.environ.setdefault("DATABASE_URL", "sqlite://")
+    import traffic
+
+    traces = [t for t in traffic.read_traces(args.paths) if not args.kind or t["kind"] == args.kind]
+    traces = sorted(traces, key=lambda t: t["at"])[:args.limit]
+    if not traces:
+        print("No traces to replay.")
+        return 1
+    recordings.load(traces, traffic.TRACE_HEADER)
+    print(f"Preparing {len(traces)} traces...")
+    prepared = {t["id"]: prepare(t) for t in traces}
+
+    span = traces[-1]["at"] - traces[0]["at"]
+    print(f"Replaying {len(traces)} traces captured over {span:.0f}s at {args.speed:g}x")
+    futures = []
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        begin = time.perf_counter()
+        for trace in traces:
+            if args.speed > 0:
+                delay = (trace["at"] - traces[0]["at"]) / args.speed - (time.perf_counter() - begin)
+                if delay > 0:
+                    time.sleep(delay)
+            futures.append((trace, pool.submit(replay_one, trace, prepared[trace["id"]])))
+        results = [(trace, future.result()) for trace, future in futures]
+    print(f"Done in {time.perf_counter() - begin:.1f}s\n")
+    summary = report(results, recordings.misses)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+    server.shutdown()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
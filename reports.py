@@ -0,0 +1,233 @@
+# reports.py
+# Chat and prescription PDFs, cached per session / analysis. The cache holds
+# patient data: it lives in an owner-only (0700) directory under the app and
+# files older than REPORT_CACHE_MAX_AGE_HOURS or beyond REPORT_CACHE_MAX_MB
+# (oldest first) are evicted whenever a new report is written.
+import os
+import re
+import glob
+import hashlib
+import time
+import datetime
+from fpdf import FPDF
+from dotenv import load_dotenv
+from private_files import DATA_DIR, private_dir
+
+load_dotenv()
+REPORT_CACHE_DIR = os.getenv("REPORT_CACHE_DIR", os.path.join(DATA_DIR, "report_cache"))
+REPORT_CACHE_MAX_AGE = float(os.getenv("REPORT_CACHE_MAX_AGE_HOURS", 24)) * 3600
+REPORT_CACHE_MAX_BYTES = int(float(os.getenv("REPORT_CACHE_MAX_MB", 200)) * 1_000_000)
+FOOTER = "Generated by Curo Health Assistant - https://curo-health.streamlit.app"
+
+def clean_assistant_message(text):
+    text = re.sub(r"```[\s\S]*?```", "", text)
+    text = re.sub(r"</?div[^>]*>", "", text)
+    text = re.sub(r"</?span[^>]*>", "", text)
+    text = re.sub(r'class="[^"]*"', "", text)
+    text = text.strip()
+    return text
+
+def _latin1(text):
+    # FPDF's core fonts are latin-1 only; emoji and other symbols would abort the whole report.
+    return str(text).encode("latin1", "replace").decode("latin1")
+
+def _clock(value):
+    return value.strftime('%H:%M:%S') if value else "--:--:--"
+
+def chat_block(chat):
+    ops = [
+        ("fill", 200, 220, 255), ("style", "B"),
+        ("cell", _latin1(f"You ({_clock(chat.get('user_time'))}):")),
+        ("style", ""), ("multi", _latin1(chat['user'])), ("ln", 2),
+        ("fill", 230, 230, 230), ("style", "B"),
+        ("cell", _latin1(f"Curo ({_clock(chat.get('assistant_time'))}):")),
+        ("style", ""), ("multi", _latin1(clean_assistant_message(str(chat['assistant'])))), ("ln", 5),
+    ]
+    if chat.get("articles"):
+        ops += [("style", "I"), ("plain", "Relevant articles mentioned:")]
+        for art in chat["articles"]:
+            ops.append(("link", _latin1(f"- {art['title']}: "), _latin1(art['url'])))
+        ops.append(("ln", 3))
+    return tuple(ops)
+
+def cached_chat_block(chat):
+    # Rendered once per turn and kept with it, so each new report only lays out new text.
+    block = chat.get("pdf_block")
+    if block is None:
+        block = chat_block(chat)
+        chat["pdf_block"] = block
+    return block
+
+def _draw(pdf, ops):
+    for op in ops:
+        kind = op[0]
+        if kind == "fill":
+            pdf.set_fill_color(*op[1:])
+        elif kind == "style":
+            pdf.set_font('', op[1])
+        elif kind == "cell":
+            pdf.cell(0, 5, op[1], 0, 1, fill=True)
+        elif kind == "plain":
+            pdf.cell(0, 5, op[1], 0, 1)
+        elif kind == "multi":
+            pdf.multi_cell(0, 5, op[1], fill=True)
+        elif kind == "ln":
+            pdf.ln(op[1])
+        elif kind == "link":
+            pdf.set_text_color(0, 0, 255)
+            pdf.write(5, op[1])
+            pdf.write(5, op[2], op[2])
+            pdf.ln(5)
+            pdf.set_text_color(0, 0, 0)
+
+def _header(pdf, title, user, detail):
+    pdf.add_page()
+    pdf.set_font("Arial", 'B', 16)
+    pdf.cell(0, 10, title, 0, 1, 'C')
+    pdf.ln(5)
+    pdf.set_font("Arial", size=12)
+    pdf.cell(0, 6, _latin1(f"User: {user.username}"), 0, 1)
+    pdf.cell(0, 6, _latin1(detail), 0, 1)
+    pdf.cell(0, 6, f"Generated on: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", 0, 1)
+    pdf.ln(10)
+    pdf.multi_cell(0, 6, txt=_latin1(profile_summary(user)))
+    pdf.ln(10)
+
+def _footer(pdf):
+    pdf.set_font("Arial", 'I', 8)
+    pdf.cell(0, 5, FOOTER, 0, 0, 'C')
+
+def profile_summary(user):
+    return (
+        f"Age: {user.age}, Gender: {user.gender}\n"
+        f"Medical Conditions: {user.conditions or 'None'}\n"
+        f"Allergies: {user.allergies or 'None'}\n"
+        f"Medications: {user.medications or 'None'}\n"
+    )
+
+def write_chat_pdf(path, session_chats, user, session_id):
+    pdf = FPDF(orientation='P', unit='mm', format='A4')
+    _header(pdf, "Curo Health Assistant - Chat History", user, f"Session ID: {session_id}")
+    pdf.set_font("Arial", 'B', 14)
+    pdf.cell(0, 10, "Conversation", 0, 1)
+    pdf.ln(5)
+    pdf.set_font("Arial", size=10)
+    for chat in session_chats:
+        _draw(pdf, cached_chat_block(chat))
+        pdf.set_font('', '')
+    _footer(pdf)
+    pdf.output(path, 'F')
+    return path
+
+def write_prescription_pdf(path, user, filename, result, med_links, buy_links):
+    pdf = FPDF(orientation='P', unit='mm', format='A4')
+    _header(pdf, "Curo Health Assistant - Prescription Analysis", user, f"Prescription File: {filename}")
+    pdf.set_font("Arial", 'B', 14)
+    pdf.cell(0, 10, "Prescription Summary", 0, 1)
+    pdf.ln(5)
+    pdf.set_font("Arial", size=10)
+    pdf.multi_cell(0, 5, _latin1(result))
+    pdf.ln(10)
+    if med_links:
+        pdf.set_font("Arial", 'B', 14)
+        pdf.cell(0, 10, "Medicine Information", 0, 1)
+        pdf.ln(5)
+        pdf.set_font("Arial", size=10)
+        for med in med_links:
+            pdf.set_font('', 'B')
+            pdf.cell(0, 5, _latin1(med['medicine']), 0, 1)
+            pdf.set_font('', '')
+            pdf.multi_cell(0, 5, _latin1(f"Information: {med['title']}"))
+            _draw(pdf, [("link", "Link: ", _latin1(med['url'])), ("ln", 2)])
+    if buy_links:
+        pdf.set_font("Arial", 'B', 14)
+        pdf.cell(0, 10, "Purchase Options", 0, 1)
+        pdf.ln(5)
+        pdf.set_font("Arial", size=10)
+        for name, url in buy_links.items():
+            pdf.set_font('', 'B')
+            pdf.cell(0, 5, _latin1(name), 0, 1)
+            pdf.set_font('', '')
+            if url:
+                _draw(pdf, [("link", "Buy: ", _latin1(url))])
+            else:
+                pdf.multi_cell(0, 5, "Search online for availability")
+            pdf.ln(2)
+    _footer(pdf)
+    pdf.output(path, 'F')
+    return path
+
+def _profile_key(user):
+    return f"{user.id}|{user.age}|{user.gender}|{user.conditions}|{user.allergies}|{user.medications}"
+
+def _cache_dir():
+    return private_dir(REPORT_CACHE_DIR)
+
+def evict(keep=None, now=None):
+    # Drops reports (and abandoned .part files) past the age limit, then the
+    # oldest ones until the cache fits the size limit; `keep` is about to be served.
+    now = now or time.time()
+    entries = []
+    for entry in os.scandir(_cache_dir()):
+        try:
+            st = entry.stat()
+        except OSError:
+            continue
+        if entry.is_file():
+            entries.append((st.st_mtime, st.st_size, entry.path))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    entries = [e for e in entries if e[2] != keep]
+    for mtime, size, path in entries:
+        if now - mtime <= REPORT_CACHE_MAX_AGE and total <= REPORT_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+
+def _cache_path(prefix, key):
+    _cache_dir()
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(REPORT_CACHE_DIR, f"{prefix}_{digest}.pdf")
+
+def _drop_stale(prefix, keep):
+    for path in glob.glob(os.path.join(REPORT_CACHE_DIR, f"{prefix}_*.pdf")):
+        if path != keep:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def _chat_prefix(session_id):
+    return "chat_" + re.sub(r"[^A-Za-z0-9-]", "", str(session_id))
+
+def chat_pdf_path(user, session_id, version):
+    # Where cached_chat_pdf keeps this version of the report, for checking a served one is current.
+    return _cache_path(_chat_prefix(session_id), f"{session_id}|{version}|{_profile_key(user)}")
+
+def cached_chat_pdf(session_chats, user, session_id, version=None):
+    if version is None:
+        version = len(session_chats)
+    path = chat_pdf_path(user, session_id, version)
+    if not os.path.exists(path):
+        tmp_path = path + ".part"
+        write_chat_pdf(tmp_path, session_chats, user, session_id)
+        os.replace(tmp_path, path)
+        _drop_stale(_chat_prefix(session_id), path)
+        evict(keep=path)
+    return path
+
+def cached_prescription_pdf(user, analysis_id, filename, result, med_links, buy_links):
+    # One report per analysis: regenerating it replaces only that analysis' older copies.
+    prefix = f"presc_{user.id}_{analysis_id}"
+    key = f"{_profile_key(user)}|{filename}|{result}|{med_links}|{sorted(buy_links.items())}"
+    path = _cache_path(prefix, key)
+    if not os.path.exists(path):
+        tmp_path = path + ".part"
+        write_prescription_pdf(tmp_path, user, filename, result, med_links, buy_links)
+        os.replace(tmp_path, path)
+        _drop_stale(prefix, path)
+        evict(keep=path)
+    return path
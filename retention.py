@@ -0,0 +1,327 @@
+# retention.py
+# Data lifecycle for conversations and feedback. Rows older than the retention
+# policy are appended to per-user gzip JSONL archives under ARCHIVE_DIR and then
+# deleted in small batches, so the hot tables and their indexes only hold
+# recent history. A user's archive can be brought back on request. Archives
+# hold full chat text: ARCHIVE_DIR (default data/archive, relative paths are
+# taken from the app directory, not the cwd) and its directories are 0700,
+# the files 0600.
+#   python retention.py                  # archive and delete rows past the policy
+#   python retention.py --dry-run        # count what would be archived
+#   python retention.py --restore 42     # restore user 42's archived history
+#   python retention.py --partition      # MySQL only: partition conversations by month (one-off)
+#   python retention.py --stats          # hot row counts and archive size
+# Cut-offs fall on midnight, so each (day, user) feedback group is archived
+# whole and its rollup stays exact (see rollups.archive_horizon). A conversation
+# is kept while its feedback is still inside the policy.
+import os
+import sys
+import gzip
+import json
+import time
+import datetime
+from collections import defaultdict, Counter
+from sqlalchemy import select, delete, exists, func, text, DateTime
+from dotenv import load_dotenv
+from db import (SessionLocal, engine, Conversation, ChatFeedback, PrescriptionFeedback, SearchDocument,
+                SearchPosting)
+from rollups import set_archive_horizon
+from search import index_conversation
+from private_files import BASE_DIR, DATA_DIR, private_dir, open_private
+
+load_dotenv()
+# Days kept hot; 0 disables archiving for that kind.
+RETENTION_DAYS = {
+    "chat": int(os.getenv("RETENTION_CHAT_DAYS", 365)),
+    "prescription": int(os.getenv("RETENTION_PRESCRIPTION_FEEDBACK_DAYS", 365)),
+}
+ARCHIVE_DIR = os.path.join(BASE_DIR, os.getenv("ARCHIVE_DIR", os.path.join(DATA_DIR, "archive")))
+# Restored users are skipped by later runs for this long.
+RESTORE_HOLD_DAYS = int(os.getenv("RETENTION_RESTORE_HOLD_DAYS", 30))
+BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", 1000))
+BATCH_PAUSE = float(os.getenv("RETENTION_BATCH_PAUSE_SECONDS", 0.2))
+PARTITION_MONTHS_AHEAD = 3
+# Restore order: conversations before the feedback that references them.
+TABLES = {
+    "conversations": Conversation,
+    "chat_feedback": ChatFeedback,
+    "prescription_feedback": PrescriptionFeedback,
+}
+
+def cutoff_for(days, now=None):
+    today = (now or datetime.datetime.now()).date()
+    return datetime.datetime.combine(today - datetime.timedelta(days=days), datetime.time.min)
+
+def _user_dir(user_id):
+    return os.path.join(ARCHIVE_DIR, "users", str(user_id) if user_id is not None else "unowned")
+
+def _private_user_dir(user_id):
+    # makedirs only gives the leaf its mode, so every level is made owner-only.
+    for path in (ARCHIVE_DIR, os.path.join(ARCHIVE_DIR, "users"), _user_dir(user_id)):
+        private_dir(path)
+    return _user_dir(user_id)
+
+def _encode(row):
+    return {k: v.isoformat() if isinstance(v, (datetime.datetime, datetime.date)) else v for k, v in row.items()}
+
+def _decode(model, values):
+    row = {}
+    for column in model.__table__.columns:
+        if column.name in values:
+            value = values[column.name]
+            if value is not None and isinstance(column.type, DateTime):
+                value = datetime.datetime.fromisoformat(value)
+            row[column.key] = value
+    return row
+
+def _append(records):
+    # records: [(user_id, table, when, row)]. Each batch adds one gzip member to
+    # the user's file for that month; concatenated members read back as one stream.
+    groups = defaultdict(list)
+    for user_id, table, when, row in records:
+        month = (when or datetime.datetime.now()).strftime("%Y-%m")
+        groups[(user_id, month)].append(json.dumps({"table": table, "row": _encode(row)}, ensure_ascii=False))
+    for (user_id, month), lines in groups.items():
+        with open_private(os.path.join(_private_user_dir(user_id), f"{month}.jsonl.gz"), "ab") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb") as f:
+                f.write(("\n".join(lines) + "\n").encode("utf-8"))
+            raw.flush()
+            # The rows are deleted right after; the archive must be on disk first.
+            os.fsync(raw.fileno())
+
+def _held_users():
+    root = os.path.join(ARCHIVE_DIR, "users")
+    if not os.path.isdir(root):
+        return set()
+    since = time.time() - RESTORE_HOLD_DAYS * 86400
+    held = set()
+    for name in os.listdir(root):
+        marker = os.path.join(root, name, "restored")
+        if name.isdigit() and os.path.exists(marker) and os.path.getmtime(marker) > since:
+            held.add(int(name))
+    return held
+
+def archive_conversations(db, cutoff, held=(), dry_run=False):
+    conv, fb = Conversation.__table__, ChatFeedback.__table__
+    fresh_feedback = exists().where(fb.c.conversation_id == conv.c.id, fb.c.created_at >= cutoff)
+    counts, last_id = Counter(), 0
+    while True:
+        query = select(conv).where(conv.c.id > last_id, conv.c.timestamp < cutoff, ~fresh_feedback)
+        if held:
+            query = query.where(conv.c.user_id.notin_(held))
+        rows = db.execute(query.order_by(conv.c.id).limit(BATCH_SIZE)).mappings().all()
+        if not rows:
+            break
+        last_id = rows[-1]["id"]
+        ids = [r["id"] for r in rows]
+        owners = {r["id"]: (r["user_id"], r["timestamp"]) for r in rows}
+        feedback = db.execute(select(fb).where(fb.c.conversation_id.in_(ids))).mappings().all()
+        counts["conversations"] += len(rows)
+        counts["chat_feedback"] += len(feedback)
+        if dry_run:
+            continue
+        records = [(r["user_id"], "conversations", r["timestamp"], r) for r in rows]
+        for f in feedback:
+            # Filed with the conversation's owner and month so a restore brings both back.
+            owner, when = owners[f["conversation_id"]]
+            records.append((owner, "chat_feedback", when, f))
+        _append(records)
+        user_ids = {r["user_id"] for r in rows if r["user_id"] is not None}
+        db.execute(delete(fb).where(fb.c.conversation_id.in_(ids)))
+        db.execute(delete(SearchPosting.__table__).where(
+            SearchPosting.user_id.in_(user_ids), SearchPosting.doc_type == "chat", SearchPosting.doc_id.in_(ids)))
+        db.execute(delete(SearchDocument.__table__).where(
+            SearchDocument.doc_type == "chat", SearchDocument.doc_id.in_(ids)))
+        db.execute(delete(conv).where(conv.c.id.in_(ids)))
+        db.commit()
+        time.sleep(BATCH_PAUSE)
+    return counts
+
+def archive_prescription_feedback(db, cutoff, held=(), dry_run=False):
+    pf = PrescriptionFeedback.__table__
+    counts, last_id = Counter(), 0
+    while True:
+        query = select(pf).where(pf.c.id > last_id, pf.c.created_at < cutoff)
+        if held:
+            query = query.where(pf.c.user_id.notin_(held))
+        rows = db.execute(query.order_by(pf.c.id).limit(BATCH_SIZE)).mappings().all()
+        if not rows:
+            break
+        last_id = rows[-1]["id"]
+        counts["prescription_feedback"] += len(rows)
+        if dry_run:
+            continue
+        _append([(r["user_id"], "prescription_feedback", r["created_at"], r) for r in rows])
+        db.execute(delete(pf).where(pf.c.id.in_([r["id"] for r in rows])))
+        db.commit()
+        time.sleep(BATCH_PAUSE)
+    return counts
+
+def _add_months(day, months):
+    year, month = divmod(day.month - 1 + months, 12)
+    return datetime.date(day.year + year, month + 1, 1)
+
+def _partition_defs(start, end):
+    defs, month = [], start
+    while month < end:
+        following = _add_months(month, 1)
+        defs.append(f"PARTITION p{month:%Y%m} VALUES LESS THAN (TO_DAYS('{following:%Y-%m-%d}'))")
+        month = following
+    return defs
+
+def partitions(conn):
+    return [name for (name,) in conn.execute(text(
+        "SELECT PARTITION_NAME FROM information_schema.PARTITIONS WHERE TABLE_SCHEMA = DATABASE() "
+        "AND TABLE_NAME = 'conversations' AND PARTITION_NAME IS NOT NULL ORDER BY PARTITION_ORDINAL_POSITION"))]
+
+def partition_conversations():
+    # Monthly RANGE partitions on conversations.timestamp. InnoDB partitioned
+    # tables cannot take part in foreign keys, so the keys to and from
+    # conversations are dropped (the ORM still knows the relationships), and
+    # the primary key becomes (id, timestamp). The feedback tables stay
+    # unpartitioned: their unique (user, target) keys cannot include a date.
+    if engine.dialect.name != "mysql":
+        print(f"Partitioning is only supported on MySQL, not {engine.dialect.name}; retention uses batched deletes.")
+        return []
+    with engine.begin() as conn:
+        if not partitions(conn):
+            foreign_keys = conn.execute(text(
+                "SELECT TABLE_NAME, CONSTRAINT_NAME FROM information_schema.REFERENTIAL_CONSTRAINTS "
+                "WHERE CONSTRAINT_SCHEMA = DATABASE() "
+                "AND (TABLE_NAME = 'conversations' OR REFERENCED_TABLE_NAME = 'conversations')")).fetchall()
+            for table, name in foreign_keys:
+                conn.execute(text(f"ALTER TABLE {table} DROP FOREIGN KEY {name}"))
+            conn.execute(text("UPDATE conversations SET timestamp = :t WHERE timestamp IS NULL"),
+                         {"t": datetime.datetime.now()})
+            oldest = conn.execute(text("SELECT MIN(timestamp) FROM conversations")).scalar() or datetime.datetime.now()
+            this_month = datetime.date.today().replace(day=1)
+            defs = _partition_defs(oldest.date().replace(day=1), _add_months(this_month, PARTITION_MONTHS_AHEAD + 1))
+            conn.execute(text("ALTER TABLE conversations MODIFY timestamp DATETIME NOT NULL, "
+                              "DROP PRIMARY KEY, ADD PRIMARY KEY (id, timestamp)"))
+            conn.execute(text("ALTER TABLE conversations PARTITION BY RANGE (TO_DAYS(timestamp)) ("
+                              + ", ".join(defs + ["PARTITION pmax VALUES LESS THAN MAXVALUE"]) + ")"))
+        ensure_partitions(conn)
+        return partitions(conn)
+
+def ensure_partitions(conn):
+    # Split pmax so there are always PARTITION_MONTHS_AHEAD empty months ready.
+    months = [name for name in partitions(conn) if name != "pmax"]
+    if not months:
+        return
+    after_last = _add_months(datetime.datetime.strptime(months[-1][1:], "%Y%m").date(), 1)
+    defs = _partition_defs(after_last, _add_months(datetime.date.today().replace(day=1), PARTITION_MONTHS_AHEAD + 1))
+    if defs:
+        conn.execute(text("ALTER TABLE conversations REORGANIZE PARTITION pmax INTO ("
+                          + ", ".join(defs + ["PARTITION pmax VALUES LESS THAN MAXVALUE"]) + ")"))
+
+def drop_empty_partitions(conn, cutoff):
+    # After archiving, whole months below the cutoff are usually empty; dropping
+    # them gives the space back at once instead of leaving fragmented pages.
+    # Months still holding kept rows (recent feedback, restored users) stay.
+    dropped = []
+    for name in partitions(conn):
+        if name == "pmax":
+            continue
+        upper = _add_months(datetime.datetime.strptime(name[1:], "%Y%m").date(), 1)
+        if upper > cutoff.date():
+            break
+        if conn.execute(text(f"SELECT 1 FROM conversations PARTITION ({name}) LIMIT 1")).first() is None:
+            conn.execute(text(f"ALTER TABLE conversations DROP PARTITION {name}"))
+            dropped.append(name)
+    return dropped
+
+def run(dry_run=False, now=None):
+    held = _held_users()
+    counts = Counter()
+    chat_cutoff = cutoff_for(RETENTION_DAYS["chat"], now) if RETENTION_DAYS["chat"] > 0 else None
+    presc_cutoff = cutoff_for(RETENTION_DAYS["prescription"], now) if RETENTION_DAYS["prescription"] > 0 else None
+    db = SessionLocal()
+    try:
+        if not dry_run:
+            # Freeze rollups below the cut-offs before any raw row goes away.
+            if chat_cutoff:
+                set_archive_horizon(db, "chat", chat_cutoff)
+            if presc_cutoff:
+                set_archive_horizon(db, "prescription", presc_cutoff)
+            db.commit()
+        if chat_cutoff:
+            counts.update(archive_conversations(db, chat_cutoff, held, dry_run))
+        if presc_cutoff:
+            counts.update(archive_prescription_feedback(db, presc_cutoff, held, dry_run))
+    finally:
+        db.close()
+    if chat_cutoff and not dry_run and engine.dialect.name == "mysql":
+        with engine.begin() as conn:
+            if partitions(conn):
+                counts["dropped_partitions"] = len(drop_empty_partitions(conn, chat_cutoff))
+                ensure_partitions(conn)
+    return dict(counts)
+
+def archived_files(user_id):
+    directory = _user_dir(user_id)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, n) for n in os.listdir(directory) if n.endswith(".jsonl.gz"))
+
+def has_archive(user_id):
+    return bool(archived_files(user_id))
+
+def restore_user(user_id, batch=500):
+    # Rows that are already back (or were never removed) are left untouched;
+    # a row archived more than once restores from its latest copy.
+    latest = {table: {} for table in TABLES}
+    for path in archived_files(user_id):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    item = json.loads(line)
+                    latest[item["table"]][item["row"]["id"]] = item["row"]
+    restored = Counter()
+    db = SessionLocal()
+    try:
+        for table, model in TABLES.items():
+            rows = list(latest[table].values())
+            for i in range(0, len(rows), batch):
+                chunk = rows[i:i + batch]
+                present = set(db.scalars(select(model.id).where(model.id.in_([r["id"] for r in chunk]))))
+                added = [model(**_decode(model, r)) for r in chunk if r["id"] not in present]
+                db.add_all(added)
+                db.flush()
+                if model is Conversation:
+                    for conversation in added:
+                        index_conversation(db, conversation)
+                db.commit()
+                restored[table] += len(added)
+    finally:
+        db.close()
+    with open_private(os.path.join(_private_user_dir(user_id), "restored"), "w") as f:
+        f.write(datetime.datetime.now().isoformat())
+    return dict(restored)
+
+def stats():
+    db = SessionLocal()
+    try:
+        hot = {table: db.scalar(select(func.count()).select_from(model.__table__)) for table, model in TABLES.items()}
+        oldest = db.scalar(select(func.min(Conversation.timestamp)))
+    finally:
+        db.close()
+    root = os.path.join(ARCHIVE_DIR, "users")
+    users = os.listdir(root) if os.path.isdir(root) else []
+    size = sum(os.path.getsize(p) for u in users for p in [os.path.join(root, u, n) for n in os.listdir(os.path.join(root, u))])
+    return {"hot_rows": hot, "oldest_conversation": oldest, "archived_users": len(users), "archive_bytes": size}
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if "--restore" in args:
+        user_id = int(args[args.index("--restore") + 1])
+        print(f"Restored user {user_id}:", restore_user(user_id))
+    elif "--partition" in args:
+        print("conversations partitions:", partition_conversations())
+    elif "--stats" in args:
+        for key, value in stats().items():
+            print(f"{key}: {value}")
+    else:
+        dry_run = "--dry-run" in args
+        started = time.perf_counter()
+        result = run(dry_run=dry_run)
+        print(("Would archive" if dry_run else "Archived") + f": {result} in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,183 @@
+# rollups.py
+# Per-day, per-kind, per-user feedback aggregates for the dashboards.
+# Feedback rows are scanned from an (updated_at, id) high-water mark; every
+# (day, user) group they touch is recomputed from the raw table, so repeat
+# clicks that flip an existing rating are picked up too.
+#   python rollups.py              # incremental refresh
+#   python rollups.py --loop 60    # refresh every minute
+#   python rollups.py --rebuild    # drop and recompute everything
+#   python rollups.py --check      # compare rollups with raw tables
+# Days before a kind's archive horizon (see retention.py) have had their raw
+# rows archived; their rollups are kept as they were and never recomputed.
+import os
+import sys
+import time
+import datetime
+import threading
+from collections import defaultdict
+from sqlalchemy import func, or_, and_
+from dotenv import load_dotenv
+from db import SessionLocal, ChatFeedback, PrescriptionFeedback, FeedbackRollup, RollupState, upsert
+
+load_dotenv()
+ROLLUP_INTERVAL = int(os.getenv("ROLLUP_INTERVAL_SECONDS", 60))
+# Rows younger than this may still belong to open transactions with earlier timestamps.
+SAFETY_LAG = datetime.timedelta(seconds=int(os.getenv("ROLLUP_SAFETY_LAG_SECONDS", 2)))
+BATCH_SIZE = 5000
+EPOCH = datetime.datetime(1970, 1, 1)
+KINDS = {
+    "chat": ChatFeedback,
+    "prescription": PrescriptionFeedback,
+}
+
+_refresh_lock = threading.Lock()
+_refresher = None
+
+def _state(db, kind):
+    state = db.get(RollupState, f"feedback_{kind}")
+    if state is None:
+        state = RollupState(name=f"feedback_{kind}", high_water_time=EPOCH, high_water_id=0)
+        db.add(state)
+    return state
+
+def archive_horizon(db, kind):
+    state = db.get(RollupState, f"retention_{kind}")
+    return state.high_water_time if state else None
+
+def set_archive_horizon(db, kind, horizon):
+    # Only ever moves forward: restoring rows does not make their days live again.
+    state = db.get(RollupState, f"retention_{kind}")
+    if state is None:
+        db.add(RollupState(name=f"retention_{kind}", high_water_time=horizon, high_water_id=0))
+    elif state.high_water_time is None or horizon > state.high_water_time:
+        state.high_water_time = horizon
+
+def aggregate_groups(db, model, keys):
+    # keys: {day: {user_id, ...}} -> {(day, user_id): (total, positive)}
+    result = {}
+    for day, user_ids in keys.items():
+        start = datetime.datetime.combine(day, datetime.time.min)
+        rows = (db.query(model.user_id, func.count(model.id), func.sum(model.feedback))
+                .filter(model.created_at >= start, model.created_at < start + datetime.timedelta(days=1),
+                        model.user_id.in_(user_ids))
+                .group_by(model.user_id).all())
+        for user_id in user_ids:
+            result[(day, user_id)] = (0, 0)
+        for user_id, total, positive in rows:
+            result[(day, user_id)] = (int(total), int(positive or 0))
+    return result
+
+def _write_groups(db, kind, groups):
+    rows = [{"day": day, "kind": kind, "user_id": user_id, "total": total, "positive": positive}
+            for (day, user_id), (total, positive) in groups.items() if total]
+    empty = [(day, user_id) for (day, user_id), (total, _) in groups.items() if not total]
+    for day, user_id in empty:
+        db.query(FeedbackRollup).filter_by(day=day, kind=kind, user_id=user_id).delete()
+    for i in range(0, len(rows), 500):
+        upsert(db, FeedbackRollup, rows[i:i + 500], ["day", "kind", "user_id"], ["total", "positive"])
+
+def refresh_kind(db, kind, model):
+    state = _state(db, kind)
+    cutoff = datetime.datetime.now() - SAFETY_LAG
+    horizon = archive_horizon(db, kind)
+    changed = 0
+    while True:
+        rows = (db.query(model.id, model.user_id, model.created_at, model.updated_at)
+                .filter(or_(model.updated_at > state.high_water_time,
+                            and_(model.updated_at == state.high_water_time, model.id > state.high_water_id)),
+                        model.updated_at <= cutoff)
+                .order_by(model.updated_at, model.id)
+                .limit(BATCH_SIZE).all())
+        if not rows:
+            break
+        keys = defaultdict(set)
+        for _, user_id, created_at, _ in rows:
+            if user_id is not None and (horizon is None or created_at >= horizon):
+                keys[created_at.date()].add(user_id)
+        _write_groups(db, kind, aggregate_groups(db, model, keys))
+        state.high_water_time, state.high_water_id = rows[-1].updated_at, rows[-1].id
+        db.commit()
+        changed += len(rows)
+    return changed
+
+def refresh():
+    with _refresh_lock:
+        db = SessionLocal()
+        try:
+            return {kind: refresh_kind(db, kind, model) for kind, model in KINDS.items()}
+        finally:
+            db.close()
+
+def rebuild():
+    with _refresh_lock:
+        db = SessionLocal()
+        try:
+            for kind in KINDS:
+                horizon = archive_horizon(db, kind)
+                stale = db.query(FeedbackRollup).filter(FeedbackRollup.kind == kind)
+                if horizon is not None:
+                    stale = stale.filter(FeedbackRollup.day >= horizon.date())
+                stale.delete()
+            db.query(RollupState).filter(RollupState.name.in_([f"feedback_{k}" for k in KINDS])).delete()
+            db.commit()
+        finally:
+            db.close()
+    return refresh()
+
+def _refresh_loop(interval):
+    while True:
+        try:
+            refresh()
+        except Exception as e:
+            print("Rollup refresh failed:", e)
+        time.sleep(interval)
+
+def start_background_refresh(interval=ROLLUP_INTERVAL):
+    global _refresher
+    if _refresher is None or not _refresher.is_alive():
+        _refresher = threading.Thread(target=_refresh_loop, args=(interval,), daemon=True)
+        _refresher.start()
+
+def totals(db, kind=None):
+    query = db.query(FeedbackRollup.kind, func.sum(FeedbackRollup.total), func.sum(FeedbackRollup.positive))
+    if kind:
+        query = query.filter(FeedbackRollup.kind == kind)
+    return {k: (int(t or 0), int(p or 0)) for k, t, p in query.group_by(FeedbackRollup.kind)}
+
+def check():
+    # Brings rollups up to date first; rows written during the check can show up as transient mismatches.
+    refresh()
+    db = SessionLocal()
+    mismatches = []
+    try:
+        for kind, model in KINDS.items():
+            horizon = archive_horizon(db, kind) or EPOCH
+            raw = {uid: (int(t), int(p or 0)) for uid, t, p in
+                   db.query(model.user_id, func.count(model.id), func.sum(model.feedback))
+                   .filter(model.user_id.isnot(None), model.created_at >= horizon)
+                   .group_by(model.user_id)}
+            rolled = {uid: (int(t), int(p or 0)) for uid, t, p in
+                      db.query(FeedbackRollup.user_id, func.sum(FeedbackRollup.total), func.sum(FeedbackRollup.positive))
+                      .filter(FeedbackRollup.kind == kind, FeedbackRollup.day >= horizon.date())
+                      .group_by(FeedbackRollup.user_id)}
+            for uid in set(raw) | set(rolled):
+                if raw.get(uid, (0, 0)) != rolled.get(uid, (0, 0)):
+                    mismatches.append((kind, uid, raw.get(uid, (0, 0)), rolled.get(uid, (0, 0))))
+    finally:
+        db.close()
+    return mismatches
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if "--rebuild" in args:
+        print("Rebuilt rollups:", rebuild())
+    elif "--check" in args:
+        problems = check()
+        for kind, uid, raw, rolled in problems:
+            print(f"❌ {kind} user {uid}: raw (total, positive) {raw} vs rollup {rolled}")
+        print("✅ Rollups match raw tables" if not problems else f"{len(problems)} mismatches")
+        sys.exit(1 if problems else 0)
+    elif "--loop" in args:
+        _refresh_loop(int(args[args.index("--loop") + 1]) if len(args) > args.index("--loop") + 1 else ROLLUP_INTERVAL)
+    else:
+        print("Refreshed rollups:", refresh())
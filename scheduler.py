@@ -0,0 +1,286 @@
+# scheduler.py
+# Per-user fair scheduling of chat (Groq) and prescription (Gemini) work inside
+# one app process. Every user has their own queue; workers dispatch the queued
+# job with the smallest weighted-fair-queueing finish tag among users that are
+# under their concurrency cap and have a rate token, so one user sending
+# rapid-fire work cannot starve everyone else. Queue depth and wait times are
+# available from metrics() and, with SCHEDULER_METRICS_PORT set, in Prometheus
+# text format at http://127.0.0.1:<port>/metrics:
+#   SCHEDULER_METRICS_PORT=9108 streamlit run app.py
+#   curl http://127.0.0.1:9108/metrics
+# SCHED_USER_WEIGHTS=alice:2,batch_bot:0.5 gives users a larger or smaller share.
+import os
+import time
+import itertools
+import threading
+from collections import defaultdict, deque, Counter
+from concurrent.futures import Future, wait
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from dotenv import load_dotenv
+
+load_dotenv()
+ENGINES = {
+    "chat": {
+        "workers": int(os.getenv("SCHED_CHAT_WORKERS", 8)),
+        "user_concurrency": int(os.getenv("SCHED_CHAT_USER_CONCURRENCY", 1)),
+        "user_rate_per_min": float(os.getenv("SCHED_CHAT_USER_RATE", 20)),
+        "burst": 3,
+        "max_queued_per_user": 5,
+    },
+    "prescription": {
+        "workers": int(os.getenv("SCHED_PRESCRIPTION_WORKERS", 3)),
+        "user_concurrency": int(os.getenv("SCHED_PRESCRIPTION_USER_CONCURRENCY", 1)),
+        "user_rate_per_min": float(os.getenv("SCHED_PRESCRIPTION_USER_RATE", 6)),
+        "burst": 2,
+        "max_queued_per_user": 3,
+    },
+}
+USER_WEIGHTS = {name.strip(): float(weight) for name, _, weight in
+                (item.partition(":") for item in os.getenv("SCHED_USER_WEIGHTS", "").split(",")) if weight}
+SCHEDULER_METRICS_PORT = int(os.getenv("SCHEDULER_METRICS_PORT", 0))
+WAIT_SAMPLES = 500
+COUNTERS = ("submitted", "completed", "failed", "rejected", "cancelled")
+
+class QueueFull(Exception):
+    pass
+
+class Ticket:
+    __slots__ = ("scheduler", "user", "fn", "cost", "start_tag", "finish_tag", "seq",
+                 "enqueued", "started", "future")
+
+    def __init__(self, scheduler, user, fn, cost, start_tag, finish_tag, seq):
+        self.scheduler = scheduler
+        self.user = user
+        self.fn = fn
+        self.cost = cost
+        self.start_tag = start_tag
+        self.finish_tag = finish_tag
+        self.seq = seq
+        self.enqueued = time.monotonic()
+        self.started = None
+        self.future = Future()
+
+    def position(self):
+        # 1-based place in dispatch order among queued jobs; 0 once running.
+        return self.scheduler.position(self)
+
+    def waited(self):
+        return (self.started or time.monotonic()) - self.enqueued
+
+    def done(self):
+        return self.future.done()
+
+    def result(self, timeout=None):
+        return self.future.result(timeout)
+
+class FairScheduler:
+    def __init__(self, name, workers, user_concurrency, user_rate_per_min, burst, max_queued_per_user):
+        self.name = name
+        self.user_concurrency = user_concurrency
+        self.rate = user_rate_per_min / 60.0
+        self.burst = burst
+        self.max_queued_per_user = max_queued_per_user
+        self.cond = threading.Condition()
+        self.queues = defaultdict(deque)
+        self.running = defaultdict(int)
+        self.last_finish = defaultdict(float)
+        self.buckets = {}
+        self.virtual_time = 0.0
+        self.seq = itertools.count()
+        self.waits = deque(maxlen=WAIT_SAMPLES)
+        self.counters = Counter()
+        for i in range(workers):
+            threading.Thread(target=self._worker, name=f"{name}-scheduler-{i}", daemon=True).start()
+
+    def submit(self, user, fn, cost=1, weight=1):
+        with self.cond:
+            if len(self.queues[user]) >= self.max_queued_per_user:
+                self.counters["rejected"] += 1
+                raise QueueFull(f"{len(self.queues[user])} {self.name} requests already queued")
+            start = max(self.virtual_time, self.last_finish[user])
+            finish = start + cost / max(weight, 0.01)
+            self.last_finish[user] = finish
+            ticket = Ticket(self, user, fn, cost, start, finish, next(self.seq))
+            self.queues[user].append(ticket)
+            self.counters["submitted"] += 1
+            self.cond.notify()
+        return ticket
+
+    def cancel(self, ticket):
+        # Drops a job that has not started (e.g. its page was rerun); False once running.
+        with self.cond:
+            queue = self.queues.get(ticket.user)
+            if ticket.started is not None or queue is None or ticket not in queue:
+                return False
+            queue.remove(ticket)
+            if not queue:
+                del self.queues[ticket.user]
+            ticket.future.cancel()
+            self.counters["cancelled"] += 1
+            self._prune(time.monotonic())
+            return True
+
+    def _prune(self, now):
+        # An idle user whose bucket has refilled needs no state: a fresh bucket
+        # and a start tag of virtual_time are what they would get anyway.
+        for user in set(self.buckets) | set(self.last_finish):
+            if user in self.queues or user in self.running:
+                continue
+            tokens, last = self.buckets.get(user, (self.burst, now))
+            if tokens + (now - last) * self.rate >= self.burst:
+                self.buckets.pop(user, None)
+                self.last_finish.pop(user, None)
+
+    def position(self, ticket):
+        with self.cond:
+            if ticket.started is not None:
+                return 0
+            key = (ticket.finish_tag, ticket.seq)
+            return 1 + sum(1 for q in self.queues.values() for t in q if (t.finish_tag, t.seq) < key)
+
+    def _token_wait(self, user, now):
+        tokens, last = self.buckets.get(user, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        self.buckets[user] = (tokens, now)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def _next_job(self, now):
+        best, wake = None, None
+        for user, queue in self.queues.items():
+            if not queue or self.running[user] >= self.user_concurrency:
+                continue
+            wait = self._token_wait(user, now)
+            if wait > 0:
+                wake = wait if wake is None else min(wake, wait)
+                continue
+            head = queue[0]
+            if best is None or (head.finish_tag, head.seq) < (best.finish_tag, best.seq):
+                best = head
+        return best, wake
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                while True:
+                    ticket, wake = self._next_job(time.monotonic())
+                    if ticket is not None:
+                        break
+                    self.cond.wait(timeout=wake)
+                queue = self.queues[ticket.user]
+                queue.popleft()
+                if not queue:
+                    del self.queues[ticket.user]
+                tokens, last = self.buckets[ticket.user]
+                self.buckets[ticket.user] = (tokens - 1, last)
+                self.running[ticket.user] += 1
+                self.virtual_time = max(self.virtual_time, ticket.start_tag)
+                ticket.started = time.monotonic()
+                self.waits.append(ticket.started - ticket.enqueued)
+            try:
+                ticket.future.set_result(ticket.fn())
+                outcome = "completed"
+            except BaseException as e:
+                ticket.future.set_exception(e)
+                outcome = "failed"
+            with self.cond:
+                self.running[ticket.user] -= 1
+                if not self.running[ticket.user]:
+                    del self.running[ticket.user]
+                self.counters[outcome] += 1
+                self._prune(time.monotonic())
+                self.cond.notify_all()
+
+    def metrics(self):
+        with self.cond:
+            waits = sorted(self.waits)
+            depth = {user: len(q) for user, q in self.queues.items()}
+            return {
+                "queued": sum(depth.values()),
+                "queued_users": len(depth),
+                "max_user_depth": max(depth.values(), default=0),
+                "running": sum(self.running.values()),
+                "wait_p50": waits[len(waits) // 2] if waits else 0.0,
+                "wait_p95": waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0,
+                "wait_max": waits[-1] if waits else 0.0,
+                **{k: self.counters[k] for k in COUNTERS},
+            }
+
+_schedulers = {}
+_lock = threading.Lock()
+_metrics_server = None
+_collectors = {}
+
+def get_scheduler(engine):
+    with _lock:
+        if engine not in _schedulers:
+            _schedulers[engine] = FairScheduler(engine, **ENGINES[engine])
+            _start_metrics_server()
+        return _schedulers[engine]
+
+def register_collector(name, fn):
+    # fn() -> Prometheus text lines, served on /metrics after the scheduler's own.
+    _collectors[name] = fn
+
+def start_metrics_server():
+    # Serves /metrics before the first job is scheduled (no-op without SCHEDULER_METRICS_PORT).
+    with _lock:
+        _start_metrics_server()
+
+def user_weight(username):
+    return USER_WEIGHTS.get(username, 1.0)
+
+def wait_for(ticket, on_wait=None, poll=0.5):
+    # Blocks until the job finishes, calling on_wait(ticket) while it is queued.
+    while not ticket.done():
+        if on_wait and ticket.started is None:
+            on_wait(ticket)
+        wait([ticket.future], timeout=poll)
+    return ticket.result()
+
+def metrics():
+    with _lock:
+        schedulers = dict(_schedulers)
+    return {name: s.metrics() for name, s in schedulers.items()}
+
+def prometheus_text():
+    # One TYPE line per metric, then one sample per engine.
+    samples = defaultdict(list)
+    for engine, values in metrics().items():
+        for key, value in values.items():
+            name = f"curo_scheduler_{key}_total" if key in COUNTERS else f"curo_scheduler_{key}"
+            samples[name].append(f'{name}{{engine="{engine}"}} {value}')
+    lines = []
+    for name, rows in samples.items():
+        lines.append(f"# TYPE {name} {'counter' if name.endswith('_total') else 'gauge'}")
+        lines.extend(rows)
+    for name, fn in list(_collectors.items()):
+        try:
+            lines.extend(fn())
+        except Exception as e:
+            print(f"Metrics collector {name} failed:", e)
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        data = prometheus_text().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+def _start_metrics_server():
+    global _metrics_server
+    if SCHEDULER_METRICS_PORT and _metrics_server is None:
+        try:
+            _metrics_server = ThreadingHTTPServer(("127.0.0.1", SCHEDULER_METRICS_PORT), _MetricsHandler)
+        except OSError as e:
+            print("Scheduler metrics server not started:", e)
+            return
+        threading.Thread(target=_metrics_server.serve_forever, daemon=True).start()
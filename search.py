@@ -0,0 +1,120 @@
+# search.py
+# Per-user inverted index over chat turns and prescription analyses, ranked
+# with BM25. Postings are keyed (user_id, term, ...) so a query only touches
+# the querying user's rows for the query terms. Rebuild with:
+#   python search.py --reindex
+import re
+import sys
+import math
+from collections import Counter
+from sqlalchemy import func
+from db import SessionLocal, session_scope, SearchDocument, SearchPosting, Conversation, PrescriptionAnalysis
+
+PAGE_SIZE = 10
+BM25_K1 = 1.2
+BM25_B = 0.75
+MAX_TERM_LENGTH = 64
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "can", "do", "for", "from", "has", "have",
+    "how", "i", "if", "in", "is", "it", "its", "me", "my", "of", "on", "or", "should", "so", "that",
+    "the", "their", "there", "this", "to", "was", "what", "when", "which", "will", "with", "you", "your",
+}
+
+def _stem(word):
+    for suffix in ("ing", "ies", "es", "ed", "s"):
+        if len(word) > len(suffix) + 3 and word.endswith(suffix):
+            return word[:-len(suffix)] + ("y" if suffix == "ies" else "")
+    return word
+
+def tokenize(text):
+    words = re.findall(r"[a-z0-9]+", (text or "").lower())
+    return [_stem(w)[:MAX_TERM_LENGTH] for w in words if w not in STOPWORDS and len(w) > 1]
+
+def index_document(db, user_id, doc_type, doc_id, text):
+    terms = Counter(tokenize(text))
+    db.query(SearchPosting).filter_by(user_id=user_id, doc_type=doc_type, doc_id=doc_id).delete()
+    db.merge(SearchDocument(doc_type=doc_type, doc_id=doc_id, user_id=user_id, length=sum(terms.values())))
+    db.add_all([
+        SearchPosting(user_id=user_id, term=term, doc_type=doc_type, doc_id=doc_id, tf=tf)
+        for term, tf in terms.items()
+    ])
+
+def index_conversation(db, conversation):
+    index_document(db, conversation.user_id, "chat", conversation.id,
+                   f"{conversation.message or ''} {conversation.response or ''}")
+
+def index_prescription(db, analysis):
+    index_document(db, analysis.user_id, "prescription", analysis.id,
+                   f"{analysis.filename or ''} {analysis.result or ''}")
+
+def _rank(db, user_id, terms):
+    n_docs, avg_len = db.query(func.count(), func.avg(SearchDocument.length)).filter(SearchDocument.user_id == user_id).one()
+    if not n_docs:
+        return []
+    avg_len = float(avg_len or 1)
+    postings = (db.query(SearchPosting.term, SearchPosting.doc_type, SearchPosting.doc_id, SearchPosting.tf, SearchDocument.length)
+                .join(SearchDocument, (SearchDocument.doc_type == SearchPosting.doc_type) & (SearchDocument.doc_id == SearchPosting.doc_id))
+                .filter(SearchPosting.user_id == user_id, SearchPosting.term.in_(terms))
+                .all())
+    df = Counter(p.term for p in postings)
+    scores = Counter()
+    for p in postings:
+        idf = math.log(1 + (n_docs - df[p.term] + 0.5) / (df[p.term] + 0.5))
+        norm = p.tf + BM25_K1 * (1 - BM25_B + BM25_B * p.length / avg_len)
+        scores[(p.doc_type, p.doc_id)] += idf * p.tf * (BM25_K1 + 1) / norm
+    return sorted(scores.items(), key=lambda kv: (-kv[1], -kv[0][1]))
+
+def _snippet(text, terms, width=220):
+    text = text or ""
+    lowered = text.lower()
+    positions = [lowered.find(t) for t in terms if lowered.find(t) >= 0]
+    start = max(0, min(positions) - 60) if positions else 0
+    snippet = text[start:start + width]
+    return ("…" if start else "") + snippet + ("…" if start + width < len(text) else "")
+
+def search_history(user_id, query, page=0, page_size=PAGE_SIZE):
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not terms:
+        return [], 0
+    with session_scope(read=True) as db:
+        ranked = _rank(db, user_id, terms)
+        page_hits = ranked[page * page_size:(page + 1) * page_size]
+        chat_ids = [doc_id for (doc_type, doc_id), _ in page_hits if doc_type == "chat"]
+        presc_ids = [doc_id for (doc_type, doc_id), _ in page_hits if doc_type == "prescription"]
+        chats = {c.id: c for c in db.query(Conversation).filter(Conversation.id.in_(chat_ids))} if chat_ids else {}
+        prescs = {p.id: p for p in db.query(PrescriptionAnalysis).filter(PrescriptionAnalysis.id.in_(presc_ids))} if presc_ids else {}
+        results = []
+        for (doc_type, doc_id), score in page_hits:
+            if doc_type == "chat" and doc_id in chats:
+                c = chats[doc_id]
+                results.append({"type": "chat", "id": doc_id, "score": score, "when": c.timestamp,
+                                "title": c.message, "snippet": _snippet(c.response, terms)})
+            elif doc_type == "prescription" and doc_id in prescs:
+                p = prescs[doc_id]
+                results.append({"type": "prescription", "id": doc_id, "score": score, "when": p.created_at,
+                                "title": p.filename, "snippet": _snippet(p.result, terms)})
+        return results, len(ranked)
+
+def reindex_all(batch=500):
+    db = SessionLocal()
+    try:
+        for model, indexer in ((Conversation, index_conversation), (PrescriptionAnalysis, index_prescription)):
+            last_id, count = 0, 0
+            while True:
+                rows = db.query(model).filter(model.id > last_id).order_by(model.id).limit(batch).all()
+                if not rows:
+                    break
+                for row in rows:
+                    if row.user_id is not None:
+                        indexer(db, row)
+                        count += 1
+                db.commit()
+                db.expunge_all()
+                last_id = rows[-1].id
+            print(f"Indexed {count} {model.__tablename__} rows")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    if "--reindex" in sys.argv[1:]:
+        reindex_all()
@@ -0,0 +1,284 @@
+# session_store.py
+# Server-side storage for chat turns. Only the last WINDOW turns of the most
+# recently used MAX_SESSIONS sessions stay in RAM; older turns are spilled to
+# a backing tier (JSONL files on disk, or the session_turns table). Spill files
+# hold chat text: they live in an owner-only directory under data/ and expire
+# after SESSION_SPILL_TTL_SECONDS of inactivity.
+import os
+import re
+import json
+import datetime
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from db import SessionLocal, SessionTurn
+from private_files import DATA_DIR, private_dir, open_private
+
+load_dotenv()
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")
+SESSION_WINDOW = int(os.getenv("SESSION_WINDOW", 20))
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", 500))
+SESSION_SPILL_DIR = os.getenv("SESSION_SPILL_DIR", os.path.join(DATA_DIR, "sessions"))
+SESSION_SPILL_TTL = int(os.getenv("SESSION_SPILL_TTL_SECONDS", 86400))
+SESSION_SPILL_CLEANUP_SECONDS = int(os.getenv("SESSION_SPILL_CLEANUP_SECONDS", 3600))
+TIME_FIELDS = ("user_time", "assistant_time")
+
+def _dump_turn(turn):
+    data = {k: v for k, v in turn.items() if k != "pdf_block"}
+    for field in TIME_FIELDS:
+        if isinstance(data.get(field), datetime.datetime):
+            data[field] = data[field].isoformat()
+    return json.dumps(data)
+
+def _load_turn(line):
+    turn = json.loads(line)
+    for field in TIME_FIELDS:
+        if turn.get(field):
+            turn[field] = datetime.datetime.fromisoformat(turn[field])
+    return turn
+
+class WindowedSessionStore:
+    # self._lock only guards the LRU of sessions; each session's own lock guards
+    # its window and its backing-tier I/O, so one session's disk or DB access
+    # never holds up another session's rerun.
+    def __init__(self, window=SESSION_WINDOW, max_sessions=SESSION_MAX_SESSIONS):
+        self.window = window
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        # Evicted entries until their turns are spilled; a rerun arriving meanwhile takes the entry back.
+        self._evicting = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, session_id):
+        with self._lock:
+            entry = self._sessions.get(session_id) or self._evicting.get(session_id)
+            if entry is None:
+                entry = {"lock": threading.Lock(), "spilled": None, "recent": []}
+            self._sessions[session_id] = entry
+            self._sessions.move_to_end(session_id)
+            evicted = []
+            while len(self._sessions) > self.max_sessions:
+                old_id, old = self._sessions.popitem(last=False)
+                self._evicting[old_id] = old
+                evicted.append((old_id, old))
+        for old_id, old in evicted:
+            self._spill_entry(old_id, old)
+        return entry
+
+    @contextmanager
+    def _locked(self, session_id):
+        # The session's entry, locked and with its spilled count known. An entry
+        # evicted and replaced before its lock was taken is stale: retry.
+        while True:
+            entry = self._entry(session_id)
+            with entry["lock"]:
+                with self._lock:
+                    current = entry is self._sessions.get(session_id) or entry is self._evicting.get(session_id)
+                if current:
+                    if entry["spilled"] is None:
+                        entry["spilled"] = self._backing_count(session_id)
+                    yield entry
+                    return
+
+    def _spill_entry(self, session_id, entry):
+        with entry["lock"]:
+            if entry["recent"] and entry["spilled"] is not None:
+                self._spill(session_id, entry["spilled"], entry["recent"])
+                entry["spilled"] += len(entry["recent"])
+                entry["recent"] = []
+        with self._lock:
+            if self._evicting.get(session_id) is entry:
+                del self._evicting[session_id]
+
+    def append(self, session_id, turn):
+        with self._locked(session_id) as entry:
+            entry["recent"].append(turn)
+            if len(entry["recent"]) > self.window:
+                overflow = entry["recent"][:-self.window]
+                self._spill(session_id, entry["spilled"], overflow)
+                entry["spilled"] += len(overflow)
+                entry["recent"] = entry["recent"][-self.window:]
+            return entry["spilled"] + len(entry["recent"]) - 1
+
+    def count(self, session_id):
+        with self._locked(session_id) as entry:
+            return entry["spilled"] + len(entry["recent"])
+
+    def turns(self, session_id, start=0, stop=None):
+        with self._locked(session_id) as entry:
+            total = entry["spilled"] + len(entry["recent"])
+            stop = total if stop is None else min(stop, total)
+            start = max(0, start)
+            result = []
+            if start < entry["spilled"]:
+                result.extend(self._backing_read(session_id, start, min(stop, entry["spilled"])))
+            offset = entry["spilled"]
+            result.extend(entry["recent"][max(0, start - offset):max(0, stop - offset)])
+            return result
+
+    def iter_turns(self, session_id, chunk=200):
+        total = self.count(session_id)
+        for start in range(0, total, chunk):
+            yield from self.turns(session_id, start, start + chunk)
+
+    def update(self, session_id, index, **fields):
+        with self._locked(session_id) as entry:
+            if index >= entry["spilled"]:
+                entry["recent"][index - entry["spilled"]].update(fields)
+
+    def clear(self, session_id):
+        with self._lock:
+            entries = self._sessions.pop(session_id, None), self._evicting.pop(session_id, None)
+        entry = entries[0] or entries[1]
+        if entry is None:
+            self._backing_clear(session_id)
+            return
+        with entry["lock"]:
+            entry["recent"] = []
+            self._backing_clear(session_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sessions_in_memory": len(self._sessions),
+                "turns_in_memory": sum(len(e["recent"]) for e in self._sessions.values()),
+            }
+
+class DiskSessionStore(WindowedSessionStore):
+    # One owner-only JSONL file per session, with the byte offset of every line
+    # kept for recently used sessions so a page is read with one seek.
+    def __init__(self, spill_dir=SESSION_SPILL_DIR, **kwargs):
+        super().__init__(**kwargs)
+        self.spill_dir = private_dir(spill_dir)
+        self._offsets = OrderedDict()
+        self._offsets_lock = threading.Lock()
+        self._remove_expired()
+        threading.Thread(target=self._cleanup_loop, name="session-spill-cleanup", daemon=True).start()
+
+    def _remove_expired(self):
+        cutoff = time.time() - SESSION_SPILL_TTL
+        for name in os.listdir(self.spill_dir):
+            path = os.path.join(self.spill_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _cleanup_loop(self):
+        while True:
+            time.sleep(SESSION_SPILL_CLEANUP_SECONDS)
+            try:
+                self._remove_expired()
+            except Exception as e:
+                print("Session spill cleanup failed:", e)
+
+    def _path(self, session_id):
+        return os.path.join(self.spill_dir, re.sub(r"[^A-Za-z0-9_-]", "_", str(session_id)) + ".jsonl")
+
+    def _index(self, session_id):
+        # Called under the session's lock, so only the dict itself needs _offsets_lock.
+        with self._offsets_lock:
+            offsets = self._offsets.get(session_id)
+            if offsets is not None:
+                self._offsets.move_to_end(session_id)
+                return offsets
+        offsets, pos = [], 0
+        try:
+            with open(self._path(session_id), "rb") as f:
+                for line in f:
+                    offsets.append(pos)
+                    pos += len(line)
+        except FileNotFoundError:
+            pass
+        with self._offsets_lock:
+            self._offsets[session_id] = offsets
+            while len(self._offsets) > self.max_sessions:
+                self._offsets.popitem(last=False)
+        return offsets
+
+    def _backing_count(self, session_id):
+        return len(self._index(session_id))
+
+    def _spill(self, session_id, start_index, turns):
+        offsets = self._index(session_id)
+        with open_private(self._path(session_id), "ab") as f:
+            pos = f.seek(0, os.SEEK_END)
+            for turn in turns:
+                line = (_dump_turn(turn) + "\n").encode("utf-8")
+                f.write(line)
+                offsets.append(pos)
+                pos += len(line)
+
+    def _backing_read(self, session_id, start, stop):
+        offsets = self._index(session_id)
+        if start >= len(offsets):
+            return []
+        result = []
+        try:
+            with open(self._path(session_id), "rb") as f:
+                f.seek(offsets[start])
+                for _ in range(start, min(stop, len(offsets))):
+                    result.append(_load_turn(f.readline()))
+        except FileNotFoundError:
+            # Expired by the TTL cleanup while the session was idle.
+            pass
+        return result
+
+    def _backing_clear(self, session_id):
+        with self._offsets_lock:
+            self._offsets.pop(session_id, None)
+        try:
+            os.remove(self._path(session_id))
+        except FileNotFoundError:
+            pass
+
+class DBSessionStore(WindowedSessionStore):
+    def _backing_count(self, session_id):
+        db = SessionLocal()
+        try:
+            return db.query(SessionTurn).filter_by(session_id=session_id).count()
+        finally:
+            db.close()
+
+    def _spill(self, session_id, start_index, turns):
+        db = SessionLocal()
+        try:
+            db.add_all([
+                SessionTurn(session_id=session_id, turn_index=start_index + i, payload=_dump_turn(turn))
+                for i, turn in enumerate(turns)
+            ])
+            db.commit()
+        finally:
+            db.close()
+
+    def _backing_read(self, session_id, start, stop):
+        db = SessionLocal()
+        try:
+            rows = (db.query(SessionTurn.payload)
+                    .filter(SessionTurn.session_id == session_id,
+                            SessionTurn.turn_index >= start, SessionTurn.turn_index < stop)
+                    .order_by(SessionTurn.turn_index).all())
+            return [_load_turn(payload) for (payload,) in rows]
+        finally:
+            db.close()
+
+    def _backing_clear(self, session_id):
+        db = SessionLocal()
+        try:
+            db.query(SessionTurn).filter_by(session_id=session_id).delete()
+            db.commit()
+        finally:
+            db.close()
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = DBSessionStore() if SESSION_STORE == "db" else DiskSessionStore()
+        return _store
@@ -0,0 +1,112 @@
+# stub_services.py
+# Local stand-ins for the Groq, Gemini and Tavily APIs, for load tests and
+# offline runs. Responses have the same shape as the real services, with a
+# configurable latency and error rate:
+#   python stub_services.py --port 8765 --latency-ms 800 --error-rate 0.02
+# then point the app at it:
+#   GROQ_API_URL=http://127.0.0.1:8765/groq/chat/completions
+#   GEMINI_API_URL=http://127.0.0.1:8765/gemini/generateContent
+#   TAVILY_API_URL=http://127.0.0.1:8765/tavily/search
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+CHAT_REPLY = ("Ibuprofen is generally safe to take with food for short periods. "
+              "Stay hydrated and rest. If the pain lasts more than three days, please consult a doctor.")
+PRESCRIPTION_REPLY = {
+    "medicines": [
+        {"medicine": "Paracetamol", "dosage": "650 mg", "frequency": "Every 6 hours as needed", "notes": "After food"},
+        {"medicine": "Amoxicillin", "dosage": "500 mg", "frequency": "Three times a day", "notes": "Complete the course"},
+        {"medicine": "Pantoprazole", "dosage": "40 mg", "frequency": "Once daily", "notes": "Before breakfast"},
+    ],
+    "doctor_comments": "Review after five days.",
+    "summary": "A short course of antibiotics with a painkiller and an antacid.",
+}
+ARTICLES = [
+    {"title": f"Health article {i}", "url": f"https://example.org/health/{i}", "content": ""} for i in range(5)
+]
+
+def paths(base_url):
+    return {
+        "GROQ_API_URL": f"{base_url}/groq/chat/completions",
+        "GEMINI_API_URL": f"{base_url}/gemini/generateContent",
+        "TAVILY_API_URL": f"{base_url}/tavily/search",
+    }
+
+def _response(path, body):
+    if path.startswith("/groq"):
+        prompt_tokens = sum(len(m.get("content", "").split()) for m in body.get("messages", []))
+        return {
+            "choices": [{"message": {"role": "assistant", "content": CHAT_REPLY}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(CHAT_REPLY.split())},
+        }
+    if path.startswith("/gemini"):
+        return {"candidates": [{"content": {"parts": [{"text": json.dumps(PRESCRIPTION_REPLY)}]}}]}
+    if path.startswith("/tavily"):
+        return {"results": ARTICLES[:body.get("num_results", 5)]}
+    return None
+
+def make_handler(latency, error_rate, stats, responder=None):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            path = self.path.split("?")[0]
+            service = path.strip("/").split("/")[0]
+            # responder(service, headers, body) -> (status, payload, delay seconds), or None for the canned reply
+            reply = responder(service, self.headers, body) if responder else None
+            if reply is not None:
+                status, payload, delay = reply
+                time.sleep(delay)
+            else:
+                time.sleep(random.uniform(0.5, 1.5) * latency.get(service, 0))
+                payload = _response(path, body)
+                status = 503 if payload is not None and random.random() < error_rate else 200
+            with stats["lock"]:
+                stats[service] = stats.get(service, 0) + 1
+            if payload is None and status == 200:
+                self.send_error(404)
+                return
+            if status != 200:
+                self.send_error(status, "stub overload" if reply is None else "recorded failure")
+                return
+            data = json.dumps(payload).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+def start(port=0, latency_ms=None, error_rate=0.0, responder=None):
+    # latency_ms: {"groq": ms, "gemini": ms, "tavily": ms}; mean per-request delay
+    # responder: serves recorded replies instead (replay.py)
+    latency = {k: v / 1000 for k, v in (latency_ms or {}).items()}
+    stats = {"lock": threading.Lock()}
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(latency, error_rate, stats, responder))
+    server.daemon_threads = True
+    server.stats = stats
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-ins for the Groq, Gemini and Tavily APIs")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=int, default=0, help="mean delay for every service")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    server, base_url = start(args.port, dict.fromkeys(("groq", "gemini", "tavily"), args.latency_ms), args.error_rate)
+    for name, url in paths(base_url).items():
+        print(f"{name}={url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
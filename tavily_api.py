@@ -1,23 +1,40 @@
 import os, requests
 from dotenv import load_dotenv
+from drug_store import get_drug, has_reference
 
 load_dotenv()
 TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
-TAVILY_API_URL = "https://api.tavily.com/search"
+TAVILY_API_URL = os.getenv("TAVILY_API_URL", "https://api.tavily.com/search")
+PHARMACY_DOMAINS = ["1mg.com", "pharmeasy", "netmeds"]
 
-def get_health_articles(query):
-    headers = {
+def tavily_headers():
+    return {
         "Authorization": f"Bearer {TAVILY_API_KEY}",
         "Content-Type": "application/json"
     }
-    payload = {
+
+def search_payload(query, num_results):
+    return {
         "query": query,
-        "num_results": 5,
+        "num_results": num_results,
         "search_depth": "basic",
         "include_answer": False,
         "include_images": False
     }
-    response = requests.post(TAVILY_API_URL, headers=headers, json=payload, timeout=10)
+
+def medicine_query(name):
+    return f"medical uses, dosage, and side effects of {name}"
+
+def pick_buy_link(info):
+    # info: medicine link dicts for one medicine; prefer a pharmacy page.
+    for item in info:
+        url = item.get("url", "")
+        if any(domain in url for domain in PHARMACY_DOMAINS):
+            return url
+    return info[0]["url"]
+
+def get_health_articles(query):
+    response = requests.post(TAVILY_API_URL, headers=tavily_headers(), json=search_payload(query, 5), timeout=10)
     if response.status_code == 200:
         res = response.json()
         return [{
@@ -28,20 +45,14 @@ def get_health_articles(query):
 
 def get_medicine_links(medicine_names):
     results = []
-    headers = {
-        "Authorization": f"Bearer {TAVILY_API_KEY}",
-        "Content-Type": "application/json"
-    }
     for name in medicine_names:
-        payload = {
-            "query": f"medical uses, dosage, and side effects of {name}",
-            "num_results": 1,
-            "search_depth": "basic",
-            "include_answer": False,
-            "include_images": False
-        }
+        drug = get_drug(name)
+        if has_reference(drug):
+            results.append({"medicine": name, "title": drug["description"], "url": drug["reference_url"]})
+            continue
         try:
-            response = requests.post(TAVILY_API_URL, headers=headers, json=payload, timeout=6)
+            response = requests.post(TAVILY_API_URL, headers=tavily_headers(),
+                                     json=search_payload(medicine_query(name), 1), timeout=6)
             if response.status_code == 200:
                 res = response.json()
                 results.extend([{
@@ -52,3 +63,18 @@ def get_medicine_links(medicine_names):
         except Exception:
             pass
     return results
+
+def get_buy_links(medicine_names):
+    links = {}
+    for name in medicine_names:
+        drug = get_drug(name)
+        if drug and drug["pharmacy_links"]:
+            links[name] = next(iter(drug["pharmacy_links"].values()))
+            continue
+        try:
+            info = get_medicine_links([name])
+            if info:
+                links[name] = pick_buy_link(info)
+        except Exception:
+            links[name] = ""
+    return links
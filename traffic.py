@@ -0,0 +1,302 @@
+# traffic.py
+# Opt-in capture of real chat turns and prescription analyses, for replay.py.
+# A trace keeps what a replay needs to rebuild the request and nothing that
+# identifies the user:
+#   inputs    chat: question, recent history and profile with every word swapped
+#             for a keyed pseudo-word of the same length (terms the router and
+#             the refusal check look for are kept); prescription: size, pixel
+#             dimensions and format of each page, never the image itself
+#   stages    seconds spent on context loading, queueing, the scheduled work,
+#             saving, ... and the total
+#   upstream  every Groq / Gemini / Tavily call in order: service, status,
+#             latency and the response body masked the same way (medicine names
+#             and link domains are kept: they decide drug-store hits and buy links)
+# Traces are buffered and appended every TRAFFIC_FLUSH_SECONDS as one gzip member
+# to <TRAFFIC_DIR>/<yyyymmdd>.jsonl.gz, one JSON object per line. Enable with
+# TRAFFIC_CAPTURE=1 (TRAFFIC_SAMPLE_RATE and TRAFFIC_MAX_TRACES bound the volume):
+#   python traffic.py stats traces/
+import io
+import os
+import re
+import sys
+import gzip
+import hmac
+import json
+import time
+import uuid
+import atexit
+import random
+import hashlib
+import datetime
+import threading
+import contextvars
+from urllib.parse import urlsplit
+from collections import defaultdict
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from model_router import COMPLEX_TERMS
+from cli_groq_chat import IRRELEVANT_TOPICS
+
+load_dotenv()
+TRAFFIC_CAPTURE = os.getenv("TRAFFIC_CAPTURE", "0") == "1"
+TRAFFIC_DIR = os.getenv("TRAFFIC_DIR", "traces")
+TRAFFIC_SAMPLE_RATE = float(os.getenv("TRAFFIC_SAMPLE_RATE", 1.0))
+TRAFFIC_MAX_TRACES = int(os.getenv("TRAFFIC_MAX_TRACES", 10000))
+TRAFFIC_FLUSH_SECONDS = float(os.getenv("TRAFFIC_FLUSH_SECONDS", 10))
+# Without SECRET_KEY the pseudo-words only stay consistent within one process.
+MASK_KEY = (os.getenv("SECRET_KEY") or uuid.uuid4().hex).encode()
+# Sent to the replay stand-in only; captured production calls never carry it.
+TRACE_HEADER = "X-Curo-Trace"
+FORMAT_VERSION = 1
+
+_KEEP = re.compile("|".join(re.escape(t) for t in sorted(set(COMPLEX_TERMS) | set(IRRELEVANT_TOPICS),
+                                                        key=len, reverse=True)), re.I)
+_WORD = re.compile(r"[^\W_]+")
+_current = contextvars.ContextVar("traffic_trace", default=None)
+_lock = threading.Lock()
+_buffer = []
+_captured = 0
+_writer = None
+
+def _pseudo_word(word):
+    digest = hmac.new(MASK_KEY, word.lower().encode(), hashlib.sha256).digest()
+    while len(digest) < len(word):
+        digest += hashlib.sha256(digest).digest()
+    out = []
+    for ch, b in zip(word, digest):
+        if ch.isdigit():
+            out.append(str(b % 10))
+        else:
+            c = chr(97 + b % 26)
+            out.append(c.upper() if ch.isupper() else c)
+    return "".join(out)
+
+def mask(text):
+    # Same length, spacing and punctuation; only the routing vocabulary survives verbatim.
+    if not text:
+        return text
+    out, pos = [], 0
+    for m in _KEEP.finditer(text):
+        out.append(_WORD.sub(lambda w: _pseudo_word(w.group()), text[pos:m.start()]))
+        out.append(m.group())
+        pos = m.end()
+    out.append(_WORD.sub(lambda w: _pseudo_word(w.group()), text[pos:]))
+    return "".join(out)
+
+def mask_url(url):
+    parts = urlsplit(url or "")
+    return f"{parts.scheme}://{parts.netloc}{mask(parts.path)}" if parts.netloc else mask(url)
+
+def _mask_prescription(text):
+    try:
+        data = json.loads(text)
+    except (TypeError, ValueError):
+        return mask(text)
+    if not isinstance(data, dict):
+        return mask(text)
+    masked = {k: mask(v) if isinstance(v, str) else v for k, v in data.items() if k != "medicines"}
+    masked["medicines"] = [{k: v if k == "medicine" else mask(v) if isinstance(v, str) else v
+                            for k, v in med.items()} if isinstance(med, dict) else med
+                           for med in data.get("medicines") or []]
+    return json.dumps(masked)
+
+def sanitize_response(service, status, content):
+    # -> a body the replay stand-in can serve as is; None for failed calls.
+    if status != 200 or not content:
+        return None
+    try:
+        body = json.loads(content)
+        if service == "groq":
+            return {"choices": [{"message": {"role": "assistant",
+                                             "content": mask(body["choices"][0]["message"]["content"])},
+                                 "finish_reason": "stop"}],
+                    "usage": body.get("usage") or {}}
+        if service == "gemini":
+            text = body["candidates"][0]["content"]["parts"][0]["text"]
+            return {"candidates": [{"content": {"parts": [{"text": _mask_prescription(text)}]}}]}
+        if service == "tavily":
+            return {"results": [{"title": mask(r.get("title", "")), "url": mask_url(r.get("url", "")), "content": ""}
+                                for r in body.get("results", [])]}
+    except (ValueError, KeyError, IndexError, TypeError):
+        pass
+    return None
+
+class Trace:
+    __slots__ = ("id", "kind", "user", "at", "started", "inputs", "stages", "upstream", "replay")
+
+    def __init__(self, kind, user, inputs, trace_id=None, replay=False):
+        self.id = trace_id or uuid.uuid4().hex[:16]
+        self.kind = kind
+        self.user = user
+        self.at = time.time()
+        self.started = time.perf_counter()
+        self.inputs = inputs
+        self.stages = {}
+        # [service, status, latency, masked body]
+        self.upstream = []
+        self.replay = replay
+
+    def as_dict(self, outcome):
+        return {"v": FORMAT_VERSION, "id": self.id, "kind": self.kind, "user": self.user, "at": round(self.at, 3),
+                "outcome": outcome, "inputs": self.inputs,
+                "stages": {k: round(v, 4) for k, v in self.stages.items()}, "upstream": self.upstream}
+
+def _sampled():
+    global _captured
+    if not TRAFFIC_CAPTURE:
+        return False
+    with _lock:
+        if _captured >= TRAFFIC_MAX_TRACES or random.random() >= TRAFFIC_SAMPLE_RATE:
+            return False
+        _captured += 1
+        return True
+
+def _user(user_id):
+    return hmac.new(MASK_KEY, str(user_id).encode(), hashlib.sha256).hexdigest()[:16]
+
+def _profile(user):
+    return {
+        # Decade only; the prompt needs a number of the same width.
+        "age": user.age // 10 * 10 if user.age is not None else None,
+        "gender": user.gender,
+        "conditions": mask(user.conditions),
+        "allergies": mask(user.allergies),
+        "medications": mask(user.medications),
+    }
+
+def start_chat(user_id, question, history, user, articles, context_seconds=0.0):
+    # history: Conversation rows oldest first, as loaded for the prompt
+    if not _sampled():
+        return None
+    trace = Trace("chat", _user(user_id), {
+        "question": mask(question),
+        "history": [(mask(c.message), mask(c.response)) for c in history],
+        "profile": _profile(user),
+        "articles": bool(articles),
+    })
+    trace.stages["context"] = context_seconds
+    return trace
+
+def _image_info(data):
+    from PIL import Image
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            return {"bytes": len(data), "width": img.width, "height": img.height, "format": img.format}
+    except Exception:
+        return {"bytes": len(data), "width": None, "height": None, "format": None}
+
+def start_prescription(user_id, pages, force=False):
+    # pages: [(filename, bytes)]; filenames are dropped
+    if not _sampled():
+        return None
+    return Trace("prescription", _user(user_id), {"pages": [_image_info(data) for _, data in pages],
+                                                  "force": bool(force)})
+
+def add_stage(trace, name, seconds):
+    if trace is not None:
+        trace.stages[name] = trace.stages.get(name, 0.0) + seconds
+
+@contextmanager
+def stage(trace, name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage(trace, name, time.perf_counter() - started)
+
+async def _bound(trace, coro):
+    # Tasks copy the context they are created in, so calls made by gathered
+    # children of coro are recorded too.
+    _current.set(trace)
+    return await coro
+
+def bind(trace, coro):
+    # Makes trace the current one for coro, which runs on the async_services loop.
+    return coro if trace is None else _bound(trace, coro)
+
+def request_headers(headers):
+    trace = _current.get()
+    return {**headers, TRACE_HEADER: trace.id} if trace is not None and trace.replay else headers
+
+def upstream(service, status, latency, content=None):
+    trace = _current.get()
+    if trace is None:
+        return
+    body = None if trace.replay else sanitize_response(service, status, content)
+    trace.upstream.append([service, status, round(latency, 4), body])
+
+def finish(trace, outcome="ok"):
+    global _writer
+    if trace is None or trace.replay:
+        return
+    trace.stages["total"] = time.perf_counter() - trace.started
+    line = json.dumps(trace.as_dict(outcome), separators=(",", ":"))
+    with _lock:
+        _buffer.append(line)
+        if _writer is None:
+            _writer = threading.Thread(target=_flush_loop, name="traffic-writer", daemon=True)
+            _writer.start()
+            atexit.register(flush)
+
+def flush():
+    with _lock:
+        lines = _buffer[:]
+        del _buffer[:]
+    if not lines:
+        return
+    os.makedirs(TRAFFIC_DIR, exist_ok=True)
+    path = os.path.join(TRAFFIC_DIR, f"{datetime.date.today():%Y%m%d}.jsonl.gz")
+    # One write of a complete gzip member: appends from several app processes never interleave mid-member.
+    data = gzip.compress(("\n".join(lines) + "\n").encode("utf-8"))
+    with open(path, "ab") as f:
+        f.write(data)
+
+def _flush_loop():
+    while True:
+        time.sleep(TRAFFIC_FLUSH_SECONDS)
+        try:
+            flush()
+        except Exception as e:
+            print("Traffic capture flush failed:", e)
+
+def trace_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith(".jsonl.gz"))
+        else:
+            files.append(path)
+    return files
+
+def read_traces(paths):
+    for path in trace_files(paths):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+def _stats(paths):
+    from loadtest import percentile
+    stages, calls, outcomes = defaultdict(list), defaultdict(list), defaultdict(int)
+    for trace in read_traces(paths):
+        outcomes[(trace["kind"], trace["outcome"])] += 1
+        for name, seconds in trace["stages"].items():
+            stages[(trace["kind"], name)].append(seconds)
+        for service, status, latency, _ in trace["upstream"]:
+            calls[(service, status)].append(latency)
+    for (kind, outcome), count in sorted(outcomes.items()):
+        print(f"{kind:<14}{outcome:<12}{count:>8}")
+    print(f"\n{'stage':<28}{'n':>8}{'p50 ms':>10}{'p95 ms':>10}")
+    for (kind, name), values in sorted(stages.items()):
+        print(f"{kind + '.' + name:<28}{len(values):>8}{percentile(values, 50) * 1000:>10.0f}"
+              f"{percentile(values, 95) * 1000:>10.0f}")
+    print(f"\n{'upstream':<28}{'n':>8}{'p50 ms':>10}{'p95 ms':>10}")
+    for (service, status), values in sorted(calls.items(), key=lambda kv: (kv[0][0], str(kv[0][1]))):
+        print(f"{f'{service} {status}':<28}{len(values):>8}{percentile(values, 50) * 1000:>10.0f}"
+              f"{percentile(values, 95) * 1000:>10.0f}")
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != "stats":
+        print("usage: python traffic.py stats <trace dir or files>...")
+        sys.exit(1)
+    _stats(sys.argv[2:])